@@ -5,15 +5,25 @@ import datetime
 from dateutil.relativedelta import relativedelta
 import os
 import csv
+from multiprocessing import Pool, shared_memory
 
+import numpy as np
+import pandas as pd
+
+from scripts import exit_engine
+from scripts import price_store
+from scripts import rs_matrix
 from scripts import rs_ranking
-from scripts.rs_ranking import find_closest_date
+from scripts import trading_calendar
 
 DIR = os.path.dirname(os.path.realpath(__file__))
+TRADES_FILE = os.path.join(os.path.dirname(DIR), 'screen_results', 'screen_results copy.csv')
+# Stop-loss / stop-gain cells handed to a sweep worker at a time
+SWEEP_CHUNK = 20
 
 
 def calculate_sma(prices, window):
-    close_prices = [candle['close'] for candle in prices['candles']]
+    close_prices = price_store.column(prices, 'close').tolist()
     if len(close_prices) < window:
         return None
     return sum(close_prices[-window:]) / window
@@ -34,89 +44,86 @@ def screen_stocks(PRICE_DATA):
     current_date = s2025
     end_date = today
 
-    # last_ts and timestamp make sure we only process each friday once
-    last_ts = None
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        timestamp = find_closest_date(PRICE_DATA, date_str)
-        if timestamp != last_ts:
-            filtered_price_date, date = rs_ranking.main(PRICE_DATA, timestamp)
-            # back_test(PRICE_DATA)
-            last_ts = timestamp
-
-        current_date += relativedelta(days=1)
-
-
-import datetime
-
-
-def check_stop_loss(start_timestamp, candles_dict, stop_loss, stop_gain):
-    MA_PERIOD = 50  # Period for moving average calculation
-    buy_timestamp = -1
-    purchase_price = -1
-    max_close = -1
-    min_close = -1
-    close_prices = []
-
-    sorted_timestamps = sorted(candles_dict.keys(),
-                               key=lambda ts: datetime.datetime.fromtimestamp(int(ts)))
-
-    if not sorted_timestamps:
-        return -1, -1, 0, "Error"
+    matrix = rs_matrix.load_or_build(PRICE_DATA)
+    calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA)
 
-    for ts in sorted_timestamps:
-        current_close = candles_dict[ts]["close"]
+    # Each trading day between the two dates is processed once
+    for timestamp in calendar.days_between_dates(current_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")):
+        filtered_price_date, date = rs_ranking.main(PRICE_DATA, timestamp, rs_matrix=matrix)
+        # back_test(PRICE_DATA)
 
-        close_prices.append(current_close)
-        if len(close_prices) > MA_PERIOD:
-            close_prices.pop(0)
 
-        ts_int = int(ts)
-        if ts_int < start_timestamp:
+def trade_entries(PRICE_DATA, rows):
+    """Keeps the rows that can be traded and pairs each with its ticker and the index of its entry candle, the
+    first candle on or after the screening date."""
+    traded, entries = [], []
+    for row in rows:
+        if row["Ticker"] not in PRICE_DATA:
+            print(f"Skipping {row['Ticker']}, not in the price data")
             continue
-
-        # Initial purchase
-        if purchase_price == -1:
-            buy_timestamp = ts_int
-            purchase_price = current_close
-            max_close = current_close
-            min_close = current_close
+        start_timestamp = int(datetime.datetime.strptime(row["Date"], "%Y-%m-%d").timestamp())
+        entry = int(np.searchsorted(price_store.column(PRICE_DATA[row["Ticker"]], "datetime"), start_timestamp))
+        if entry == len(PRICE_DATA[row["Ticker"]]["candles"]):
+            print(f"Skipping {row['Ticker']} on {row['Date']}, no candle on or after the screening date")
             continue
+        traded.append(row)
+        entries.append((row["Ticker"], entry))
+    return traded, entries
 
-        if ts_int < start_timestamp:
-            continue
 
-        profit = (current_close - purchase_price) / purchase_price
+def stop_rules(stop_loss, stop_gain):
+    # Take profit first, it wins when both fire on the same candle
+    return [exit_engine.TakeProfit(stop_gain), exit_engine.TrailingStop(stop_loss)]
 
-        min_close = min(min_close, current_close)
-        if profit > stop_gain / 100:
-            min_profit = (min_close - purchase_price) / purchase_price
-            return buy_timestamp, ts_int, profit, f"{stop_gain} gain, min: {min_profit * 100:.2f}%"
 
-        # Update trailing stop loss: update max_close and check if current close dropped 7% below max
-        max_close = max(max_close, current_close)
-        if current_close < max_close * (1 - stop_loss / 100):
-            max_profit = (max_close - purchase_price) / purchase_price
-            return buy_timestamp, ts_int, profit, f"{stop_loss} loss, max: {max_profit * 100:.2f}%"
+def simulate_trades(PRICE_DATA, rows, stop_loss=9.0, stop_gain=0.0):
+    """Fills the sell date, profit, holding duration and sell reason of every row of ``rows`` that can be traded.
 
-        # ma_value = sum(close_prices) / MA_PERIOD
-        # if current_close < ma_value:
-        #     max_profit = (max_close - purchase_price) / purchase_price
-        #     return buy_timestamp, ts_int, profit, f"Less than MA, max: {max_profit * 100:.2f}%"
+    Returns the traded rows with their profits and holding days.
+    """
+    rows, entries = trade_entries(PRICE_DATA, rows)
+    paths = exit_engine.trade_paths(PRICE_DATA, entries)
+    offsets, profits, reasons = exit_engine.evaluate(paths, stop_rules(stop_loss, stop_gain))
+    trade_profits = []
+    trade_holding_days = []
+    for i, row in enumerate(rows):
+        offset = offsets[i]
+        purchase_price = paths.closes[i, 0]
+        buy_timestamp = int(paths.datetimes[i, 0])
+        sell_timestamp = int(paths.datetimes[i, offset])
+        profit = float(profits[i])
+        if reasons[i] == 0:
+            min_profit = (paths.troughs[i, offset] - purchase_price) / purchase_price
+            sell_reason = f"{stop_gain} gain, min: {min_profit * 100:.2f}%"
+        else:
+            max_profit = (paths.peaks[i, offset] - purchase_price) / purchase_price
+            sell_reason = f"{stop_loss} loss, max: {max_profit * 100:.2f}%" if reasons[i] == 1 \
+                else f"End of data, max: {max_profit * 100:.2f}%"
 
-    # If we reach the end without selling, calculate final profit/loss
-    last_ts = sorted_timestamps[-1]
-    max_profit = (max_close - purchase_price) / purchase_price
-    return (buy_timestamp, int(last_ts),
-            (candles_dict[last_ts]["close"] - purchase_price) / purchase_price,
-            f"End of data, max: {max_profit * 100:.2f}%")
+        sell_date = datetime.datetime.fromtimestamp(sell_timestamp).strftime("%Y-%m-%d")
+        row["Sell Date"] = sell_date
+        row["Profit"] = f"{profit * 100:.4f}%"
+        holding_days = (datetime.datetime.fromtimestamp(sell_timestamp) - datetime.datetime.fromtimestamp(
+            buy_timestamp)).days
+        row["Holding Duration"] = str(holding_days)
+        row["Sell reason"] = sell_reason
+        trade_profits.append(profit)
+        trade_holding_days.append(holding_days)
+    return rows, trade_profits, trade_holding_days
+
+
+def annualized_return(profits, holding_days):
+    """Average profit and holding days of the trades, and the return of repeating the average trade for a year."""
+    r = sum(profits) / len(profits)
+    d = sum(holding_days) / len(holding_days)
+    n = 365 / d if d > 0 else 0
+    f = (1 + r) ** n
+    return r, d, (f - 1) * 100
 
 
 def back_test(PRICE_DATA, stop_loss=9.0, stop_gain=0.0):
     output_dir = os.path.join(os.path.dirname(DIR), 'screen_results')
     file_path = os.path.join(output_dir, f'screen_results copy.csv')
-    global_holding_days = []
-    global_profits = []
 
     if not os.path.exists(file_path):
         return 0
@@ -124,52 +131,29 @@ def back_test(PRICE_DATA, stop_loss=9.0, stop_gain=0.0):
         reader = csv.DictReader(csv_file)
         rows = list(reader)
 
-    total_holding_days = 0
-    total_profit = 0
-    count = 0
-    has_average = False
     index_to_pop = None
+    to_test = []
     for i, row in enumerate(rows):
         if row["Ticker"] == "AVERAGE":
             index_to_pop = i
             continue
+        if row["Date"] != "":
+            to_test.append(row)
 
-        screening_date = row["Date"]
-        if screening_date == "":
-            continue
-        start_timestamp = int(datetime.datetime.strptime(screening_date, "%Y-%m-%d").timestamp())
-        candles = PRICE_DATA[row["Ticker"]]["candles"]
-        candles_dict = {str(candle["datetime"]): candle for candle in candles}
-        buy_timestamp, sell_timestamp, profit, sell_reason = check_stop_loss(start_timestamp, candles_dict,
-                                                                             stop_loss, stop_gain)
-        sell_date = datetime.datetime.fromtimestamp(sell_timestamp).strftime("%Y-%m-%d")
-        row["Sell Date"] = sell_date
-        row["Profit"] = f"{profit * 100:.4f}%"
-        holding_days = (datetime.datetime.fromtimestamp(sell_timestamp) - datetime.datetime.fromtimestamp(
-            buy_timestamp)).days
-        row["Holding Duration"] = str(holding_days)
-        row["Sell reason"] = sell_reason
-        total_holding_days += holding_days
-        total_profit += profit
-        count += 1
-        global_holding_days.append(holding_days)
-        global_profits.append(profit)
+    _, global_profits, global_holding_days = simulate_trades(PRICE_DATA, to_test, stop_loss, stop_gain)
+    count = len(global_profits)
 
     if index_to_pop: rows.pop(index_to_pop)
 
     if count > 0 and len(rows) > 0:
-        avg_held = total_holding_days / count
-        avg_profit = total_profit / count
-        r = sum(global_profits) / len(global_profits)
-        d = sum(global_holding_days) / len(global_holding_days)
-        n = 365 / d if d > 0 else 0
-        f = (1 + r) ** n
-        annualized_return = (f - 1) * 100
+        avg_held = sum(global_holding_days) / count
+        avg_profit = sum(global_profits) / count
+        _, _, annualized = annualized_return(global_profits, global_holding_days)
 
         summary = {col: "" for col in rows[0].keys()}
         summary["Ticker"] = "AVERAGE"
         summary["Holding Duration"] = f"{avg_held:.2f}"
-        summary["Profit"] = f"{avg_profit * 100:.4f}% ({annualized_return:.4f}%)"
+        summary["Profit"] = f"{avg_profit * 100:.4f}% ({annualized:.4f}%)"
         rows.append(summary)
 
     with open(file_path, mode="w", newline="") as csv_out:
@@ -179,47 +163,113 @@ def back_test(PRICE_DATA, stop_loss=9.0, stop_gain=0.0):
         writer.writerows(rows)
 
     if len(global_holding_days) > 0 and len(global_profits) > 0:
-        r = sum(global_profits) / len(global_profits)
-        d = sum(global_holding_days) / len(global_holding_days)
-        n = 365 / d if d > 0 else 0
-        f = (1 + r) ** n
-        annualized_return = (f - 1) * 100
+        r, d, annualized = annualized_return(global_profits, global_holding_days)
         print(f"Global Average Profit: {r * 100:.4f}%")
         print(f"Global Average Holding Days: {d:.2f}")
-        print(f"Annualized Return: {annualized_return:.4f}%")
+        print(f"Annualized Return: {annualized:.4f}%")
         print("\n")
-    return f"{annualized_return:.2f}% in {d:.2f}d"
+    return f"{annualized:.2f}% in {d:.2f}d"
+
+def load_trades(PRICE_DATA, file_path=TRADES_FILE):
+    """Reads the screened trades once and lines up the closes of every trade from its entry candle on.
+
+    Returns the traded rows, their ``exit_engine.Paths`` and the local time of every candle of the paths as seconds,
+    what ``back_test`` takes its holding days from.
+    """
+    with open(file_path, mode="r", newline="") as csv_file:
+        rows = [row for row in csv.DictReader(csv_file) if row["Ticker"] != "AVERAGE" and row["Date"] != ""]
+    rows, entries = trade_entries(PRICE_DATA, rows)
+    paths = exit_engine.trade_paths(PRICE_DATA, entries)
+
+    epoch = datetime.datetime(1970, 1, 1)
+    local = {ts: (datetime.datetime.fromtimestamp(ts) - epoch).total_seconds()
+             for ts in np.unique(paths.datetimes).tolist()}
+    local_seconds = np.vectorize(local.get, otypes=[float])(paths.datetimes) if local else \
+        np.zeros(paths.datetimes.shape)
+    return rows, paths, local_seconds
+
+
+def summarize_stops(profits, holding_days, exit_order):
+    """Average profit and holding days, annualized return as printed by ``back_test`` and the max drawdown of
+    the summed profits in exit order, in % of one position."""
+    r = profits.mean()
+    d = holding_days.mean()
+    n = 365 / d if d > 0 else 0
+    annualized_return = ((1 + r) ** n - 1) * 100
+    equity = np.concatenate([[0.0], np.cumsum(profits[exit_order])])
+    max_drawdown = (np.maximum.accumulate(equity) - equity).max() * 100
+    return r * 100, d, annualized_return, max_drawdown
+
+
+_SWEEP = {}
+
+
+def _attach_sweep(name, shape, lengths):
+    memory = shared_memory.SharedMemory(name=name)
+    closes, local_seconds = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    _SWEEP["memory"] = memory
+    _SWEEP["paths"] = exit_engine.Paths(closes, lengths)
+    _SWEEP["local_seconds"] = local_seconds
+
+
+def _sweep_cells(cells):
+    paths = _SWEEP["paths"]
+    local_seconds = _SWEEP["local_seconds"]
+    rows = np.arange(len(paths.closes))
+    results = []
+    for stop_loss, stop_gain in cells:
+        offsets, profits, reasons = exit_engine.evaluate(paths, stop_rules(stop_loss, stop_gain))
+        exit_seconds = local_seconds[rows, offsets]
+        holding_days = np.floor((exit_seconds - local_seconds[:, 0]) / 86400)
+        exit_order = np.argsort(exit_seconds, kind="stable")
+        results.append((stop_loss, stop_gain, len(profits), *summarize_stops(profits, holding_days, exit_order),
+                        int((reasons == 0).sum()), int((reasons == 1).sum())))
+    return results
+
+
+def sweep(PRICE_DATA, stop_losses, stop_gains, file_path=TRADES_FILE, workers=None):
+    """Back-tests every (stop loss, stop gain) pair of the grid over the screened trades.
+
+    The trades and their closes are read once into shared memory and the grid is spread over a process pool.
+    Returns one row per cell with the average profit, average holding days, annualized return and max drawdown.
+    """
+    _, paths, local_seconds = load_trades(PRICE_DATA, file_path)
+    stacked = np.stack([paths.closes, local_seconds])
+    memory = shared_memory.SharedMemory(create=True, size=max(stacked.nbytes, 1))
+    try:
+        np.ndarray(stacked.shape, dtype=np.float64, buffer=memory.buf)[:] = stacked
+        cells = [(float(stop_loss), float(stop_gain)) for stop_loss in stop_losses for stop_gain in stop_gains]
+        chunks = [cells[i:i + SWEEP_CHUNK] for i in range(0, len(cells), SWEEP_CHUNK)]
+        with Pool(workers, initializer=_attach_sweep, initargs=(memory.name, stacked.shape, paths.lengths)) as pool:
+            results = [row for chunk in pool.map(_sweep_cells, chunks) for row in chunk]
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return pd.DataFrame(results, columns=["stop_loss", "stop_gain", "trades", "avg_profit", "avg_holding_days",
+                                          "annualized_return", "max_drawdown", "stop_gain_exits",
+                                          "stop_loss_exits"])
+
 
 def main():
-    PRICE_DATA = rs_ranking.load_data()
     just_testing = False
     # just_testing = True
 
     if (just_testing):
+        # Only the traded tickers are read
+        PRICE_DATA = rs_ranking.load_data(lazy=True)
         # back_test(PRICE_DATA, 7, 100)
 
-        stop_loss = 0.0
-        rows = []
-        while stop_loss <= 10:
-            columns = []
-            stop_gain = 0.0
-            while stop_gain <= 20:
-                columns.append(
-                    f"({stop_loss:>4.1f} {stop_gain:>4.1f}) {back_test(PRICE_DATA, stop_loss, stop_gain):>25}")
-                if stop_gain < 2:
-                    stop_gain = round(stop_gain + 1, 2)
-                else:
-                    stop_gain = round(stop_gain + 1, 2)
-            stop_loss = round(stop_loss + 1, 1)
-            rows.append(columns)
-
-        for row in rows:
-            print(" ".join(str(item) for item in row))
+        results = sweep(PRICE_DATA, np.arange(0, 11, 1.0), np.arange(0, 21, 1.0))
+        for stop_loss, cells in results.groupby("stop_loss", sort=True):
+            print(" ".join(f"({cell.stop_loss:>4.1f} {cell.stop_gain:>4.1f}) "
+                           f"{f'{cell.annualized_return:.2f}% in {cell.avg_holding_days:.2f}d':>25}"
+                           for cell in cells.itertuples()))
     else:
         file_path = os.path.join(os.path.dirname(DIR), 'screen_results', 'screen_results.csv')
         if os.path.exists(file_path):
             os.remove(file_path)
-        screen_stocks(PRICE_DATA)
+        screen_stocks(rs_ranking.load_data())
 
 
 if __name__ == "__main__":
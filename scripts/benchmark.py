@@ -0,0 +1,261 @@
+"""Benchmarks of the pipeline on a synthetic price universe.
+
+The benchmark builds a workspace holding a copy of ``scripts`` and
+``config.yaml`` next to a ``data_persist`` filled by ``synthetic_universe``,
+then runs the stages in a fresh interpreter inside it, so every module reads
+and writes the workspace through its usual paths and the real data is never
+touched. Every stage is timed over ``--repeat`` runs (the best one is kept)
+and then run once more under tracemalloc for its peak traced memory. The
+report is written as JSON, and ``--compare`` prints the speedup of every
+stage against an earlier report.
+
+    python -m scripts.benchmark --tickers 2000 --days 1500 --output benchmark.json
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+STAGES = ("load_data_cold", "load_data", "filter_price_data_by_index", "rankings", "screen", "back_test",
+          "simulate")
+TRADES = 500
+
+
+def prepare_workspace(workspace, tickers, days, gap_rate, delist_rate, seed):
+    """Copies the code into ``workspace`` and writes the synthetic universe next to it."""
+    from scripts import synthetic_universe
+
+    shutil.copytree(DIR, os.path.join(workspace, 'scripts'), ignore=shutil.ignore_patterns('__pycache__'))
+    shutil.copy(os.path.join(os.path.dirname(DIR), 'config.yaml'), workspace)
+    for directory in ('data_persist', 'rs_stocks', os.path.join('screen_results', 'daily')):
+        os.makedirs(os.path.join(workspace, directory), exist_ok=True)
+    synthetic_universe.generate(os.path.join(workspace, 'data_persist'), tickers, days, gap_rate, delist_rate,
+                                seed)
+
+
+def write_trades(file_path, PRICE_DATA, end_timestamp, count=TRADES, seed=0):
+    """Screened trades on random tickers and days before ``end_timestamp``, in the format back_test reads."""
+    rng = np.random.default_rng(seed)
+    tickers = [ticker for ticker in PRICE_DATA if not ticker.startswith("^")]
+    rows = []
+    for ticker in rng.choice(tickers, count):
+        datetimes = PRICE_DATA[ticker]["candles"].column("datetime")
+        datetimes = datetimes[datetimes < end_timestamp]
+        if len(datetimes):
+            date = datetime.datetime.fromtimestamp(int(rng.choice(datetimes))).strftime("%Y-%m-%d")
+            rows.append({"Ticker": ticker, "Date": date, "Sell Date": "", "Holding Duration": "", "Profit": "",
+                         "Sell reason": ""})
+    rows.sort(key=lambda row: row["Date"])
+    with open(file_path, mode="w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def stages(seed=0):
+    """``(name, prepare, run)`` of every stage, run in order inside the workspace.
+
+    ``prepare`` resets whatever the previous run left so every run does the same work, and ``run`` is the timed
+    call. Both take a dict shared by the stages.
+    """
+    from scripts import back_tester
+    from scripts import fundamentals
+    from scripts import price_store
+    from scripts import rs_ranking
+    from scripts import rs_store
+    from scripts import screen_stocks
+    from scripts import simulate_timeline
+    from scripts import synthetic_universe
+    from scripts import trading_calendar
+
+    def load_cold(state):
+        shutil.rmtree(price_store.STORE_DIR, ignore_errors=True)
+
+    def load(state):
+        state["PRICE_DATA"] = rs_ranking.load_data()
+
+    def as_of(state):
+        calendar = trading_calendar.TradingCalendar.from_price_data(state["PRICE_DATA"])
+        # Rank and screen as of 80% of the history, the back-test trades before that
+        state["timestamp"] = int(calendar.timestamps[len(calendar) * 4 // 5])
+        state["end_date"] = trading_calendar.timestamp_to_date(state["timestamp"])
+
+    def view(state):
+        view = rs_ranking.filter_price_data_by_index(state["PRICE_DATA"], state["timestamp"])
+        # The view is cut lazily, touch every ticker so the cuts are part of the stage
+        state["view"] = view
+        state["candles"] = sum(len(view[ticker]["candles"]) for ticker in view)
+
+    def unrank(state):
+        store = rs_store.open_store()
+        with store.connection:
+            store.connection.execute("DELETE FROM rs_history WHERE date = ?", (state["end_date"],))
+
+    def rank(state):
+        rs_ranking.rankings(state["view"], state["end_date"])
+
+    def seed_fundamentals(state):
+        # Fresh fundamentals for every ticker keep the screen off the network
+        if not fundamentals.CACHE.entries:
+            for ticker in state["PRICE_DATA"]:
+                fundamentals.CACHE.update(ticker, synthetic_universe.fundamentals(ticker, seed))
+        # The screen reads the ranking of the day, stored already unless the rankings stage was skipped
+        rs_ranking.rankings(state["view"], state["end_date"])
+
+    def screen(state):
+        screen_stocks.screen(state["PRICE_DATA"], state["view"], state["end_date"], append_csv=False)
+
+    def trades(state):
+        write_trades(back_tester.TRADES_FILE, state["PRICE_DATA"], state["timestamp"], seed=seed)
+
+    def back_test(state):
+        back_tester.back_test(state["PRICE_DATA"])
+
+    def nothing(state):
+        pass
+
+    return [
+        ("load_data_cold", load_cold, load),
+        ("load_data", nothing, lambda state: (load(state), as_of(state))),
+        ("filter_price_data_by_index", nothing, view),
+        ("rankings", unrank, rank),
+        ("screen", seed_fundamentals, screen),
+        ("back_test", trades, back_test),
+        ("simulate", nothing, lambda state: simulate_timeline.simulate()),
+    ]
+
+
+def max_rss_mb():
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_stages(repeat=3, memory=True, seed=0, only=None):
+    """Times every stage in the current directory's workspace and returns ``{stage: measurements}``."""
+    results = {}
+    state = {}
+    for name, prepare, run in stages(seed):
+        if only and name not in only and name not in ("load_data", "filter_price_data_by_index"):
+            continue
+        runs = []
+        # The stages print their own progress, only the measurements are shown
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                prepare(state)
+                start = time.perf_counter()
+                run(state)
+                runs.append(time.perf_counter() - start)
+
+        result = {"seconds": min(runs), "runs": runs}
+        if memory:
+            with contextlib.redirect_stdout(io.StringIO()):
+                prepare(state)
+                tracemalloc.start()
+                run(state)
+            result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        result["max_rss_mb"] = max_rss_mb()
+        results[name] = result
+        print(f"{name:<28} {result['seconds']:>9.3f}s"
+              + (f" {result['peak_traced_mb']:>9.1f} MB traced" if memory else "")
+              + f" {result['max_rss_mb']:>9.1f} MB max RSS", flush=True)
+    return results
+
+
+def compare(report, previous):
+    """Prints how much faster every stage of ``report`` is than in ``previous``."""
+    for name, result in report["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if before is None:
+            continue
+        speedup = before["seconds"] / result["seconds"] if result["seconds"] else float("inf")
+        print(f"{name:<28} {before['seconds']:>9.3f}s -> {result['seconds']:>9.3f}s  x{speedup:.2f}")
+
+
+def run(tickers=2000, days=1500, gap_rate=0.01, delist_rate=0.05, seed=0, repeat=3, memory=True, only=None,
+        workspace=None, keep=False):
+    """Builds a workspace, runs the stages in it and returns the report."""
+    workspace = workspace or tempfile.mkdtemp(prefix='mmr_benchmark_')
+    universe = {"tickers": tickers, "days": days, "gap_rate": gap_rate, "delist_rate": delist_rate, "seed": seed}
+    try:
+        start = time.perf_counter()
+        prepare_workspace(workspace, tickers, days, gap_rate, delist_rate, seed)
+        generate_seconds = time.perf_counter() - start
+
+        stages_path = os.path.join(workspace, 'stages.json')
+        command = [sys.executable, "-m", "scripts.benchmark", "--run-stages", stages_path, "--repeat", str(repeat),
+                   "--seed", str(seed)] + ([] if memory else ["--no-memory"]) + \
+                  (["--only", *only] if only else [])
+        subprocess.run(command, cwd=workspace, check=True)
+        with open(stages_path, 'r', encoding='utf8') as f:
+            stage_results = json.load(f)
+    finally:
+        if not keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    import pandas as pd
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "universe": universe,
+        "repeat": repeat,
+        "generate_seconds": generate_seconds,
+        "stages": stage_results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark load, rank, screen and back-test on synthetic data")
+    parser.add_argument("--tickers", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1500)
+    parser.add_argument("--gap-rate", type=float, default=0.01)
+    parser.add_argument("--delist-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass of every stage")
+    parser.add_argument("--only", nargs="+", choices=STAGES, help="stages to run, the loading ones always run")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    parser.add_argument("--workspace", help="directory to build the workspace in, a temporary one by default")
+    parser.add_argument("--keep", action="store_true", help="keep the workspace")
+    parser.add_argument("--run-stages", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stages:
+        # Inside the workspace
+        results = run_stages(args.repeat, not args.no_memory, args.seed, args.only)
+        with open(args.run_stages, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+        return
+
+    report = run(args.tickers, args.days, args.gap_rate, args.delist_rate, args.seed, args.repeat,
+                 not args.no_memory, args.only, args.workspace, args.keep)
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Settings of ``config.yaml``, overridden by ``scripts/config_private.yaml`` when it has them."""
+import os
+
+import yaml
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+try:
+    with open(os.path.join(DIR, 'config_private.yaml'), 'r') as stream:
+        private_config = yaml.safe_load(stream)
+except FileNotFoundError:
+    private_config = None
+except yaml.YAMLError as exc:
+    print(exc)
+
+try:
+    file_path = os.path.join(os.path.dirname(DIR), 'config.yaml')
+    with open(file_path, 'r') as stream:
+        config = yaml.safe_load(stream)
+except FileNotFoundError:
+    config = None
+except yaml.YAMLError as exc:
+    print(exc)
+
+
+def cfg(key):
+    try:
+        return private_config[key]
+    except:
+        try:
+            return config[key]
+        except:
+            return None
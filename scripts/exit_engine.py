@@ -0,0 +1,139 @@
+"""Vectorized trade exits.
+
+Every trade is lined up from its entry candle in one (trades x days) matrix of
+closes, and every exit rule turns that matrix into a mask of the candles it
+would sell on. A trade leaves on the first candle after its entry where any
+rule fires, the rule listed first naming the reason when several fire on the
+same candle, and is held to the end of its history otherwise.
+"""
+import numpy as np
+
+from scripts import price_store
+
+# Reason of a trade no rule closed
+END_OF_DATA = -1
+
+
+class Paths:
+    """Closes of every trade from its entry candle on, NaN-padded past the end of its history.
+
+    ``warmup`` holds the closes right before each entry (NaN-padded on the left), needed by the rules that look
+    back past the entry such as the moving average cross.
+    """
+
+    def __init__(self, closes, lengths, datetimes=None, warmup=None):
+        self.closes = closes
+        self.lengths = lengths
+        self.datetimes = datetimes
+        self.warmup = np.empty((len(closes), 0)) if warmup is None else warmup
+        purchase = closes[:, :1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.profits = (closes - purchase) / purchase
+        # Like max() / min() over Python floats, a NaN close never moves the running extremes, unless it is the
+        # purchase itself
+        self.peaks = _running(np.fmax, closes)
+        self.troughs = _running(np.fmin, closes)
+
+
+def _running(ufunc, closes):
+    running = ufunc.accumulate(closes, axis=1)
+    running[np.isnan(closes[:, 0])] = np.nan
+    return running
+
+
+def trade_paths(price_data, entries, warmup=0):
+    """Builds the ``Paths`` of ``(ticker, entry index)`` pairs, with ``warmup`` closes before every entry."""
+    entries = list(entries)
+    histories = [(price_store.column(price_data[ticker], "close"), price_store.column(price_data[ticker], "datetime"),
+                  entry) for ticker, entry in entries]
+    lengths = np.array([len(closes) - entry for closes, _, entry in histories], dtype=int)
+    width = int(lengths.max()) if len(lengths) else 1
+    closes = np.full((len(entries), width), np.nan)
+    datetimes = np.zeros((len(entries), width), dtype=np.int64)
+    before = np.full((len(entries), warmup), np.nan)
+    for i, (history, history_datetimes, entry) in enumerate(histories):
+        closes[i, :lengths[i]] = history[entry:]
+        datetimes[i, :lengths[i]] = history_datetimes[entry:]
+        if warmup:
+            tail = history[max(0, entry - warmup):entry]
+            before[i, warmup - len(tail):] = tail
+    return Paths(closes, lengths, datetimes, before)
+
+
+class TrailingStop:
+    """Sells when the close falls ``percent`` % under the highest close since the entry."""
+    name = "loss"
+
+    def __init__(self, percent):
+        self.percent = percent
+
+    def hits(self, paths):
+        return paths.closes < paths.peaks * (1 - self.percent / 100)
+
+
+class TakeProfit:
+    """Sells once the profit is above ``percent`` %."""
+    name = "gain"
+
+    def __init__(self, percent):
+        self.percent = percent
+
+    def hits(self, paths):
+        return paths.profits > self.percent / 100
+
+
+class MovingAverageCross:
+    """Sells when the close falls under its ``period`` candle SMA, which counts the candles before the entry.
+
+    Like the loop this replaces, a window reaching past the start of the history is divided by ``period`` all the
+    same and missing candles count as 0. Needs ``trade_paths(..., warmup=period - 1)``.
+    """
+    name = "ma"
+
+    def __init__(self, period):
+        self.period = period
+
+    def hits(self, paths):
+        history = np.nan_to_num(np.concatenate([paths.warmup, paths.closes], axis=1))
+        sums = np.concatenate([np.zeros((len(history), 1)), np.cumsum(history, axis=1)], axis=1)
+        ends = np.arange(paths.warmup.shape[1], history.shape[1]) + 1
+        sma = (sums[:, ends] - sums[:, np.maximum(ends - self.period, 0)]) / self.period
+        return paths.closes < sma
+
+
+class TimeStop:
+    """Sells ``candles`` candles after the entry."""
+    name = "time"
+
+    def __init__(self, candles):
+        self.candles = candles
+
+    def hits(self, paths):
+        mask = np.zeros(paths.closes.shape, dtype=bool)
+        if 0 < self.candles < mask.shape[1]:
+            mask[:, self.candles] = True
+        return mask
+
+
+def evaluate(paths, rules):
+    """First exit of every trade under ``rules``.
+
+    Returns the exit position of every trade (candles after its entry), its profit there and the index in
+    ``rules`` of the rule that closed it, ``END_OF_DATA`` when none did.
+    """
+    rows = np.arange(len(paths.closes))
+    width = paths.closes.shape[1]
+    # The entry candle is the purchase, rules only apply from the next one and while the history lasts
+    live = np.arange(1, width) < paths.lengths[:, None]
+
+    first = np.full(len(rows), width)
+    reasons = np.full(len(rows), END_OF_DATA)
+    for i, rule in enumerate(rules):
+        hit = rule.hits(paths)[:, 1:] & live
+        candle = np.where(hit.any(axis=1), hit.argmax(axis=1) + 1, width)
+        earlier = candle < first
+        first = np.where(earlier, candle, first)
+        reasons = np.where(earlier, i, reasons)
+
+    offsets = np.where(first < width, first, paths.lengths - 1)
+    return offsets, paths.profits[rows, offsets], reasons
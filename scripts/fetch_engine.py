@@ -0,0 +1,175 @@
+"""Concurrent download engine shared by the Yahoo fetchers.
+
+Every request goes through one ``FetchEngine`` which hands out reusable
+sessions from a pool, spaces requests with a global token bucket, shrinks
+its concurrency when Yahoo answers "Too Many Requests" and grows it back
+after a run of successes, and retries rate-limited calls with jittered
+exponential backoff.
+
+The bucket and the concurrency cap belong to one process. A process that is
+one of several forked workers sharing the budget calls ``split`` first.
+"""
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+
+from scripts import metrics
+
+# Requests per second allowed across all workers, and how many may be sent back to back
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 8
+DEFAULT_WORKERS = 8
+
+
+class RateLimited(Exception):
+    """Raised by a fetch function when the server rate-limited the request."""
+
+
+# HTTP status of a rate-limited request
+TOO_MANY_REQUESTS = 429
+
+
+def is_rate_limit_error(error):
+    """True when ``error`` is a 429 answer: by the status of the response it carries, else by its reason phrase,
+    which yfinance's rate limit error and the errors ``yf.download`` records as strings repeat."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == TOO_MANY_REQUESTS
+    return "Too Many Requests" in str(error)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``acquire`` blocks until a request may be sent."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Caps in-flight requests, halving the cap on a rate limit and raising it by one after a run of successes."""
+
+    def __init__(self, max_concurrency, recover_after=20, cooldown=30.0):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.recover_after = recover_after
+        self.cooldown = cooldown
+        self._active = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self._active < self.limit:
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self._active += 1
+
+    def release(self, rate_limited=False):
+        with self._cond:
+            self._active -= 1
+            now = time.monotonic()
+            if rate_limited:
+                self._successes = 0
+                # Requests already in flight when the limit hit will fail too, only back off once per cooldown
+                if now >= self._paused_until:
+                    self.limit = max(1, self.limit // 2)
+                    self._paused_until = now + self.cooldown
+                    print(f"Rate limited, pausing {self.cooldown:.0f}s and lowering concurrency to {self.limit}")
+            else:
+                self._successes += 1
+                if self.limit < self.max_concurrency and self._successes >= self.recover_after:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class SessionPool:
+    """Reuses sessions across requests instead of building one per attempt."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._sessions = queue.LifoQueue()
+
+    @contextmanager
+    def session(self):
+        try:
+            session = self._sessions.get_nowait()
+        except queue.Empty:
+            session = self._factory()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+
+class FetchEngine:
+    def __init__(self, session_factory, max_workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_retries=5, base_delay=1.0):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.sessions = SessionPool(session_factory)
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(max_workers)
+
+    def split(self, parts):
+        """Keeps this process to its share of the rate, burst and concurrency when ``parts`` processes fetch at
+        once, so together they stay within the budget of one."""
+        self.max_workers = max(1, self.max_workers // parts)
+        self.bucket = TokenBucket(self.bucket.rate / parts, max(1, self.bucket.capacity // parts))
+        self.limiter = AdaptiveLimiter(self.max_workers)
+
+    def call(self, fn, label=""):
+        """Runs ``fn(session)``, retrying with jittered backoff while it raises ``RateLimited``.
+
+        Returns None once the retries are exhausted.
+        """
+        for attempt in range(self.max_retries):
+            if attempt:
+                metrics.increment("retries")
+            self.limiter.acquire()
+            rate_limited = False
+            try:
+                self.bucket.acquire()
+                with self.sessions.session() as session:
+                    return fn(session)
+            except RateLimited as e:
+                rate_limited = True
+                metrics.increment("rate_limit_hits")
+                print(f"Rate limit hit for {label}: {e}")
+            finally:
+                self.limiter.release(rate_limited)
+            time.sleep(self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+        metrics.increment("gave_up")
+        print(f"Giving up on {label} after {self.max_retries} attempts")
+        return None
+
+    def map(self, fn, items):
+        """Runs ``fn(item, session)`` for every item on a thread pool, yielding ``(item, result)`` as they finish."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.call, partial(fn, item), str(item)): item for item in items}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
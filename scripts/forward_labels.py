@@ -0,0 +1,126 @@
+"""Forward returns of the daily screen signals.
+
+For a signal on a given day, ``gain`` is the move from the signal close to the
+latest close, and ``low_since_signal`` / ``high_since_signal`` are the lowest
+and highest closes after it, relative to the signal close. The signal candle is
+found with a binary search on the timestamps, and the lows and highs come from
+suffix min / max arrays that are computed once per ticker. That makes every
+label a constant-time lookup, so all the ``screen_results/daily`` files can be
+relabeled in one pass after a price refresh.
+"""
+import datetime
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+from scripts import price_store
+from scripts import rs_ranking
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+DAILY_DIR = os.path.join(os.path.dirname(DIR), 'screen_results', 'daily')
+
+# Starting values of the old per-candle loop, kept so the lows and highs come out the same
+NO_SIGNAL_PRICE = 10000000
+NO_HIGH = 0
+DAY = 86400
+
+
+def signal_timestamp(date):
+    """Market close of ``date``, the time the signal candle is looked up around."""
+    return int((datetime.datetime.strptime(date, "%Y-%m-%d") + datetime.timedelta(hours=16)).timestamp())
+
+
+class TickerLabels:
+    """Suffix min / max of one ticker's closes, NaN closes skipped."""
+
+    def __init__(self, prices):
+        self.datetimes = price_store.column(prices, "datetime")
+        self.closes = price_store.column(prices, "close")
+        self.lows = np.fmin.accumulate(self.closes[::-1])[::-1]
+        self.highs = np.fmax.accumulate(self.closes[::-1])[::-1]
+
+    def label(self, timestamps):
+        """``gain``, ``low_since_signal`` and ``high_since_signal`` of signals at every timestamp of ``timestamps``.
+
+        The signal close is the last candle less than a day away from the timestamp, and the candles after it are
+        the ones at least a day later.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        n = len(self.closes)
+        first = np.searchsorted(self.datetimes, timestamps - DAY, side="right")
+        after = np.searchsorted(self.datetimes, timestamps + DAY, side="left")
+        signal_price = np.where(after > first, self.closes[np.maximum(after - 1, 0)], NO_SIGNAL_PRICE)
+
+        valid = after < n
+        suffix = np.minimum(after, n - 1)
+        low = np.fmin(self.lows[suffix], NO_SIGNAL_PRICE)
+        high = np.fmax(self.highs[suffix], NO_HIGH)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain = (self.closes[-1] - signal_price) / signal_price
+            low_since_signal = (low - signal_price) / signal_price
+            high_since_signal = (high - signal_price) / signal_price
+
+        return [{"gain": float(gain[i]),
+                 "low_since_signal": float(low_since_signal[i]) if valid[i] else 0,
+                 "high_since_signal": float(high_since_signal[i]) if valid[i] else 0}
+                for i in range(len(timestamps))]
+
+
+def label(PRICE_DATA, signals, cache=None):
+    """Labels of ``(ticker, date)`` signals, in order. Tickers missing from the price data get None."""
+    cache = {} if cache is None else cache
+    by_ticker = {}
+    for i, (ticker, date) in enumerate(signals):
+        by_ticker.setdefault(ticker, []).append((i, signal_timestamp(date)))
+
+    labels = [None] * len(signals)
+    for ticker, positions in by_ticker.items():
+        if ticker not in PRICE_DATA or not len(PRICE_DATA[ticker]["candles"]):
+            continue
+        if ticker not in cache:
+            cache[ticker] = TickerLabels(PRICE_DATA[ticker])
+        for (i, _), ticker_label in zip(positions, cache[ticker].label([ts for _, ts in positions])):
+            labels[i] = ticker_label
+    return labels
+
+
+def rebuild_daily(PRICE_DATA, directory=DAILY_DIR):
+    """Recomputes the labels of every ``screen_results_<date>.json`` of ``directory`` in one pass."""
+    files = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'screen_results_*.json'))):
+        match = re.search(r'screen_results_(\d{4}-\d{2}-\d{2})\.json$', path)
+        if match is None:
+            continue
+        with open(path, 'r', encoding='utf8') as f:
+            files[path] = (match.group(1), json.load(f))
+
+    signals = [(ticker, date) for date, results in files.values() for ticker in results]
+    labels = iter(label(PRICE_DATA, signals))
+    updated = 0
+    for path, (date, results) in files.items():
+        changed = False
+        for ticker in results:
+            ticker_label = next(labels)
+            if ticker_label is not None and any(results[ticker].get(key) != value
+                                                for key, value in ticker_label.items()):
+                results[ticker].update(ticker_label)
+                changed = True
+        if changed:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w') as outfile:
+                json.dump(results, outfile)
+            os.replace(tmp_path, path)
+            updated += 1
+    print(f"Relabeled {len(signals)} signals, {updated} of {len(files)} daily files changed")
+    return updated
+
+
+def main():
+    rebuild_daily(rs_ranking.load_data(lazy=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Cached company fundamentals for the screener.
+
+Every field (market cap, beta, exchange, currency, summary, next earnings date)
+is stored with the time it was fetched and is only fetched again once it is
+older than its TTL, so re-screening past dates stays off the network for every
+ticker whose fundamentals are fresh.
+
+Updates are appended to a JSON lines journal, one line per fetched ticker, so
+a run that dies half way loses nothing and never leaves a half-written cache.
+The journal is compacted into a snapshot (written to a temporary file then
+renamed) once it holds many more lines than there are tickers. Appends and
+compactions hold a lock on ``<journal>.lock`` and first read the lines other
+processes appended, so forked workers sharing the journal lose none of them.
+"""
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import yfinance as yf
+
+from scripts import fetch_engine
+from scripts import metrics
+from scripts import rs_data
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+OUTPUT_DIR = os.path.join(os.path.dirname(DIR), 'data_persist')
+CACHE_FILE = os.path.join(OUTPUT_DIR, '_fundamentals_cache.jsonl')
+# Whole-file cache written by older versions, read once to seed the journal
+LEGACY_CACHE_FILE = os.path.join(OUTPUT_DIR, '_market_cap_cache.json')
+
+DAY = 24 * 60 * 60
+FIELD_TTLS = {
+    "market_cap": 1 * DAY,
+    "beta": 30 * DAY,
+    "exchange": 365 * DAY,
+    "currency": 365 * DAY,
+    "summary": 180 * DAY,
+    "next_earning": 1 * DAY,
+}
+# Cache field -> key of yf.Ticker.info
+INFO_KEYS = {
+    "market_cap": "marketCap",
+    "beta": "beta",
+    "exchange": "exchange",
+    "currency": "currency",
+    "summary": "longBusinessSummary",
+}
+# A ticker Yahoo had nothing for is only asked again after this long
+FAILURE_TTL = 1 * DAY
+# Compact the journal once it has this many lines per cached ticker
+COMPACT_RATIO = 2
+
+ENGINE = fetch_engine.FetchEngine(rs_data.new_session)
+
+
+class FundamentalsCache:
+    """``ticker -> {field: {"value": ..., "fetched": unix time}}`` backed by an append-only journal."""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self._lines = 0
+        # Set when the journal on disk is missing entries or ends in a torn line, the next write rewrites it whole
+        self._dirty = True
+        # (inode, device) of the journal read so far and the offset read up to
+        self._file = None
+        self._offset = 0
+        if os.path.exists(path):
+            self._replay()
+        elif os.path.exists(LEGACY_CACHE_FILE):
+            self._import_legacy(LEGACY_CACHE_FILE)
+
+    @contextmanager
+    def _locked(self):
+        """Holds the journal's lock, shared with every process writing it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _replay(self):
+        """Reads the journal lines written since the last read, every line when the journal was replaced."""
+        if not os.path.exists(self.path):
+            return
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_dev) != self._file or stat.st_size < self._offset:
+            # Compacted by another process: its snapshot holds everything read so far
+            self.entries = {}
+            self._lines = 0
+            self._offset = 0
+            self._dirty = False
+            self._file = (stat.st_ino, stat.st_dev)
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted append
+                    self._dirty = True
+                    continue
+                self.entries.setdefault(record["ticker"], {}).update(record["fields"])
+                self._lines += 1
+            self._offset = f.tell()
+
+    def _import_legacy(self, path):
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"Error loading market cap cache: {e}")
+            return
+        fetched = os.path.getmtime(path)
+        for ticker, values in legacy.items():
+            self.entries[ticker] = {field: {"value": value, "fetched": fetched}
+                                    for field, value in values.items() if field in FIELD_TTLS}
+
+    def stale_fields(self, ticker, now=None):
+        now = time.time() if now is None else now
+        cached = self.entries.get(ticker, {})
+        return [field for field, ttl in FIELD_TTLS.items()
+                if field not in cached or now - cached[field]["fetched"] > ttl]
+
+    def get(self, ticker):
+        """Cached values of ``ticker``, fresh or not, as ``{field: value}``."""
+        return {field: cached["value"] for field, cached in self.entries.get(ticker, {}).items()}
+
+    def update(self, ticker, values):
+        now = time.time()
+        self._append(ticker, {field: {"value": value, "fetched": now} for field, value in values.items()})
+
+    def mark_failed(self, ticker):
+        """Keeps the last values fetched for ``ticker`` and only retries it after ``FAILURE_TTL``.
+
+        A ticker with no cached market cap gets 0, which the screen skips. A field expiring sooner than
+        ``FAILURE_TTL`` from now keeps its expiry, every other one is backdated to expire then.
+        """
+        now = time.time()
+        cached = self.entries.get(ticker, {})
+        fields = {}
+        for field, ttl in FIELD_TTLS.items():
+            retry = now - ttl + min(ttl, FAILURE_TTL)
+            if field in cached:
+                fields[field] = {"value": cached[field]["value"], "fetched": min(cached[field]["fetched"], retry)}
+                if now - cached[field]["fetched"] > ttl:
+                    # Already stale: waits FAILURE_TTL instead of being asked again by the next screen
+                    fields[field]["fetched"] = retry
+            else:
+                fields[field] = {"value": 0 if field == "market_cap" else None, "fetched": retry}
+        self._append(ticker, fields)
+
+    def _append(self, ticker, fields):
+        with self._locked():
+            self._replay()
+            self.entries.setdefault(ticker, {}).update(fields)
+            if self._dirty or self._lines > COMPACT_RATIO * max(len(self.entries), 1000):
+                self._write_snapshot()
+                return
+            with open(self.path, 'ab') as f:
+                f.write((json.dumps({"ticker": ticker, "fields": fields}) + "\n").encode('utf-8'))
+                self._offset = f.tell()
+            self._lines += 1
+
+    def reload(self):
+        """Reads what other processes wrote to the journal since it was last read."""
+        with self._locked():
+            self._replay()
+
+    def compact(self):
+        """Rewrites the journal as one line per ticker."""
+        with self._locked():
+            self._replay()
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        # A temporary file of its own in the journal's directory, so the rename is atomic and never clashes
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=os.path.basename(self.path),
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf8') as f:
+            for ticker, fields in self.entries.items():
+                f.write(json.dumps({"ticker": ticker, "fields": fields}) + "\n")
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._file = (stat.st_ino, stat.st_dev)
+        self._offset = stat.st_size
+        self._lines = len(self.entries)
+        self._dirty = False
+
+
+def fetch_fundamentals(ticker, session):
+    """Reads every cached field of ``ticker`` from one ``Ticker.info`` call, empty when Yahoo has nothing."""
+    try:
+        info = yf.Ticker(ticker, session=session).info
+    except Exception as e:
+        if fetch_engine.is_rate_limit_error(e):
+            raise fetch_engine.RateLimited(str(e))
+        print(f"Error fetching fundamentals for {ticker}: {str(e)}")
+        return {}
+    if not info:
+        return {}
+
+    values = {field: info.get(key) for field, key in INFO_KEYS.items()}
+    earnings = info.get("earningsTimestampStart") or info.get("earningsTimestamp")
+    values["next_earning"] = \
+        datetime.datetime.fromtimestamp(earnings).strftime("%Y-%m-%d") if earnings else None
+    return values
+
+
+@metrics.timed("fundamentals")
+def prefetch(tickers, cache=None):
+    """Fetches, concurrently, every ticker of ``tickers`` that has a stale field."""
+    cache = CACHE if cache is None else cache
+    tickers = list(dict.fromkeys(tickers))
+    stale = [ticker for ticker in tickers if cache.stale_fields(ticker)]
+    metrics.increment("fundamentals_cache_hits", len(tickers) - len(stale))
+    metrics.increment("fundamentals_cache_misses", len(stale))
+    if not stale:
+        return
+    print(f"Fetching fundamentals of {len(stale)} tickers")
+    for ticker, values in ENGINE.map(fetch_fundamentals, stale):
+        if values is None:
+            # Still rate limited after every retry, asked again by the next screen
+            continue
+        if not values:
+            cache.mark_failed(ticker)
+        else:
+            cache.update(ticker, values)
+
+
+def get(ticker, cache=None):
+    """Fundamentals of ``ticker`` as ``{field: value}``, fetching them first when stale."""
+    cache = CACHE if cache is None else cache
+    if cache.stale_fields(ticker):
+        prefetch([ticker], cache)
+    else:
+        metrics.increment("fundamentals_cache_hits")
+    return cache.get(ticker)
+
+
+CACHE = FundamentalsCache()
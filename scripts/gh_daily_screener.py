@@ -3,7 +3,11 @@ import os
 
 from dateutil.relativedelta import relativedelta
 
+from scripts import forward_labels
+from scripts import metrics
+from scripts import rs_matrix
 from scripts import rs_ranking
+from scripts import trading_calendar
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -16,16 +20,16 @@ def main():
 
     current_date = today - relativedelta(days=60)
     end_date = today
+    # Only the re-screened window, not the whole history
+    matrix = rs_matrix.load_or_build(PRICE_DATA, start_date=current_date.strftime("%Y-%m-%d"))
 
-    last_ts = None
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        timestamp = rs_ranking.find_closest_date(PRICE_DATA, date_str)
-        if timestamp != last_ts:
-            rs_ranking.main(PRICE_DATA, timestamp, new_csv=True)
-            last_ts = timestamp
+    calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA)
+    for timestamp in calendar.days_between_dates(current_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")):
+        rs_ranking.main(PRICE_DATA, timestamp, new_csv=True, rs_matrix=matrix)
 
-        current_date += relativedelta(days=1)
+    # Signals older than the re-screened window still need their gains and lows / highs brought up to date
+    forward_labels.rebuild_daily(PRICE_DATA)
+    metrics.report("gh_daily_screener")
 
 
 if __name__ == "__main__":
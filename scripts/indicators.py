@@ -0,0 +1,136 @@
+"""Technical indicators of a whole set of tickers at once.
+
+Every ticker's recent history is right-aligned into one (tickers x days)
+matrix, so the SMAs come out of a single prefix sum and the daily moves out
+of one vectorized pass instead of rebuilding the close list per indicator
+per ticker as ``screen_stocks.calculate_sma`` and friends do.
+"""
+import numpy as np
+import pandas as pd
+
+from scripts import price_store
+
+# Candles needed by the longest indicator: the 200-day SMA shifted back 22 days
+HISTORY = 200 + 22
+# Ratios that all have to be above 1 for the trend template to pass
+MM_COLUMNS = ["close_sma50", "close_sma150", "close_sma200", "sma50_sma150", "sma50_sma200", "sma150_sma200",
+              "trending_up"]
+
+
+def aligned_matrix(price_data, tickers, field, width):
+    """Last ``width`` values of ``field`` for every ticker, right-aligned and NaN-padded on the left.
+
+    Returns the matrix, the mask of cells that hold a candle (as opposed to padding) and every ticker's full length.
+    """
+    values = np.full((len(tickers), width), np.nan)
+    present = np.zeros((len(tickers), width), dtype=bool)
+    lengths = np.zeros(len(tickers), dtype=int)
+    for row, ticker in enumerate(tickers):
+        column = price_store.column(price_data[ticker], field)
+        lengths[row] = len(column)
+        tail = column[-width:]
+        if len(tail):
+            values[row, width - len(tail):] = tail
+            present[row, width - len(tail):] = True
+    return values, present, lengths
+
+
+class WindowSums:
+    """Prefix sums of a right-aligned matrix, answering any trailing-window sum in O(1) per row.
+
+    Padding counts as 0 like the short slices of the list-based helpers, while a real NaN candle in the window
+    makes the sum NaN like Python's ``sum`` would.
+    """
+
+    def __init__(self, values, present):
+        rows = values.shape[0]
+        real_nan = np.isnan(values) & present
+        self.width = values.shape[1]
+        self._sums = np.concatenate([np.zeros((rows, 1)), np.cumsum(np.where(present & ~real_nan, values, 0.0),
+                                                                    axis=1)], axis=1)
+        self._nans = np.concatenate([np.zeros((rows, 1), dtype=int), np.cumsum(real_nan, axis=1)], axis=1)
+
+    def sum(self, window, shift_back=0):
+        """Sum of the ``window`` values that end ``shift_back`` candles before the last one."""
+        end = self.width - shift_back
+        start = end - window
+        total = self._sums[:, end] - self._sums[:, start]
+        return np.where(self._nans[:, end] - self._nans[:, start] > 0, np.nan, total)
+
+
+def ratio(numerator, denominator, defined=True):
+    """``numerator / denominator if denominator else 0`` element-wise, ``defined`` marking where the denominator
+    is not None."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(defined & (denominator != 0), numerator / np.where(denominator == 0, 1, denominator), 0.0)
+
+
+def max_movement(closes, present, period):
+    """``get_close_max_movement_last_period`` for every row: largest absolute daily change over the last
+    ``period - 1`` candles."""
+    width = closes.shape[1]
+    previous = closes[:, width - period + 2 - 1:-1]
+    current = closes[:, width - period + 2:]
+    pairs = present[:, width - period + 2 - 1:-1] & present[:, width - period + 2:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = np.where(previous == 0, 0.0, (current - previous) / previous)
+    moves = np.where(pairs & ~np.isnan(changes), np.abs(changes), -np.inf)
+    result = moves.max(axis=1)
+    # Python's max skips NaN changes unless the very first one is NaN
+    first = np.argmax(pairs, axis=1)
+    first_nan = np.isnan(changes[np.arange(len(changes)), first])
+    return np.where(np.isneginf(result) | first_nan, np.nan, result)
+
+
+def feature_table(price_data, tickers):
+    """One row per ticker with every indicator ``screen_stocks.screen`` checks, indexed by ticker."""
+    tickers = list(tickers)
+    closes, present, lengths = aligned_matrix(price_data, tickers, "close", HISTORY + 1)
+    volumes, _, _ = aligned_matrix(price_data, tickers, "volume", HISTORY + 1)
+    datetimes, _, _ = aligned_matrix(price_data, tickers, "datetime", 2)
+    close_sums = WindowSums(closes, present)
+    volume_sums = WindowSums(volumes, present)
+
+    sma = {}
+    for window, shift_back in ((10, 1), (50, 1), (150, 1), (200, 1), (200, 22)):
+        sma[(window, shift_back)] = close_sums.sum(window, shift_back) / window
+    sma10, sma50, sma150, sma200 = sma[(10, 1)], sma[(50, 1)], sma[(150, 1)], sma[(200, 1)]
+    sma200_22 = sma[(200, 22)]
+    has = {window: lengths >= window for window in (10, 50, 150, 200)}
+
+    latest_close = closes[:, -1]
+    yesterday_close = closes[:, -2]
+    volume = volumes[:, -1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        price_change = np.where(yesterday_close == 0, 0.0, (latest_close - yesterday_close) / yesterday_close) * 100
+
+    avg_volume100 = np.where(lengths >= 100, volume_sums.sum(100) / 100, 0.0)
+
+    features = pd.DataFrame({
+        "length": lengths,
+        "close": latest_close,
+        "yesterday_close": yesterday_close,
+        "volume": volume,
+        "datetime": np.nan_to_num(datetimes[:, -1], nan=0).astype(np.int64),
+        "price_change": price_change,
+        "close_sma10": ratio(latest_close, sma10, has[10]),
+        "close_sma50": ratio(latest_close, sma50, has[50]),
+        "close_sma150": ratio(latest_close, sma150, has[150]),
+        "close_sma200": ratio(latest_close, sma200, has[200]),
+        "sma50_sma150": ratio(sma50, sma150, has[150]),
+        "sma50_sma200": ratio(sma50, sma200, has[200]),
+        "sma150_sma200": ratio(sma150, sma200, has[200]),
+        "trending_up": ratio(sma200, sma200_22, has[200]),
+        "avg_volume100": avg_volume100,
+        "volume_volume100": ratio(volume, avg_volume100),
+        "max_mov5": max_movement(closes, present, 5) * 100,
+        "max_mov100": max_movement(closes, present, 100) * 100,
+    }, index=pd.Index(tickers, name="ticker"))
+    return add_mm_score(features)
+
+
+def add_mm_score(features):
+    """Adds how many ``MM_COLUMNS`` ratios are above 1 and whether all of them are."""
+    features["mm_score"] = (features[MM_COLUMNS] > 1).sum(axis=1)
+    features["mm_pass"] = features["mm_score"] >= len(MM_COLUMNS)
+    return features
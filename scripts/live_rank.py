@@ -0,0 +1,290 @@
+"""Intraday re-ranking on a provisional bar of fresh quotes.
+
+During the day only the last bar of every ticker changes, so ``LiveRanker``
+builds the end-of-day state of the universe once and then only applies
+quotes to it:
+
+- the closes of the RS windows. With a bar added today the 1, 3 and 6 month
+  lookbacks just move one candle, so their strengths are known before any
+  quote comes in. So are the first closes of the quarter windows of the RS
+  now, which leaves one division per quarter per quoted ticker.
+- the SMA sums. The screen's SMAs end the candle before the last one, which
+  is now yesterday's, so they are fixed for the day.
+- the breakout lookbacks. For every candidate ticker these are the closes no
+  later close has reached yet, the stack ``price_store.days_since_higher``
+  ends with, so the days since a higher close are a binary search.
+
+Every batch of quotes gives the intraday RS percentiles of the whole universe
+and the breakout candidates among the quoted tickers of its top fifth, with
+the same values ``rankings`` and ``screen`` would compute if the quotes were
+stored as today's candles. Tickers without a quote keep their end-of-day RS.
+The fundamentals checks of the screen are left to the end-of-day run, and the
+provisional ranking is never written to the RS store.
+
+    python -m scripts.live_rank --interval 3600
+    python -m scripts.live_rank --quotes quotes.json
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts import indicators
+from scripts import metrics
+from scripts import price_store
+from scripts import rs_data
+from scripts import rs_ranking
+from scripts import screen_stocks
+from scripts import trading_calendar
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+# Closes kept per ticker: the RS windows are longer than the screen's SMAs
+WIDTH = max(rs_ranking.RS_HISTORY, indicators.HISTORY + 1)
+SMA_WINDOWS = (10, 50, 150, 200)
+# Candles of the longest daily move the screen checks, plus today's
+MOVEMENT_WIDTH = 100 + 1
+
+
+def today_timestamp():
+    """Market close stamp of today's candle, the same in every time zone: the history ends before it."""
+    return trading_calendar.date_to_timestamp(datetime.date.today().strftime("%Y-%m-%d"))
+
+
+def end_of_day(PRICE_DATA, day):
+    """Every ticker's candles before ``day``, without copying them. Tickers with none are left out."""
+    history = {}
+    for ticker in PRICE_DATA:
+        prices = PRICE_DATA[ticker]
+        cut = int(np.searchsorted(price_store.column(prices, "datetime"), day, side="left"))
+        if cut:
+            history[ticker] = {"candles": prices["candles"][:cut]}
+    return history
+
+
+def higher_values(values):
+    """Positions and values of the candles no later candle is above, the stack ``days_since_higher`` ends with."""
+    values = np.asarray(values, dtype=float)
+    later = np.append(np.fmax.accumulate(values[::-1])[::-1][1:], np.nan)
+    later = np.where(np.isnan(later), -np.inf, later)
+    positions = np.flatnonzero(values >= later)
+    return positions, values[positions]
+
+
+def since_higher(stack, length, value):
+    """``days_since_higher`` of ``value`` appended after ``length`` candles whose ``higher_values`` are ``stack``."""
+    positions, values = stack
+    # The stack's values never increase, the nearest one at or above the value is the last of those at or above it
+    count = len(values) - int(np.searchsorted(values[::-1], value, side="left"))
+    return length - int(positions[count - 1]) if count else 0
+
+
+def last_higher(distance):
+    """``screen_stocks.find_last_higher`` of a ``days_since_higher`` distance."""
+    return distance if distance else screen_stocks.NOT_FOUND
+
+
+class LiveRanker:
+    """End-of-day state of the universe as of the day before ``day``, ranked again for every batch of quotes."""
+
+    def __init__(self, PRICE_DATA, day=None):
+        self.day = today_timestamp() if day is None else day
+        self.history = end_of_day(PRICE_DATA, self.day)
+        self.tickers = list(self.history)
+        self.rows = {ticker: row for row, ticker in enumerate(self.tickers)}
+        self.closes, self.present, self.lengths = indicators.aligned_matrix(self.history, self.tickers, "close",
+                                                                            WIDTH)
+        volumes, _, _ = indicators.aligned_matrix(self.history, self.tickers, "volume", WIDTH)
+
+        rs_closes = self.closes[:, -rs_ranking.RS_HISTORY:]
+        self.eod_strengths = rs_ranking.strength_matrix(rs_closes)
+        # Today's close goes in the last column, any valid value stands in for it until the quotes come
+        shifted = np.concatenate([rs_closes[:, 1:], np.ones((len(self.tickers), 1))], axis=1)
+        self.day_strengths = rs_ranking.strength_matrix(shifted)
+        self.bases, self.failed = rs_ranking.quarter_bases(shifted, rs_ranking.next_valid_columns(shifted),
+                                                           shifted.shape[1] - 1)
+
+        close_sums = indicators.WindowSums(self.closes, self.present)
+        self.sma = {window: close_sums.sum(window) / window for window in SMA_WINDOWS}
+        self.sma200_22 = close_sums.sum(200, 21) / 200
+        self.volume_sum99 = indicators.WindowSums(volumes, self.present).sum(99)
+        self._higher = {}
+
+    def _stack(self, ticker, field):
+        key = (ticker, field)
+        if key not in self._higher:
+            self._higher[key] = higher_values(price_store.column(self.history[ticker], field))
+        return self._higher[key]
+
+    def parse(self, quotes):
+        """Rows, closes and volumes of ``{ticker: close}`` or ``{ticker: {"close": ..., "volume": ...}}`` quotes of
+        known tickers."""
+        rows, closes, volumes = [], [], []
+        for ticker, quote in quotes.items():
+            close, volume = (quote.get("close"), quote.get("volume")) if isinstance(quote, dict) else (quote, None)
+            if ticker not in self.rows or close is None or not np.isfinite(close):
+                continue
+            rows.append(self.rows[ticker])
+            closes.append(close)
+            volumes.append(np.nan if volume is None else volume)
+        return np.array(rows, dtype=int), np.array(closes, dtype=float), np.array(volumes, dtype=float)
+
+    def ranking(self, rows, closes):
+        """``rankings`` of the universe with ``closes`` as today's candle of the tickers at ``rows``."""
+        strengths = self.eod_strengths.copy()
+        strengths[rows, 1:] = self.day_strengths[rows, 1:]
+        strengths[rows, 0] = rs_ranking.weighted_strength(closes, [base[rows] for base in self.bases],
+                                                          self.failed[rows])
+        lengths = self.lengths.copy()
+        lengths[rows] += 1
+        eligible = lengths >= 6 * rs_ranking.MONTH
+        reference = strengths[[self.rows[rs_ranking.REFERENCE_TICKER]]]
+        rs = rs_ranking.relative_strengths(strengths[eligible], reference)
+
+        ranking = rs_ranking.ranking_frame([ticker for ticker, kept in zip(self.tickers, eligible) if kept], rs)
+        ranking = ranking.sort_values([rs_ranking.TITLE_RS], ascending=False).reset_index(drop=True)
+        ranking[rs_ranking.TITLE_RANK] = ranking.index + 1
+        return ranking[ranking[rs_ranking.TITLE_PERCENTILE] >= (rs_ranking.MIN_PERCENTILE or 0)]
+
+    def features(self, rows, closes, volumes):
+        """``indicators.feature_table`` of the tickers at ``rows`` with today's candle added."""
+        lengths = self.lengths[rows] + 1
+        has = {window: lengths >= window for window in SMA_WINDOWS}
+        sma = {window: self.sma[window][rows] for window in SMA_WINDOWS}
+        sma200_22 = self.sma200_22[rows]
+        yesterday = self.closes[rows, -1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            price_change = np.where(yesterday == 0, 0.0, (closes - yesterday) / yesterday) * 100
+        avg_volume100 = np.where(lengths >= 100, (self.volume_sum99[rows] + volumes) / 100, 0.0)
+        movement_closes = np.concatenate([self.closes[rows, -(MOVEMENT_WIDTH - 1):], closes[:, None]], axis=1)
+        movement_present = np.concatenate([self.present[rows, -(MOVEMENT_WIDTH - 1):],
+                                           np.ones((len(rows), 1), dtype=bool)], axis=1)
+
+        features = pd.DataFrame({
+            "length": lengths,
+            "close": closes,
+            "yesterday_close": yesterday,
+            "volume": volumes,
+            "datetime": np.full(len(rows), self.day, dtype=np.int64),
+            "price_change": price_change,
+            "close_sma10": indicators.ratio(closes, sma[10], has[10]),
+            "close_sma50": indicators.ratio(closes, sma[50], has[50]),
+            "close_sma150": indicators.ratio(closes, sma[150], has[150]),
+            "close_sma200": indicators.ratio(closes, sma[200], has[200]),
+            "sma50_sma150": indicators.ratio(sma[50], sma[150], has[150]),
+            "sma50_sma200": indicators.ratio(sma[50], sma[200], has[200]),
+            "sma150_sma200": indicators.ratio(sma[150], sma[200], has[200]),
+            "trending_up": indicators.ratio(sma[200], sma200_22, has[200]),
+            "avg_volume100": avg_volume100,
+            "volume_volume100": indicators.ratio(volumes, avg_volume100),
+            "max_mov5": indicators.max_movement(movement_closes, movement_present, 5) * 100,
+            "max_mov100": indicators.max_movement(movement_closes, movement_present, 100) * 100,
+        }, index=pd.Index([self.tickers[row] for row in rows], name="ticker"))
+        return indicators.add_mm_score(features)
+
+    def breakouts(self, ranking, rows, closes, volumes):
+        """The quoted tickers of the ranking's top fifth that pass the screen's trend template and breakout test."""
+        quoted = {self.tickers[row]: i for i, row in enumerate(rows)}
+        leaders = [ticker for ticker in ranking[rs_ranking.TITLE_TICKER].head((len(ranking) + 1) // 5)
+                   if ticker in quoted]
+        picks = np.array([quoted[ticker] for ticker in leaders], dtype=int)
+        features = self.features(rows[picks], closes[picks], volumes[picks])
+        candidates = features[features["mm_pass"] & (features["price_change"] > 0) & (features["price_change"] < 8)]
+
+        results = []
+        for ticker, feature in candidates.iterrows():
+            length = self.lengths[self.rows[ticker]]
+            last_max_price = last_higher(since_higher(self._stack(ticker, "close"), length, feature["close"]))
+            yesterday_distance = int(price_store.column(self.history[ticker], "close_since_higher")[-1])
+            last_max_price_yesterday = yesterday_distance + 1 if yesterday_distance else screen_stocks.NOT_FOUND
+            if last_max_price > 90 > last_max_price_yesterday > 2:
+                results.append({
+                    "Ticker": ticker,
+                    "Price change": feature["price_change"],
+                    "Scores": f"{int(feature['mm_score'])}/7",
+                    "Last max price": last_max_price,
+                    "Last max volume": last_higher(since_higher(self._stack(ticker, "volume"), length,
+                                                                feature["volume"])),
+                    "Close / SMA10": feature["close_sma10"],
+                    "Max mov5": feature["max_mov5"],
+                    "Max mov100": feature["max_mov100"],
+                })
+        breakouts = pd.DataFrame(results, columns=["Ticker", "Price change", "Scores", "Last max price",
+                                                   "Last max volume", "Close / SMA10", "Max mov5", "Max mov100"])
+        columns = [rs_ranking.TITLE_TICKER, rs_ranking.TITLE_RANK, rs_ranking.TITLE_RS, rs_ranking.TITLE_PERCENTILE]
+        return breakouts.merge(ranking[columns], on=rs_ranking.TITLE_TICKER, how="left")
+
+    @metrics.timed("live_rank")
+    def apply(self, quotes):
+        """Intraday ranking of the universe and breakout candidates with ``quotes`` as today's bar."""
+        rows, closes, volumes = self.parse(quotes)
+        ranking = self.ranking(rows, closes)
+        return ranking, self.breakouts(ranking, rows, closes, volumes)
+
+
+def yahoo_quotes(tickers, day, batch_size=rs_data.BATCH_SIZE):
+    """Close and volume so far of the bar of ``day`` of every ticker, downloaded through the rs_data engine."""
+    start_date = trading_calendar.timestamp_to_date(day)
+    end_date = (datetime.datetime.strptime(start_date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    quotes = {}
+    for i in range(0, len(tickers), batch_size):
+        fetched, _ = rs_data.get_yf_data_batch(tickers[i:i + batch_size], start_date, end_date)
+        for ticker, ticker_data in fetched.items():
+            candle = ticker_data["candles"][-1]
+            quotes[ticker] = {"close": candle["close"], "volume": candle["volume"]}
+    return quotes
+
+
+def read_quotes(file_path):
+    """``{ticker: close}`` or ``{ticker: {"close": ..., "volume": ...}}`` from a JSON file."""
+    with open(file_path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def write_results(file_path, ranking, breakouts, quote_count):
+    results = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "quotes": quote_count,
+        "ranking": ranking.to_dict("records"),
+        "breakouts": breakouts.to_dict("records"),
+    }
+    tmp_path = f'{file_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(results, f)
+    os.replace(tmp_path, file_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-rank the universe on intraday quotes")
+    parser.add_argument("--quotes", help="JSON file of quotes, downloaded from Yahoo by default")
+    parser.add_argument("--interval", type=float, default=None, help="seconds between runs, one run by default")
+    parser.add_argument("--top", type=int, default=20, help="rows of the ranking to print")
+    parser.add_argument("--output", help="JSON file to write the ranking and breakouts of every run to")
+    args = parser.parse_args()
+
+    ranker = None
+    while True:
+        if ranker is None or ranker.day != today_timestamp():
+            ranker = LiveRanker(rs_ranking.load_data())
+            print(f"End-of-day state of {len(ranker.tickers)} tickers ready")
+
+        quotes = read_quotes(args.quotes) if args.quotes else yahoo_quotes(ranker.tickers, ranker.day)
+        start = time.perf_counter()
+        ranking, breakouts = ranker.apply(quotes)
+        print(f"Ranked {len(ranking)} tickers on {len(quotes)} quotes in {time.perf_counter() - start:.3f}s\n")
+        print(ranking.head(args.top))
+        print("\nNo breakouts\n" if breakouts.empty else f"\n{breakouts}\n")
+        if args.output:
+            write_results(args.output, ranking, breakouts, len(quotes))
+
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+    metrics.report("live_rank")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Run metrics: time spent per stage, counters and peak memory.
+
+    with metrics.span("fetch"):
+        ...
+    metrics.increment("retries")
+    metrics.export("rs_data_07")
+
+A span adds its wall time to the total of its name every time it is exited,
+so spans run from several fetch workers at once add up their busy time.
+Counters and spans are safe to use from threads. Peak RSS is sampled every
+time a span ends. ``export`` writes the metrics of the run to
+``metrics/<run>.json`` and ``metrics/<run>.prom`` (Prometheus text format),
+one pair of files per run name that every run overwrites. The directory is
+gitignored, the workflows upload it as a build artifact.
+
+Work done in worker processes is not seen by the parent's registry, pools
+report it with ``observe`` from the parent instead.
+"""
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+METRICS_DIR = os.path.join(os.path.dirname(DIR), 'metrics')
+PREFIX = "mmr"
+
+
+def max_rss_bytes():
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.spans = {}
+            self.counters = {}
+            self.peak_rss = max_rss_bytes()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """Adds ``seconds`` spent in ``name``, for work timed elsewhere."""
+        rss = max_rss_bytes()
+        with self._lock:
+            span = self.spans.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            span["calls"] += 1
+            span["seconds"] += seconds
+            span["max_seconds"] = max(span["max_seconds"], seconds)
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, run):
+        with self._lock:
+            return {
+                "run": run,
+                "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "wall_seconds": time.time() - self.started,
+                "peak_rss_bytes": max(self.peak_rss, max_rss_bytes()),
+                "spans": {name: dict(span) for name, span in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self, run):
+        """The metrics of the run in the Prometheus text exposition format."""
+        snapshot = self.snapshot(run)
+        label = f'run="{run}"'
+        lines = [
+            f"# TYPE {PREFIX}_run_seconds gauge",
+            f"{PREFIX}_run_seconds{{{label}}} {snapshot['wall_seconds']:.6f}",
+            f"# TYPE {PREFIX}_peak_rss_bytes gauge",
+            f"{PREFIX}_peak_rss_bytes{{{label}}} {snapshot['peak_rss_bytes']}",
+        ]
+        for metric, key, kind in (("span_seconds_total", "seconds", "counter"),
+                                  ("span_calls_total", "calls", "counter"),
+                                  ("span_max_seconds", "max_seconds", "gauge")):
+            lines.append(f"# TYPE {PREFIX}_{metric} {kind}")
+            lines.extend(f'{PREFIX}_{metric}{{{label},span="{name}"}} {span[key]}'
+                         for name, span in sorted(snapshot["spans"].items()))
+        lines.append(f"# TYPE {PREFIX}_events_total counter")
+        lines.extend(f'{PREFIX}_events_total{{{label},name="{name}"}} {value}'
+                     for name, value in sorted(snapshot["counters"].items()))
+        return "\n".join(lines) + "\n"
+
+    def export(self, run, directory=None):
+        """Writes ``<run>.json`` and ``<run>.prom`` to ``directory`` and returns the JSON path."""
+        directory = METRICS_DIR if directory is None else directory
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f'{run}.json')
+        for path, text in ((json_path, json.dumps(self.snapshot(run), indent=2)),
+                           (os.path.join(directory, f'{run}.prom'), self.prometheus(run))):
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        return json_path
+
+    def summary(self):
+        """One line per span, the slowest first."""
+        spans = sorted(self.spans.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        lines = [f"{name:<20} {span['seconds']:>10.2f}s in {span['calls']} calls" for name, span in spans]
+        lines.extend(f"{name:<20} {value:>10}" for name, value in sorted(self.counters.items()))
+        lines.append(f"{'peak RSS':<20} {max(self.peak_rss, max_rss_bytes()) / (1024 * 1024):>10.1f} MB")
+        return "\n".join(lines)
+
+
+REGISTRY = Metrics()
+span = REGISTRY.span
+observe = REGISTRY.observe
+increment = REGISTRY.increment
+export = REGISTRY.export
+reset = REGISTRY.reset
+
+
+def timed(name):
+    """Decorator running every call of the function in ``span(name)``."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report(run):
+    """Prints the summary of the run and exports it."""
+    print(REGISTRY.summary())
+    path = export(run)
+    print(f"Metrics written to {path}")
@@ -0,0 +1,754 @@
+"""Columnar, memory-mapped price store.
+
+Every shard lives in ``data_persist/price_store/<shard>/`` and holds one
+contiguous little-endian array per candle field (``<field>.<generation>.bin``)
+plus an ``index.json`` mapping each ticker to its ``[offset, length]`` in those
+arrays. Readers open the arrays with ``numpy.memmap`` so only the pages that
+are actually touched get loaded.
+
+A write never modifies the files of an index another process may have read:
+it writes the columns of a new generation, then replaces ``index.json``, and
+only then removes the generation before the previous one. A shard maps every
+column of its generation as it opens, so it keeps reading the data it was
+opened with while the shard is refreshed.
+
+Next to the candle fields every shard also stores derived columns computed
+once at write time, such as how many candles back the previous close at or
+above each close is, so the breakout checks become lookups.
+
+Tickers are assigned to ``SHARD_COUNT`` shards by a stable hash of their
+symbol, which spreads them evenly instead of by first letter. Every shard's
+``index.json`` records its row count, date range and column checksums, and
+``manifest.json`` gathers them with the shard each ticker is read from, so a
+reader that only needs a few tickers opens only their shards. The manifest is
+rebuilt whenever a shard was written after it, which lets the update jobs
+write their shards in parallel without touching a shared file.
+
+Only the JSON shards are committed. The store is rebuilt from them, by the
+update workflow and by ``rs_ranking.load_data`` for every shard it lacks.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from scripts import metrics
+from scripts.config import cfg
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(os.path.dirname(DIR), 'data_persist')
+STORE_DIR = os.path.join(DATA_DIR, 'price_store')
+INDEX_FILE = 'index.json'
+MANIFEST_FILE = 'manifest.json'
+JSON_SUFFIX = '_price_history.json.gz'
+STORE_VERSION = 4
+# Number of hash shards the tickers are spread over, the update workflow runs one job per shard. Set in config.yaml
+# only, which the workflow reads too.
+SHARD_COUNT = int(cfg("SHARD_COUNT"))
+# Fetched into every shard next to its own tickers
+SHARED_TICKERS = ("SPY", "^VIX")
+# Memory PriceData keeps the histories it has read in
+CACHE_BYTES = 256 * 1024 * 1024
+# Times a shard re-reads its index when a refresh removed the columns of the one it read first
+OPEN_ATTEMPTS = 5
+
+# Same key order as the candle dicts built by rs_data.get_yf_data
+FIELDS = ("open", "close", "low", "high", "volume", "datetime")
+DTYPES = {
+    "open": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+    "datetime": np.dtype("<i8"),
+    "close_since_higher": np.dtype("<i4"),
+    "volume_since_higher": np.dtype("<i4"),
+}
+# Derived column -> the candle field it is computed from with days_since_higher
+DERIVED_FIELDS = {
+    "close_since_higher": "close",
+    "volume_since_higher": "volume",
+}
+
+
+class Candles:
+    """Read-only sequence view over one ticker's rows in a set of columns.
+
+    Supports the ``candles[-1]["close"]`` / ``len(candles)`` / slicing access
+    patterns of the old list of candle dicts without materializing it, and
+    exposes each field as a zero-copy numpy array through ``column``.
+    """
+    __slots__ = ("_columns", "_start", "_stop")
+
+    def __init__(self, columns, start, stop):
+        self._columns = columns
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __bool__(self):
+        return self._stop > self._start
+
+    def __iter__(self):
+        for i in range(self._start, self._stop):
+            yield self._candle(i)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return Candles(self._columns, self._start + start, self._start + max(start, stop))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("candle index out of range")
+        return self._candle(self._start + item)
+
+    def _candle(self, i):
+        return {field: self._columns[field][i].item() for field in FIELDS}
+
+    def column(self, field):
+        return self._columns[field][self._start:self._stop]
+
+
+def column_file(path, field, generation=None):
+    """Column file of ``field`` in the shard directory ``path``, as written by ``generation``.
+
+    Shards written before the generations have a single ``<field>.bin``.
+    """
+    return os.path.join(path, f'{field}.bin' if generation is None else f'{field}.{generation}.bin')
+
+
+class Shard:
+    """Memory-maps the column files of one shard directory, all of them as it opens.
+
+    Only the pages that are read get loaded, but the files are those of the index read at opening: a refresh of
+    the shard writes new files and leaves an open shard on the old ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for attempt in range(OPEN_ATTEMPTS):
+            with open(os.path.join(path, INDEX_FILE), 'r', encoding='utf8') as f:
+                meta = json.load(f)
+            try:
+                self._arrays = _map_columns(path, meta)
+                break
+            except FileNotFoundError:
+                # Refreshed twice since the index was read, its columns are gone: read the new index
+                if attempt == OPEN_ATTEMPTS - 1:
+                    raise
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.index = meta["tickers"]
+        self.generation = meta.get("generation")
+
+    def __getitem__(self, field):
+        array = self._arrays.get(field)
+        if array is None:
+            if field not in DERIVED_FIELDS:
+                raise KeyError(field)
+            # Shard written before the column existed, derive it in memory
+            array = _derive(self[DERIVED_FIELDS[field]], self.index.values())
+            self._arrays[field] = array
+        return array
+
+    def candles(self, ticker):
+        offset, length = self.index[ticker]
+        return Candles(self, offset, offset + length)
+
+
+class PriceStore(Mapping):
+    """``ticker -> {"candles": Candles}`` mapping over every shard of the store.
+
+    SPY and ^VIX are fetched into every shard, so when a ticker appears more
+    than once the copy with the most recent last candle wins.
+
+    With ``tickers`` the mapping only holds those tickers and only the shards
+    the manifest reads them from are opened.
+    """
+
+    def __init__(self, directory=STORE_DIR, tickers=None):
+        self.directory = directory
+        self.shards = {}
+        self._locations = {}
+        if tickers is not None:
+            locations = manifest(directory)["locations"]
+            for ticker in tickers:
+                name = locations.get(ticker)
+                if name is None:
+                    continue
+                if name not in self.shards:
+                    self.shards[name] = Shard(os.path.join(directory, name))
+                self._locations[ticker] = self.shards[name]
+            return
+
+        for name in shard_names(directory):
+            shard = Shard(os.path.join(directory, name))
+            self.shards[name] = shard
+            for ticker in shard.index:
+                current = self._locations.get(ticker)
+                if current is None or _last_datetime(shard, ticker) > _last_datetime(current, ticker):
+                    self._locations[ticker] = shard
+
+    def location(self, ticker):
+        """Name of the shard ``ticker`` is read from."""
+        return os.path.basename(self._locations[ticker].path)
+
+    def __getitem__(self, ticker):
+        return {"candles": self._locations[ticker].candles(ticker)}
+
+    def __contains__(self, ticker):
+        return ticker in self._locations
+
+    def __iter__(self):
+        return iter(self._locations)
+
+    def __len__(self):
+        return len(self._locations)
+
+
+class PriceData(Mapping):
+    """Lazy ``ticker -> {"candles": Candles}`` mapping that reads a ticker only when it is first accessed.
+
+    Opening it only reads the manifest. A ticker's rows are copied out of its shard the first time it is looked up
+    and kept in a least-recently-used cache of at most ``max_bytes``, so a tool that touches a few hundred tickers
+    starts right away and stays small however large the universe is.
+    """
+
+    def __init__(self, directory=STORE_DIR, tickers=None, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.shards = {}
+        self._locations = manifest(directory)["locations"]
+        if tickers is not None:
+            self._locations = {ticker: self._locations[ticker] for ticker in tickers if ticker in self._locations}
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _shard(self, name):
+        shard = self.shards.get(name)
+        if shard is None:
+            shard = Shard(os.path.join(self.directory, name))
+            self.shards[name] = shard
+        return shard
+
+    def _read(self, ticker):
+        shard = self._shard(self._locations[ticker])
+        offset, length = shard.index[ticker]
+        columns = {field: np.array(shard[field][offset:offset + length]) for field in DTYPES}
+        return Candles(columns, 0, length)
+
+    def __getitem__(self, ticker):
+        candles = self._cache.get(ticker)
+        if candles is not None:
+            self._cache.move_to_end(ticker)
+            self.hits += 1
+            metrics.increment("price_cache_hits")
+            return {"candles": candles}
+
+        candles = self._read(ticker)
+        self.misses += 1
+        metrics.increment("price_cache_misses")
+        self._cache[ticker] = candles
+        self._bytes += _nbytes(candles)
+        # Always keep the history just read, even when it alone is over the budget
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._bytes -= _nbytes(evicted)
+        return {"candles": candles}
+
+    def __contains__(self, ticker):
+        return ticker in self._locations
+
+    def __iter__(self):
+        return iter(self._locations)
+
+    def __len__(self):
+        return len(self._locations)
+
+    def location(self, ticker):
+        return self._locations[ticker]
+
+    @property
+    def cached_bytes(self):
+        return self._bytes
+
+
+def _map_columns(path, meta):
+    """Memory maps of every column file of the shard generation ``meta`` describes."""
+    generation = meta.get("generation")
+    arrays = {}
+    for field, dtype in DTYPES.items():
+        file_path = column_file(path, field, generation)
+        if meta["rows"] == 0:
+            arrays[field] = np.empty(0, dtype=dtype)
+        elif generation is not None or field not in DERIVED_FIELDS or os.path.exists(file_path):
+            arrays[field] = np.memmap(file_path, dtype=dtype, mode='r', shape=(meta["rows"],))
+    return arrays
+
+
+def _nbytes(candles):
+    return sum(array.nbytes for array in candles._columns.values())
+
+
+class AsOfView(Mapping):
+    """Every ticker's history as of ``timestamp``, without copying any candle.
+
+    Same cut as the old filter_price_data_by_index: up to and including the first
+    candle at or after ``timestamp``, leaving out tickers whose history ends
+    before it. The cut is found with a binary search on the timestamp column and
+    only for the tickers that are actually accessed.
+    """
+
+    def __init__(self, price_data, timestamp):
+        self.price_data = price_data
+        self.timestamp = timestamp
+        self._cutoffs = {}
+
+    def _cutoff(self, ticker):
+        cutoff = self._cutoffs.get(ticker)
+        if cutoff is None:
+            cutoff = as_of_index(self.price_data[ticker].get("candles", []), self.timestamp)
+            self._cutoffs[ticker] = cutoff
+        return cutoff
+
+    def __getitem__(self, ticker):
+        if ticker not in self.price_data or self._cutoff(ticker) < 0:
+            raise KeyError(ticker)
+        return {"candles": self.price_data[ticker]["candles"][:self._cutoff(ticker) + 1]}
+
+    def __contains__(self, ticker):
+        return ticker in self.price_data and self._cutoff(ticker) >= 0
+
+    def __iter__(self):
+        for ticker in self.price_data:
+            if self._cutoff(ticker) >= 0:
+                yield ticker
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def as_of_index(candles, timestamp):
+    """Index of the first candle at or after ``timestamp``, -1 if there is none."""
+    if isinstance(candles, Candles):
+        cutoff = int(np.searchsorted(candles.column("datetime"), timestamp, side="left"))
+        return cutoff if cutoff < len(candles) else -1
+    for i, candle in enumerate(candles):
+        if candle["datetime"] >= timestamp:
+            return i
+    return -1
+
+
+def days_since_higher(values):
+    """For every position, how many candles back the nearest earlier value at or above it is, 0 when there is none.
+
+    Same answer as scanning backwards from every position, but in one pass: the stack only keeps the candles no
+    later candle has reached yet, and each candle is pushed and popped at most once.
+    """
+    values = np.asarray(values, dtype=float).tolist()
+    result = [0] * len(values)
+    stack = []
+    for i, value in enumerate(values):
+        # A NaN is never at or above anything, and nothing is at or above it
+        if value != value:
+            continue
+        while stack and values[stack[-1]] < value:
+            stack.pop()
+        if stack:
+            result[i] = i - stack[-1]
+        stack.append(i)
+    return np.array(result, dtype=np.int32)
+
+
+def _derive(source, locations):
+    """days_since_higher of every ticker's slice of a shard-wide column."""
+    derived = np.zeros(len(source), dtype=np.int32)
+    for offset, length in locations:
+        derived[offset:offset + length] = days_since_higher(source[offset:offset + length])
+    return derived
+
+
+def _last_datetime(shard, ticker):
+    offset, length = shard.index[ticker]
+    if length == 0:
+        return -1
+    return int(shard["datetime"][offset + length - 1])
+
+
+def column(prices, field):
+    """Returns one field of a ticker's history as a numpy array.
+
+    Works for both store-backed ``Candles`` (zero-copy) and the legacy list of
+    candle dicts.
+    """
+    candles = prices["candles"]
+    if isinstance(candles, Candles):
+        return candles.column(field)
+    if field in DERIVED_FIELDS:
+        return days_since_higher(column(prices, DERIVED_FIELDS[field]))
+    return np.array([candle[field] for candle in candles], dtype=DTYPES[field])
+
+
+def _to_columns(tickers_dict):
+    """Concatenates ``{ticker: {"candles": ...}}`` into one array per field plus the ticker index."""
+    index = {}
+    columns = {field: [] for field in FIELDS}
+    offset = 0
+    for ticker, data in tickers_dict.items():
+        candles = data.get("candles") or []
+        length = len(candles)
+        for field in FIELDS:
+            if isinstance(candles, Candles):
+                values = np.asarray(candles.column(field), dtype=DTYPES[field])
+            elif field == "datetime":
+                values = np.array([candle[field] for candle in candles], dtype=DTYPES[field])
+            else:
+                values = np.array([np.nan if candle.get(field) is None else candle[field] for candle in candles],
+                                  dtype=DTYPES[field])
+            columns[field].append(values)
+        index[ticker] = [offset, length]
+        offset += length
+
+    columns = {field: np.concatenate(values) if values else np.empty(0, dtype=DTYPES[field])
+               for field, values in columns.items()}
+    for field, source in DERIVED_FIELDS.items():
+        columns[field] = _derive(columns[source], index.values())
+    return columns, index
+
+
+def columnar(tickers_dict):
+    """In-memory equivalent of an opened store for a ``{ticker: {"candles": [...]}}`` dict."""
+    columns, index = _to_columns(tickers_dict)
+    return {ticker: {"candles": Candles(columns, offset, offset + length)}
+            for ticker, (offset, length) in index.items()}
+
+
+def shard_of(ticker, shard_count=SHARD_COUNT):
+    """Index of the hash shard of ``ticker``, CRC-32 of the symbol so it is the same in every process and run."""
+    return zlib.crc32(ticker.encode('utf-8')) % shard_count
+
+
+def shard_name(index):
+    return f'{index:02d}'
+
+
+def shard_tickers(tickers, index, shard_count=SHARD_COUNT):
+    """The tickers of ``tickers`` that hash to shard ``index``."""
+    return [ticker for ticker in tickers if shard_of(ticker, shard_count) == index]
+
+
+def shard_names(directory=STORE_DIR):
+    """Every shard written in ``directory``, hash and letter shards alike."""
+    if not os.path.isdir(directory):
+        return []
+    return [name for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name, INDEX_FILE))]
+
+
+def checksum(array):
+    return format(zlib.crc32(np.ascontiguousarray(array).view(np.uint8)), '08x')
+
+
+def _summary(columns, index, shard_count, generation):
+    """Contents of a shard's ``index.json``."""
+    rows = len(columns["datetime"])
+    return {
+        "version": STORE_VERSION,
+        "generation": generation,
+        "rows": rows,
+        "shard_count": shard_count,
+        "first_datetime": int(columns["datetime"].min()) if rows else None,
+        "last_datetime": int(columns["datetime"].max()) if rows else None,
+        "checksums": {field: checksum(values) for field, values in columns.items()},
+        "tickers": index,
+    }
+
+
+def write_shard(shard, tickers_dict, directory=STORE_DIR, shard_count=None):
+    """Writes ``{ticker: {"candles": ...}}`` as one columnar shard.
+
+    ``shard_count`` is the number of hash shards ``shard`` is one of, None for a letter shard.
+    """
+    write_columns(shard, *_to_columns(tickers_dict), directory=directory, shard_count=shard_count)
+
+
+@metrics.timed("write")
+def write_columns(shard, columns, index, directory=STORE_DIR, shard_count=None):
+    """Writes the output of ``_to_columns`` as one columnar shard."""
+    path = os.path.join(directory, shard)
+    os.makedirs(path, exist_ok=True)
+    previous = _generation(path)
+    generation = 0 if previous is None else previous + 1
+
+    # Write the columns first and the index last so a reader never sees an index pointing past the data
+    for field in columns:
+        tmp_path = f'{column_file(path, field, generation)}.tmp'
+        columns[field].tofile(tmp_path)
+        os.replace(tmp_path, column_file(path, field, generation))
+
+    tmp_path = os.path.join(path, f'{INDEX_FILE}.tmp')
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(_summary(columns, index, shard_count, generation), f)
+    os.replace(tmp_path, os.path.join(path, INDEX_FILE))
+
+    # The previous generation stays for the readers that read its index but have not mapped its columns yet
+    kept = {column_file(path, field, written) for field in DTYPES for written in (generation, previous)}
+    for file_path in glob.glob(os.path.join(path, '*.bin')):
+        if file_path not in kept:
+            os.remove(file_path)
+
+
+def _generation(path):
+    """Generation of the shard written in ``path``, None when there is none or it predates the generations."""
+    try:
+        with open(os.path.join(path, INDEX_FILE), 'r', encoding='utf8') as f:
+            return json.load(f).get("generation")
+    except (OSError, ValueError):
+        return None
+
+
+def _file_checksum(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return format(crc, '08x')
+
+
+def build_manifest(directory=STORE_DIR):
+    """Manifest of every shard of ``directory``: its tickers, rows, date range and checksums, and the shard every
+    ticker is read from."""
+    store = PriceStore(directory)
+    shards = {}
+    for name, shard in store.shards.items():
+        meta = shard.meta
+        if "checksums" not in meta:
+            # Shard written before the summaries, read it once
+            datetimes = shard["datetime"]
+            meta = dict(meta,
+                        first_datetime=int(datetimes.min()) if shard.rows else None,
+                        last_datetime=int(datetimes.max()) if shard.rows else None,
+                        checksums={field: _file_checksum(column_file(shard.path, field))
+                                   for field in DTYPES if os.path.exists(column_file(shard.path, field))})
+        shards[name] = {
+            "generation": shard.generation,
+            "tickers": list(shard.index),
+            "rows": shard.rows,
+            "shard_count": meta.get("shard_count"),
+            "first_datetime": meta["first_datetime"],
+            "last_datetime": meta["last_datetime"],
+            "checksums": meta["checksums"],
+        }
+    shard_counts = {entry["shard_count"] for entry in shards.values()}
+    return {
+        "version": STORE_VERSION,
+        "shard_count": shard_counts.pop() if len(shard_counts) == 1 else None,
+        "shards": shards,
+        "locations": {ticker: store.location(ticker) for ticker in store},
+    }
+
+
+def manifest(directory=STORE_DIR):
+    """The manifest of ``directory``, rebuilt and rewritten first when a shard was written after it."""
+    path = os.path.join(directory, MANIFEST_FILE)
+    names = shard_names(directory)
+    if os.path.exists(path):
+        written = os.path.getmtime(path)
+        with open(path, 'r', encoding='utf8') as f:
+            current = json.load(f)
+        if sorted(current["shards"]) == names and \
+                all(os.path.getmtime(os.path.join(directory, name, INDEX_FILE)) <= written for name in names):
+            return current
+
+    current = build_manifest(directory)
+    os.makedirs(directory, exist_ok=True)
+    # Readers in several processes may rebuild it at once, each writes a temporary file of its own
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=MANIFEST_FILE, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf8') as f:
+        json.dump(current, f)
+    os.replace(tmp_path, path)
+    return current
+
+
+def verify(directory=STORE_DIR):
+    """``(shard, field)`` of every column file whose checksum differs from the manifest."""
+    mismatches = []
+    for name, entry in manifest(directory)["shards"].items():
+        for field, expected in entry["checksums"].items():
+            file_path = column_file(os.path.join(directory, name), field, entry.get("generation"))
+            if not os.path.exists(file_path) or _file_checksum(file_path) != expected:
+                mismatches.append((name, field))
+    return mismatches
+
+
+def open_store(directory=STORE_DIR, tickers=None):
+    """Returns a ``PriceStore`` or None when no shard has been written yet.
+
+    With ``tickers`` only the shards holding them are opened, see ``PriceStore``.
+    """
+    if not shard_names(directory):
+        return None
+    return PriceStore(directory, tickers)
+
+
+def json_shard_path(name, directory=DATA_DIR):
+    return os.path.join(directory, f'{name}{JSON_SUFFIX}')
+
+
+def json_shard_names(directory=DATA_DIR):
+    """Every shard that has a ``<name>_price_history.json.gz`` file."""
+    return [os.path.basename(path)[:-len(JSON_SUFFIX)]
+            for path in sorted(glob.glob(json_shard_path('*', directory)))]
+
+
+def read_json_shard(name, directory=DATA_DIR):
+    with gzip.open(json_shard_path(name, directory), 'rb') as f_in:
+        return json.loads(f_in.read().decode('utf-8'))
+
+
+@metrics.timed("write")
+def write_json_shard(name, tickers_dict, directory=DATA_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with gzip.open(json_shard_path(name, directory), 'wb') as f_out:
+        f_out.write(json.dumps(tickers_dict).encode('utf-8'))
+
+
+def missing_shards(names=None, directory=STORE_DIR, data_directory=DATA_DIR):
+    """Shards that have a JSON file on disk but no columnar shard yet."""
+    names = json_shard_names(data_directory) if names is None else names
+    return [name for name in names
+            if os.path.exists(json_shard_path(name, data_directory))
+            and not os.path.exists(os.path.join(directory, name, INDEX_FILE))]
+
+
+def decode_json_shard(name, directory=DATA_DIR):
+    """Decodes one JSON shard into columns, in a worker process of ``decoded_json_shards``.
+
+    Returns ``(name, columns, index, seconds)``. The columns are numpy arrays, so they go back to the parent as a
+    few flat pickled buffers rather than as thousands of candle dicts. They are None when the shard could not be
+    read.
+    """
+    start = time.time()
+    try:
+        tickers_dict = read_json_shard(name, directory)
+    except Exception as e:
+        print(f"Error loading file for '{name}': {e}")
+        return name, None, {}, time.time() - start
+    columns, index = _to_columns(tickers_dict)
+    return name, columns, index, time.time() - start
+
+
+def decoded_json_shards(names, workers=None, directory=DATA_DIR):
+    """Yields ``decode_json_shard`` of every shard of ``names`` as they finish, decoded by ``workers`` processes.
+
+    Decompressing and parsing the JSON holds the GIL, so unlike threads the processes decode in parallel. A shard
+    that could not be read is skipped, so no empty columnar shard replaces it and ``missing_shards`` still lists it.
+    """
+    names = [name for name in names if os.path.exists(json_shard_path(name, directory))]
+    if not names:
+        return
+    workers = max(1, min(workers or os.cpu_count() or 1, len(names)))
+    start = time.time()
+    with Pool(workers) as pool:
+        decoded = pool.imap_unordered(partial(decode_json_shard, directory=directory), names)
+        for i, (name, columns, index, seconds) in enumerate(decoded):
+            if columns is None:
+                print(f"Skipped shard '{name}', it could not be decoded [{i + 1}/{len(names)}]")
+                continue
+            print(f"Decoded shard '{name}' ({len(index)} tickers) in {seconds:.2f}s [{i + 1}/{len(names)}]")
+            metrics.observe("decode", seconds)
+            yield name, columns, index, seconds
+    print(f"Decoded {len(names)} shards with {workers} processes in {time.time() - start:.2f}s")
+
+
+def build_from_json(names=None, directory=STORE_DIR, workers=None, data_directory=DATA_DIR):
+    """Converts the existing ``*_price_history.json.gz`` shards into the columnar store, decoding them in
+    parallel."""
+    # A hash shard is one of as many shards as there are numbered JSON files
+    hash_shards = sum(name.isdigit() for name in json_shard_names(data_directory))
+    names = json_shard_names(data_directory) if names is None else names
+    for name, columns, index, _ in decoded_json_shards(names, workers, data_directory):
+        write_columns(name, columns, index, directory, hash_shards if name.isdigit() else None)
+        print(f"Wrote {len(index)} tickers to price store shard '{name}'")
+
+
+def needs_reshard(shard_count=SHARD_COUNT, data_directory=DATA_DIR):
+    """Whether some JSON shard is not one of the ``shard_count`` hash shards, such as the letter shards written
+    before the hash shards."""
+    return any(not name.isdigit() or int(name) >= shard_count for name in json_shard_names(data_directory))
+
+
+def reshard(shard_count=SHARD_COUNT, directory=STORE_DIR, data_directory=DATA_DIR):
+    """Redistributes every stored ticker over ``shard_count`` hash shards, JSON and columnar, and removes the
+    shards they replace."""
+    build_from_json(missing_shards(directory=directory, data_directory=data_directory), directory,
+                    data_directory=data_directory)
+    store = PriceStore(directory)
+    old_names = set(store.shards) | set(json_shard_names(data_directory))
+    tickers = [ticker for ticker in store if ticker not in SHARED_TICKERS]
+    shared = [ticker for ticker in SHARED_TICKERS if ticker in store]
+
+    new_names = []
+    for index in range(shard_count):
+        name = shard_name(index)
+        tickers_dict = {ticker: {"candles": list(store[ticker]["candles"])}
+                        for ticker in shard_tickers(tickers, index, shard_count) + shared}
+        write_json_shard(name, tickers_dict, data_directory)
+        write_shard(name, tickers_dict, directory, shard_count)
+        new_names.append(name)
+        print(f"Wrote {len(tickers_dict)} tickers to hash shard '{name}'")
+
+    for name in old_names - set(new_names):
+        if os.path.exists(json_shard_path(name, data_directory)):
+            os.remove(json_shard_path(name, data_directory))
+        if os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name))
+    current = manifest(directory)
+    print(f"Resharded {len(current['locations'])} tickers into {shard_count} shards")
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, reshard or check the columnar price store")
+    parser.add_argument("shards", nargs="*", help="JSON shards to convert, every missing one by default")
+    parser.add_argument("--reshard", type=int, metavar="COUNT",
+                        help="redistribute every ticker over COUNT hash shards")
+    parser.add_argument("--migrate", action="store_true",
+                        help="reshard into SHARD_COUNT hash shards when other shards, such as letter shards, are left")
+    parser.add_argument("--verify", action="store_true", help="check every column file against the manifest")
+    parser.add_argument("--workers", type=int, default=None, help="decoding processes, one per core by default")
+    args = parser.parse_args()
+
+    if args.reshard:
+        reshard(args.reshard)
+    elif args.migrate and needs_reshard():
+        reshard()
+    else:
+        build_from_json(args.shards or missing_shards(), workers=args.workers)
+    if args.verify:
+        mismatches = verify()
+        for name, field in mismatches:
+            print(f"Checksum mismatch in shard '{name}': {field}")
+        print(f"{len(mismatches)} checksum mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
-import gzip
+import argparse
 import json
 import sys
 import time
 import datetime as dt
 import os
+import random
 # import requests
-import yaml
 import yfinance as yf
 import pandas as pd
 import dateutil.relativedelta
@@ -13,42 +13,35 @@ import numpy as np
 from io import StringIO
 from datetime import date
 from datetime import datetime
+from functools import partial
 from dateutil.relativedelta import relativedelta
 from requests.exceptions import ConnectionError, HTTPError, Timeout
 
 from curl_cffi import requests
 
+from scripts import fetch_engine
+from scripts import metrics
+from scripts import price_store
+from scripts import yahoo_stub
+from scripts.config import cfg
+
 session = requests.Session(impersonate="chrome")
 
-DIR = os.path.dirname(os.path.realpath(__file__))
+# Incremental refreshes re-fetch this many calendar days before the last stored candle so revised bars and
+# adjusted-close changes are caught, and compare the overlap against the stored history.
+OVERLAP_DAYS = 10
+# Relative change on an overlapping bar beyond which we assume a split/dividend re-adjusted the whole history
+ADJUSTMENT_TOLERANCE = 0.002
+# Rounding applied by yf.download(rounding=True), never treated as an adjustment
+ROUNDING_TOLERANCE = 0.011
+# A small dividend moves every bar by the same ratio: overlapping closes that all moved, by ratios within this of
+# each other (on top of the rounding), in at least this many bars, are an adjustment too
+RATIO_TOLERANCE = 0.0005
+MIN_ADJUSTED_BARS = 3
+# Tickers requested per yf.download call
+BATCH_SIZE = 50
 
-try:
-    with open(os.path.join(DIR, 'config_private.yaml'), 'r') as stream:
-        private_config = yaml.safe_load(stream)
-except FileNotFoundError:
-    private_config = None
-except yaml.YAMLError as exc:
-    print(exc)
-
-try:
-    file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-                             'config.yaml')
-    with open(file_path, 'r') as stream:
-        config = yaml.safe_load(stream)
-except FileNotFoundError:
-    config = None
-except yaml.YAMLError as exc:
-    print(exc)
-
-
-def cfg(key):
-    try:
-        return private_config[key]
-    except:
-        try:
-            return config[key]
-        except:
-            return None
+DIR = os.path.dirname(os.path.realpath(__file__))
 
 
 def get_tickers_from_nasdaq():
@@ -109,13 +102,72 @@ def write_to_file(dict, file):
         json.dump(dict, fp, ensure_ascii=False)
 
 
-def write_price_history_file(char, tickers_dict):
-    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_persist')
-    os.makedirs(directory, exist_ok=True)
-    path = os.path.join(directory, f'{char.lower()}_price_history.json.gz')
-    with gzip.open(path, 'wb') as f_out:
-        json_str = json.dumps(tickers_dict)
-        f_out.write(json_str.encode('utf-8'))
+def shard_name(shard):
+    """Store name of a shard given as a hash shard index or, for the old layout, a ticker letter."""
+    return price_store.shard_name(int(shard)) if str(shard).isdigit() else shard.lower()
+
+
+def select_shard_tickers(tickers, shard, count):
+    """The tickers of ``tickers`` that belong to ``shard``, see ``shard_name``."""
+    if str(shard).isdigit():
+        return price_store.shard_tickers(tickers, int(shard), count)
+    return [ticker for ticker in tickers if ticker.lower().startswith(shard.lower())]
+
+
+def write_price_history_file(shard, tickers_dict, count=None):
+    price_store.write_json_shard(shard_name(shard), tickers_dict)
+    price_store.write_shard(shard_name(shard), tickers_dict,
+                            shard_count=(count or price_store.SHARD_COUNT) if str(shard).isdigit() else None)
+
+
+def load_price_history_file(shard):
+    if not os.path.exists(price_store.json_shard_path(shard_name(shard))):
+        return {}
+    try:
+        return price_store.read_json_shard(shard_name(shard))
+    except Exception as e:
+        print(f"Error loading price history for '{shard}': {e}")
+        return {}
+
+
+def is_adjusted(stored_candles, fetched_candles):
+    """True when Yahoo re-adjusted the history: a bar present in both histories changed by more than
+    ``ADJUSTMENT_TOLERANCE``, or the overlapping closes all moved by the same small ratio."""
+    stored_by_ts = {candle["datetime"]: candle for candle in stored_candles[-(OVERLAP_DAYS + 5):]}
+    closes = []
+    for candle in fetched_candles:
+        stored = stored_by_ts.get(candle["datetime"])
+        if stored is None:
+            continue
+        for field in ("open", "close"):
+            old, new = stored.get(field), candle.get(field)
+            if old is None or new is None:
+                continue
+            if abs(new - old) > max(ROUNDING_TOLERANCE, abs(old) * ADJUSTMENT_TOLERANCE):
+                return True
+            if field == "close" and old > 0 and new > 0:
+                closes.append((old, new))
+    return is_uniformly_adjusted(closes)
+
+
+def is_uniformly_adjusted(closes):
+    """True when the ``(stored, fetched)`` closes moved beyond rounding by one common ratio, allowing a single bar
+    off it (the last stored bar may have been a provisional one)."""
+    moved = [(old, new) for old, new in closes if abs(new - old) > ROUNDING_TOLERANCE]
+    if len(moved) < max(MIN_ADJUSTED_BARS, len(closes) - 1):
+        return False
+    ratios = sorted(new / old for old, new in moved)
+    median = ratios[len(ratios) // 2]
+    agreeing = [old for old, new in moved
+                if abs(new / old - median) <= RATIO_TOLERANCE + ROUNDING_TOLERANCE / old]
+    return len(agreeing) >= max(MIN_ADJUSTED_BARS, len(closes) - 1)
+
+
+def merge_candles(stored_candles, fetched_candles):
+    """Merges two candle lists by timestamp, fetched candles replacing stored ones."""
+    by_ts = {candle["datetime"]: candle for candle in stored_candles}
+    by_ts.update((candle["datetime"], candle) for candle in fetched_candles)
+    return [by_ts[ts] for ts in sorted(by_ts)]
 
 
 def print_data_progress(ticker, idx, tickers, error_text, elapsed_s, remaining_s):
@@ -132,178 +184,354 @@ def print_data_progress(ticker, idx, tickers, error_text, elapsed_s, remaining_s
         f'{ticker} from {error_text} ({idx + 1} / {len(tickers)}). Elapsed: {elapsed.hours}h {elapsed.minutes}m {elapsed.seconds}s. Remaining: {remaining_string}.')
 
 
-def get_remaining_seconds(all_load_times, idx, len):
-    load_time_ma = pd.Series(all_load_times).rolling(np.minimum(idx + 1, 25)).mean().tail(1).item()
-    remaining_seconds = (len - idx) * load_time_ma
+def get_remaining_seconds(all_load_times, idx, count):
+    # Mean of the last 25 load times, only the tail is read so the ETA costs the same on every ticker
+    window = min(idx + 1, 25)
+    if len(all_load_times) < window:
+        return np.nan
+    load_time_ma = sum(all_load_times[-window:]) / window
+    remaining_seconds = (count - idx) * load_time_ma
     return remaining_seconds
 
 
-def get_yf_data(ticker, start_date, end_date):
-    ticker_data = {}
-    rate_limit_delay = 0.1
-    max_retries = 5
+def get_random_user_agent():
+    try:
+        from user_agents import get_random_user_agent as random_user_agent
+        return random_user_agent()
+    except ImportError:
+        # If import fails, use a default method
+        import random
+        default_agents = [
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36"
+        ]
+        return random.choice(default_agents)
+
+
+# Where the sessions of new_session send Yahoo requests: "live", "stub" (a scripts.yahoo_stub server at STUB_URL)
+# or "record" (live, every response also saved to RECORD_DIR for yahoo_stub --replay)
+TRANSPORTS = ("live", "stub", "record")
+TRANSPORT = cfg("YAHOO_TRANSPORT") or "live"
+STUB_URL = cfg("YAHOO_STUB_URL") or yahoo_stub.DEFAULT_URL
+RECORD_DIR = cfg("YAHOO_RECORD_DIR") or yahoo_stub.CASSETTE_DIR
+
+
+class StubSession(requests.Session):
+    """Session sending every Yahoo request to a yahoo_stub server instead."""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, yahoo_stub.redirect(url, self.base_url), *args, **kwargs)
+
+
+class RecordingSession(requests.Session):
+    """Live session saving every Yahoo response to ``directory``."""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+
+    def request(self, method, url, *args, **kwargs):
+        response = super().request(method, url, *args, **kwargs)
+        if yahoo_stub.is_yahoo(url):
+            yahoo_stub.record(self.directory, method, url, kwargs.get("params"), response.status_code,
+                              response.headers.get("content-type"), response.text)
+        return response
+
+
+def use_transport(transport, stub_url=None, record_dir=None):
+    """Sends the Yahoo requests of the sessions created from now on through ``transport``, see TRANSPORTS."""
+    global TRANSPORT, STUB_URL, RECORD_DIR
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {transport}, expected one of {TRANSPORTS}")
+    TRANSPORT = transport
+    STUB_URL = stub_url or STUB_URL
+    RECORD_DIR = record_dir or RECORD_DIR
+
+
+def new_session():
+    if TRANSPORT == "stub":
+        session = StubSession(STUB_URL)
+    elif TRANSPORT == "record":
+        session = RecordingSession(RECORD_DIR)
+    else:
+        session = requests.Session()
+    session.headers['User-Agent'] = get_random_user_agent()
+    return session
+
+
+ENGINE = fetch_engine.FetchEngine(new_session)
+
+
+def frame_to_ticker_data(df):
+    """Converts one ticker's yfinance frame to the stored {"candles": [...]} format with column operations."""
+    required_cols = ["Open", "Adj Close", "Low", "High", "Volume"]
+    if not all(col in df.columns for col in required_cols):
+        return None
+    # Batched downloads share one index across tickers, drop the dates this ticker did not trade
+    df = df[required_cols].dropna(how="all")
+    if df.empty:
+        return None
+
+    index = df.index
+    if index.tz is not None:
+        # Ticker.history returns exchange-local timestamps, yf.download naive dates: store both the same way
+        index = index.tz_localize(None)
+    volumes = df["Volume"]
+    if not volumes.isna().any():
+        volumes = volumes.astype("int64")
+    timestamps = (index + pd.Timedelta(hours=16)).values.astype("datetime64[s]").astype("int64")
+    candles = pd.DataFrame({
+        "open": df["Open"].values,
+        "close": df["Adj Close"].values,
+        "low": df["Low"].values,
+        "high": df["High"].values,
+        "volume": volumes.values,
+        "datetime": timestamps,
+    }).to_dict("records")
+    return {"candles": candles}
+
+
+@metrics.timed("fetch")
+def fetch_history(ticker, start_date, end_date, session):
+    """Downloads one ticker through Ticker.history, which unlike yf.download keeps no module-global state and is
+    safe to run from several engine workers at once."""
+    try:
+        df = yf.Ticker(ticker, session=session).history(
+            start=start_date,
+            end=end_date,
+            auto_adjust=False,
+            rounding=True,
+            raise_errors=True
+        )
+    except Exception as e:
+        if fetch_engine.is_rate_limit_error(e):
+            raise fetch_engine.RateLimited(str(e))
+        print(f"Error downloading data for {ticker}: {str(e)}")
+        return None
+
+    if df.empty:
+        print(f"No data found for {ticker}, symbol may be delisted or incorrect")
+        return None
+
+    ticker_data = frame_to_ticker_data(df)
+    if ticker_data is None:
+        print(f"Missing required columns for {ticker}. Available: {list(df.columns)}")
+    return ticker_data
 
-    for attempt in range(max_retries):
-        try:
-            # Import the random user agent function
-            # First check if we need to import it
-            try:
-                from user_agents import get_random_user_agent
-            except ImportError:
-                # If import fails, use a default method
-                # Define the function inline if we can't import it
-                def get_random_user_agent():
-                    import random
-                    default_agents = [
-                        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
-                        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
-                        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36"
-                    ]
-                    return random.choice(default_agents)
-
-            # Set a random user agent
-            user_agent = get_random_user_agent()
-
-            # Configure yfinance session with the random user agent
-            session = requests.Session()
-            session.headers['User-Agent'] = user_agent
-
-            # Download data with auto_adjust=False (based on Reddit fix) and using our custom session
-            df = yf.download(
-                ticker,
-                start=start_date,
-                end=end_date,
-                auto_adjust=False,
-                progress=False,
-                session=session,
-                rounding=True
-            )
-
-            # Add a small delay to avoid rate limiting (adjust as needed)
-            time.sleep(rate_limit_delay)
-
-            # Check if DataFrame is empty
-            if df.empty:
-                print(f"No data found for {ticker}, symbol may be delisted or incorrect")
-                return None
-
-            # Fix the MultiIndex columns by dropping the second level
+
+def get_yf_data(ticker, start_date, end_date):
+    return ENGINE.call(partial(fetch_history, ticker, start_date, end_date), ticker)
+
+
+@metrics.timed("fetch")
+def download_batch(tickers, start_date, end_date, session):
+    """Downloads ``tickers`` with one yf.download call and returns ``(fetched, missing)``.
+
+    A ticker is missing when it has no usable rows in the returned frame, whatever the reason: yf.download keeps
+    its per-ticker errors in private state, so failures and rate limits are not told apart from empty histories.
+    ``fetch_tickers`` asks for the missing tickers again with a backoff. This batched path is optional
+    (``--batched``), the workflows fetch per ticker through ``fetch_history``, which reports rate limits to the
+    fetch engine.
+    """
+    # Download data with auto_adjust=False (based on Reddit fix) and using a pooled session
+    df = yf.download(
+        list(tickers),
+        start=start_date,
+        end=end_date,
+        auto_adjust=False,
+        progress=False,
+        session=session,
+        rounding=True,
+        group_by="ticker",
+        threads=False
+    )
+
+    fetched = {}
+    if not df.empty:
+        for ticker in tickers:
             if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.droplevel(1)
-
-            # Convert to dictionary and process as in the original simple function
-            yahoo_response = df.to_dict()
-
-            # Check if we have all required columns
-            required_cols = ["Open", "Close", "Low", "High", "Volume"]
-            if not all(col in yahoo_response for col in required_cols):
-                print(f"Missing required columns for {ticker}. Available: {list(yahoo_response.keys())}")
-                return None
-
-            timestamps = list(yahoo_response["Open"].keys())
-            timestamps = timestamps = [int((timestamp + relativedelta(hours=16)).timestamp())
-                                       for timestamp in timestamps]
-
-            opens = list(yahoo_response["Open"].values())
-            closes = list(yahoo_response["Adj Close"].values())
-            lows = list(yahoo_response["Low"].values())
-            highs = list(yahoo_response["High"].values())
-            volumes = list(yahoo_response["Volume"].values())
-
-            candles = []
-            for i in range(0, len(opens)):
-                candle = {}
-                candle["open"] = opens[i]
-                candle["close"] = closes[i]
-                candle["low"] = lows[i]
-                candle["high"] = highs[i]
-                candle["volume"] = volumes[i]
-                candle["datetime"] = timestamps[i]
-                candles.append(candle)
-
-            ticker_data["candles"] = candles
-            return ticker_data
-        except Exception as e:
-            print(f"Error downloading data for {ticker}: {str(e)}")
-            if "Too Many Requests" in str(e) or "Rate limit" in str(e):
-                rate_limit_delay *= 5
-                print(f"Rate limit hit for {ticker}, increasing delay to {rate_limit_delay}s")
-                time.sleep(rate_limit_delay)
+                if ticker not in df.columns.get_level_values(0):
+                    continue
+                ticker_df = df[ticker]
+            elif len(tickers) == 1:
+                ticker_df = df
             else:
-                print(f"Non-rate limit error occurred for {ticker}, skipping retries.")
-                break
+                continue
+            ticker_data = frame_to_ticker_data(ticker_df)
+            if ticker_data is not None:
+                fetched[ticker] = ticker_data
 
+    missing = [ticker for ticker in tickers if ticker not in fetched]
+    if missing:
+        print(f"No data for {len(missing)} of {len(tickers)} tickers of the batch: {', '.join(missing[:10])}")
+    return fetched, missing
 
-def load_prices_from_yahoo(char):
+
+def get_yf_data_batch(tickers, start_date, end_date):
+    """Downloads a group of tickers with a single yf.download call.
+
+    Returns ({ticker: ticker_data}, missing_tickers) so callers can re-queue only
+    the symbols that came back empty or failed inside the batch.
+    """
+    try:
+        result = ENGINE.call(partial(download_batch, tickers, start_date, end_date),
+                             f"batch of {len(tickers)} tickers")
+    except Exception as e:
+        print(f"Error downloading batch of {len(tickers)} tickers: {str(e)}")
+        result = None
+    if result is None:
+        return {}, list(tickers)
+    return result
+
+
+def fetch_round(tickers, start_dates, end_date, batched, batch_size):
+    """Yields (ticker, ticker_data or None) for one pass over ``tickers``."""
+    if not batched:
+        # yf.download shares module-global state between calls, so concurrent workers go through Ticker.history
+        yield from ENGINE.map(lambda ticker, session: fetch_history(ticker, start_dates[ticker], end_date, session),
+                              tickers)
+        return
+
+    # Tickers that need the same date range are downloaded together
+    windows = {}
+    for ticker in tickers:
+        windows.setdefault(start_dates[ticker], []).append(ticker)
+    for start_date, window_tickers in windows.items():
+        for i in range(0, len(window_tickers), batch_size):
+            fetched, missing = get_yf_data_batch(window_tickers[i:i + batch_size], start_date, end_date)
+            yield from fetched.items()
+            for ticker in missing:
+                yield ticker, None
+
+
+def fetch_tickers(start_dates, end_date, batched=False, batch_size=BATCH_SIZE, max_retries=8, base_delay=1):
+    """Yields (ticker, ticker_data or None) for every ticker, re-queueing only the ones that came back empty."""
+    pending = list(start_dates)
+    for retry_count in range(max_retries):
+        if retry_count > 0:
+            # Exponential backoff with jitter
+            retry_delay = base_delay * (2 ** (retry_count - 1)) * random.uniform(0.5, 1.5)
+            print(f"Retry {retry_count}/{max_retries} for {len(pending)} tickers, waiting {retry_delay:.1f}s...")
+            metrics.increment("ticker_retries", len(pending))
+            time.sleep(retry_delay)
+
+        missing = []
+        for ticker, ticker_data in fetch_round(pending, start_dates, end_date, batched, batch_size):
+            if ticker_data is None:
+                missing.append(ticker)
+            else:
+                yield ticker, ticker_data
+        pending = missing
+        if not pending:
+            return
+
+    for ticker in pending:
+        print(f"Failed to download {ticker} after {max_retries} retries")
+        yield ticker, None
+
+
+def with_stored_history(ticker, ticker_data, stored_candles, start_date, end_date):
+    """Merges freshly fetched candles into the stored history, re-pulling everything if Yahoo re-adjusted it."""
+    if not stored_candles:
+        return ticker_data
+    if is_adjusted(stored_candles, ticker_data["candles"]):
+        print(f"Adjustment detected for {ticker}, re-downloading full history")
+        full_data = get_yf_data(ticker, start_date, end_date)
+        if full_data is not None:
+            return full_data
+    return {"candles": merge_candles(stored_candles, ticker_data["candles"])}
+
+
+def load_prices_from_yahoo(shard, full=False, batched=False, batch_size=BATCH_SIZE, count=None):
+    """Refreshes one shard, a hash shard index out of ``count`` (``SHARD_COUNT`` of the config by default) or a
+    ticker letter."""
+    count = count or price_store.SHARD_COUNT
     today = date.today()
     start = time.time()
     s2018 = datetime.strptime("2022-01-01", "%Y-%m-%d") - relativedelta(years=2)
     # start_date = today - dt.timedelta(days=5 * 365)
     start_date = s2018
+    stored_dict = {} if full else load_price_history_file(shard)
     tickers_dict = {}
     load_times = []
     failed_tickers = []
 
-    # Add retry mechanism
-    max_retries = 8
-    base_delay = 1  # seconds
-
     # tickers = ([ticker for ticker in get_tickers_from_nasdaq()
-    tickers = ([ticker for ticker in get_tickers_from_file()
-                if (ticker.lower().startswith(char.lower()))]
-               + ["SPY", "^VIX"])
+    tickers = ([ticker for ticker in select_shard_tickers(get_tickers_from_file(), shard, count)
+                if ticker not in price_store.SHARED_TICKERS]
+               + list(price_store.SHARED_TICKERS))
 
     print("*** Loading Stocks from Yahoo Finance ***")
-    for idx, ticker in enumerate(tickers):
-        retry_count = 0
-        success = False
-
-        r_start = 0
-        ticker_data = None
-        while retry_count < max_retries and not success:
-            r_start = time.time()
-
-            # If this is a retry, wait with exponential backoff
-            if retry_count > 0:
-                retry_delay = base_delay * (2 ** (retry_count - 1))  # Exponential backoff
-                print(f"Retry {retry_count}/{max_retries} for {ticker}, waiting {retry_delay}s...")
-                time.sleep(retry_delay)
-
-            # Use the updated get_yf_data function
-            ticker_data = get_yf_data(ticker, start_date, today)
-
-            # If successful, mark as success and break retry loop
-            if ticker_data is not None:
-                success = True
-            else:
-                retry_count += 1
+    if stored_dict:
+        print(f"Incremental refresh on top of {len(stored_dict)} stored tickers")
+
+    start_dates = {}
+    for ticker in tickers:
+        stored_candles = stored_dict.get(ticker, {}).get("candles") or []
+        if stored_candles:
+            last_stored = datetime.fromtimestamp(stored_candles[-1]["datetime"])
+            start_dates[ticker] = (last_stored - relativedelta(days=OVERLAP_DAYS)).date()
+        else:
+            start_dates[ticker] = start_date
+
+    last_done = time.time()
+    for idx, (ticker, ticker_data) in enumerate(fetch_tickers(start_dates, today, batched, batch_size)):
+        stored_candles = stored_dict.get(ticker, {}).get("candles") or []
 
         # Handle failed downloads after all retries
-        if not success:
-            print(f"Failed to download {ticker} after {max_retries} retries")
+        metrics.increment("tickers_processed")
+        if ticker_data is None:
+            metrics.increment("tickers_failed")
             failed_tickers.append(ticker)
+            if stored_candles:
+                # Keep what we already have rather than dropping the ticker from the shard
+                tickers_dict[ticker] = {"candles": stored_candles}
             continue
 
+        tickers_dict[ticker] = with_stored_history(ticker, ticker_data, stored_candles, start_date, today)
+
         # Track timing and progress
         now = time.time()
-        current_load_time = now - r_start
-        load_times.append(current_load_time)
+        load_times.append(now - last_done)
+        last_done = now
         remaining_seconds = get_remaining_seconds(load_times, idx, len(tickers))
         print_data_progress(ticker, idx, tickers, "", time.time() - start, remaining_seconds)
 
-        # Add to results dictionary
-        tickers_dict[ticker] = ticker_data
-
+    # Keep the shard in ticker-list order so refreshes produce stable files
+    tickers_dict = {ticker: tickers_dict[ticker] for ticker in tickers if ticker in tickers_dict}
     if tickers_dict:
-        write_price_history_file(char, tickers_dict)
+        write_price_history_file(shard, tickers_dict, count)
     else:
         print("No tickers data to write.")
     return tickers_dict
 
 
 def main():
-    char = "v" if len(sys.argv) <= 1 else sys.argv[1]
-    load_prices_from_yahoo(char)
+    global ENGINE
+    parser = argparse.ArgumentParser(description="Refresh one price history shard")
+    parser.add_argument("shard", nargs="?", default="0", help="hash shard index, or a ticker letter for the old layout")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="number of hash shards, SHARD_COUNT of the config by default")
+    parser.add_argument("--full", action="store_true", help="re-download the full history of every ticker")
+    parser.add_argument("--batched", action="store_true",
+                        help="download groups of tickers through yf.download instead of concurrent workers, "
+                             "retrying whatever a batch is missing without telling rate limits apart")
+    parser.add_argument("--workers", type=int, default=fetch_engine.DEFAULT_WORKERS)
+    parser.add_argument("--rate", type=float, default=fetch_engine.DEFAULT_RATE, help="requests per second")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT,
+                        help="live Yahoo, a local yahoo_stub server, or live while recording the responses")
+    parser.add_argument("--stub-url", default=STUB_URL, help="address of the yahoo_stub server")
+    parser.add_argument("--record-dir", default=RECORD_DIR, help="where --transport record saves the responses")
+    args = parser.parse_args()
+    use_transport(args.transport, args.stub_url, args.record_dir)
+    ENGINE = fetch_engine.FetchEngine(new_session, max_workers=args.workers, rate=args.rate)
+    load_prices_from_yahoo(args.shard, full=args.full, batched=args.batched, count=args.shards)
+    metrics.report(f"rs_data_{shard_name(args.shard)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+"""Relative strength of every ticker on every trading day, computed in one pass.
+
+``rankings()`` recomputes the universe for a single date; walking it day by day
+is O(days x tickers x history). Here every ticker's ``strength()`` is computed
+once for every prefix of its history, after which the RS and the percentiles of
+any trading day (and their 1/3/6 month lookbacks) are array lookups.
+
+The matrix is saved compressed, with the RS as float32, to
+``data_persist/rs_matrix.npz``. It is a cache rebuilt from the price data and
+is not committed.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts import price_store
+from scripts import rs_ranking
+from scripts import trading_calendar
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+MATRIX_FILE = os.path.join(os.path.dirname(DIR), 'data_persist', 'rs_matrix.npz')
+# Percentile of a ticker that was not ranked that day
+MISSING = -1
+
+
+def strength_series(closes):
+    """``rs_ranking.strength(closes[:p + 1])`` for every position p of one ticker's closes."""
+    n = len(closes)
+    positions = np.arange(n)
+    valid = ~np.isnan(closes)
+    last_valid = np.maximum.accumulate(np.where(valid, positions, -1))
+    filled = closes[np.maximum(last_valid, 0)]
+    next_valid = np.minimum.accumulate(np.where(valid, positions, n)[::-1])[::-1]
+
+    total = np.zeros(n)
+    failed = np.zeros(n, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for quarters, weight in enumerate(rs_ranking.QUARTER_WEIGHTS, start=1):
+            first = next_valid[np.maximum(0, positions - quarters * rs_ranking.RS_QUARTER + 1)]
+            failed |= first >= positions
+            perf = filled / closes[np.minimum(first, n - 1)] - 1
+            total = total + weight * perf
+    return np.where(failed, 0.0, total)
+
+
+class RSMatrix:
+    """Dense (trading day x ticker) relative strength and percentiles.
+
+    ``rs[day, ticker]`` is the "Relative Strength" column of that day's ranking
+    (NaN when the ticker was not ranked) and ``percentiles[j, day, ticker]`` the
+    Percentile / 1 / 3 / 6 Months Ago columns, ``MISSING`` when not ranked.
+    """
+
+    def __init__(self, timestamps, tickers, rs, percentiles, source_tickers=None):
+        self.timestamps = np.asarray(timestamps)
+        self.tickers = list(tickers)
+        # Every ticker of the price data it was built from, ranked or not
+        self.source_tickers = list(tickers if source_tickers is None else source_tickers)
+        self.rs = rs
+        self.percentiles = percentiles
+        self.dates = [trading_calendar.timestamp_to_date(ts) for ts in self.timestamps]
+        self.date_index = {date: i for i, date in enumerate(self.dates)}
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def frame(self, date):
+        """The unsorted ranking of ``date`` with the same columns and rows ``rankings()`` computes."""
+        day = self.date_index[date]
+        rows = np.flatnonzero(~np.isnan(self.rs[day]))
+        columns = {rs_ranking.TITLE_TICKER: [self.tickers[row] for row in rows],
+                   rs_ranking.TITLE_RS: self.rs[day, rows]}
+        titles = (rs_ranking.TITLE_PERCENTILE, rs_ranking.TITLE_1M, rs_ranking.TITLE_3M, rs_ranking.TITLE_6M)
+        for j, title in enumerate(titles):
+            labels = self.percentiles[j, day, rows].astype(int)
+            if (labels == MISSING).any():
+                labels = np.where(labels == MISSING, np.nan, labels)
+            columns[title] = labels
+        return pd.DataFrame(columns)
+
+    def percentile_history(self, ticker):
+        """Percentile of ``ticker`` on every trading day, as a Series indexed by date."""
+        values = self.percentiles[0, :, self.ticker_index[ticker]].astype(float)
+        values[values == MISSING] = np.nan
+        return pd.Series(values, index=self.dates)
+
+    def save(self, path=MATRIX_FILE):
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, timestamps=self.timestamps, tickers=np.array(self.tickers),
+                            source_tickers=np.array(self.source_tickers), rs=self.rs.astype(np.float32),
+                            percentiles=self.percentiles)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=MATRIX_FILE):
+        with np.load(path) as data:
+            # The RS is truncated to 2 decimals, rounding the float32 back gives the exact float64 values
+            rs = np.round(data["rs"].astype(float), 2)
+            return cls(data["timestamps"], data["tickers"].tolist(), rs, data["percentiles"],
+                       data["source_tickers"].tolist())
+
+    def is_current(self, PRICE_DATA, start_timestamp=None):
+        """Whether the matrix was built from the same tickers up to the same last trading day as PRICE_DATA and
+        covers the days from ``start_timestamp`` on."""
+        last_timestamp = int(price_store.column(PRICE_DATA[rs_ranking.REFERENCE_TICKER], "datetime")[-1])
+        if len(self.timestamps) == 0 or int(self.timestamps[-1]) != last_timestamp:
+            return False
+        if start_timestamp is not None and int(self.timestamps[0]) > start_timestamp:
+            return False
+        return set(self.source_tickers) == set(PRICE_DATA)
+
+
+def first_day(calendar, start_date=None):
+    """Index of the first trading day at or after ``start_date``, 0 without one, ``len(calendar)`` when the calendar
+    ends before it.
+
+    The date is compared at the 16:00 UTC stamp of the candles, so the result does not depend on the time zone.
+    """
+    if start_date is None:
+        return 0
+    return int(np.searchsorted(calendar.timestamps, trading_calendar.date_to_timestamp(start_date), side="left"))
+
+
+def build(PRICE_DATA, start_date=None):
+    """Computes the RS matrix over the trading days of the reference ticker from ``start_date`` on, every day
+    without one."""
+    reference = PRICE_DATA[rs_ranking.REFERENCE_TICKER]
+    calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA, rs_ranking.REFERENCE_TICKER)
+    first = first_day(calendar, start_date)
+    timestamps = calendar.timestamps[first:]
+    reference_strength = strength_series(np.asarray(price_store.column(reference, "close"), dtype=float))
+    n_days = len(timestamps)
+
+    tickers, strengths, ends, lengths, offsets = [], [], [], [], []
+    offset = 0
+    for ticker, data in PRICE_DATA.items():
+        try:
+            closes = np.asarray(price_store.column(data, "close"), dtype=float)
+            datetimes = price_store.column(data, "datetime")
+        except KeyError:
+            print(f'Ticker {ticker} has corrupted data.')
+            continue
+        if len(closes) == 0:
+            continue
+        tickers.append(ticker)
+        strengths.append(strength_series(closes))
+        # Same cut as filter_price_data_by_index: up to the first candle at or after the trading day
+        ends.append(calendar.ticker_offsets(datetimes)[first:])
+        lengths.append(len(closes))
+        offsets.append(offset)
+        offset += len(closes)
+
+    strengths = np.concatenate(strengths) if strengths else np.zeros(0)
+    ends = np.stack(ends) if ends else np.zeros((0, n_days), dtype=int)
+    lengths = np.array(lengths, dtype=int)
+    offsets = np.array(offsets, dtype=int)
+
+    rs_matrix = np.full((n_days, len(tickers)), np.nan)
+    percentiles = np.full((len(rs_ranking.RS_LOOKBACKS), n_days, len(tickers)), MISSING, dtype=np.int8)
+    for day in range(n_days):
+        end = ends[:, day]
+        rows = np.flatnonzero((end < lengths) & (end + 1 >= 6 * rs_ranking.MONTH))
+        rs = np.empty((len(rows), len(rs_ranking.RS_LOOKBACKS)))
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for j, lookback in enumerate(rs_ranking.RS_LOOKBACKS):
+                position = end[rows] - lookback
+                strength = np.where(position >= 0, strengths[offsets[rows] + np.maximum(position, 0)], 0.0)
+                reference_day = first + day - lookback
+                strength_ref = reference_strength[reference_day] if reference_day >= 0 else 0.0
+                rs[:, j] = (1 + strength) / (1 + strength_ref) * 100
+            rs = np.where(np.isfinite(rs), np.trunc(rs * 100) / 100, 0.0)
+
+        keep = rs[:, 0] < 590
+        rows, rs = rows[keep], rs[keep]
+        rs_matrix[day, rows] = rs[:, 0]
+        for j, labels in enumerate(rs_ranking.qcut_labels(rs)):
+            percentiles[j, day, rows] = np.where(np.isnan(labels), MISSING, labels)
+
+    return RSMatrix(timestamps, tickers, rs_matrix, percentiles, list(PRICE_DATA))
+
+
+def load_or_build(PRICE_DATA, path=MATRIX_FILE, start_date=None):
+    """Loads the persisted matrix when it is up to date with PRICE_DATA and covers ``start_date``, otherwise
+    builds the days from ``start_date`` on and saves them."""
+    start_timestamp = None
+    if start_date is not None:
+        calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA, rs_ranking.REFERENCE_TICKER)
+        first = first_day(calendar, start_date)
+        start_timestamp = calendar.timestamp_at(first) if first < len(calendar) else None
+    if os.path.exists(path):
+        try:
+            matrix = RSMatrix.load(path)
+            if matrix.is_current(PRICE_DATA, start_timestamp):
+                return matrix
+        except Exception as e:
+            print(f"Error loading RS matrix: {e}")
+
+    matrix = build(PRICE_DATA, start_date)
+    matrix.save(path)
+    print(f"Computed RS for {len(matrix.tickers)} tickers over {len(matrix.dates)} trading days")
+    return matrix
+
+
+def main():
+    load_or_build(rs_ranking.load_data())
+
+
+if __name__ == "__main__":
+    main()
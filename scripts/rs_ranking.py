@@ -1,17 +1,20 @@
-import gzip
 import itertools
-import json
 import math
 import os
-import string
 import sys
 
 import yaml
 
+import numpy as np
 import pandas as pd
 import datetime
 
+from scripts import indicators
+from scripts import metrics
+from scripts import price_store
+from scripts import rs_store
 from scripts import screen_stocks
+from scripts import trading_calendar
 from scripts.rs_data import cfg
 
 DIR = os.path.dirname(os.path.abspath(__file__))
@@ -41,6 +44,14 @@ TITLE_3M = "3 Months Ago"
 TITLE_6M = "6 Months Ago"
 TITLE_RS = "Relative Strength"
 
+MONTH = 20
+RS_QUARTER = int(252 / 4)
+QUARTER_WEIGHTS = (0.4, 0.2, 0.2, 0.2)
+# Offsets (in candles) of the "now", 1, 3 and 6 months ago rankings
+RS_LOOKBACKS = (0, MONTH, 3 * MONTH, 6 * MONTH)
+# Closes needed to compute every lookback: a full year of quarters behind the oldest one
+RS_HISTORY = len(QUARTER_WEIGHTS) * RS_QUARTER + RS_LOOKBACKS[-1]
+
 if not os.path.exists('../rs_stocks'):
     os.makedirs('../rs_stocks')
 
@@ -69,56 +80,152 @@ def strength(closes: pd.Series):
 
 
 def quarters_perf(closes: pd.Series, n):
-    length = min(len(closes), n * int(252 / 4))
+    length = min(len(closes), n * RS_QUARTER)
     prices = closes.tail(length)
     pct_chg = prices.pct_change().dropna()
     perf_cum = (pct_chg + 1).cumprod() - 1
     return perf_cum.tail(1).item()
 
 
-def rankings(PRICE_DATA, end_date):
-    output_dir = os.path.join(os.path.dirname(DIR), 'rs_stocks')
-    output_path = os.path.join(output_dir, f'rs_stocks_{end_date}.csv')
-    original_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-    for i in range(0, 1):
-        try_date = original_date - datetime.timedelta(days=i)
-        try_date_str = try_date.strftime("%Y-%m-%d")
-        output_path = os.path.join(output_dir, f'rs_stocks_{try_date_str}.csv')
-        if os.path.exists(output_path):
-            print(f"rs_stocks file {output_path} already exists. Loading...")
-            df = pd.read_csv(output_path)
-            return [df]
-
-    relative_strengths = []
-    stock_rs = {}
-    total = len(PRICE_DATA)
-    closes_ref = pd.Series([candle["close"] for candle in PRICE_DATA[REFERENCE_TICKER]["candles"]])
-
-    for i, (ticker, data) in enumerate(PRICE_DATA.items()):
-        # print(f"\rCalculating ranking for {ticker:>5}, {i + 1:>5} / {total:>5}, {(i + 1) / total * 100:>6.2f}% ",
-        #       end="", flush=True)
+def close_matrix(PRICE_DATA, tickers, width=RS_HISTORY):
+    """Right-aligns the last ``width`` closes of every ticker into one (tickers x width) matrix, NaN-padded on the
+    left for shorter histories."""
+    return indicators.aligned_matrix(PRICE_DATA, tickers, "close", width)[0]
+
+
+def next_valid_columns(closes):
+    """For every cell of a close matrix, the column of the first non-NaN close at or after it (width if none)."""
+    width = closes.shape[1]
+    columns = np.where(~np.isnan(closes), np.arange(width), width)
+    return np.minimum.accumulate(columns[:, ::-1], axis=1)[:, ::-1]
+
+
+def quarter_bases(closes, next_valid, end):
+    """First close of every quarter window ending at column ``end``, and the rows where a window has no change to
+    compound."""
+    rows = np.arange(closes.shape[0])
+    width = closes.shape[1]
+    bases = []
+    failed = np.zeros(closes.shape[0], dtype=bool)
+    for quarters in range(1, len(QUARTER_WEIGHTS) + 1):
+        first = next_valid[:, max(0, end - quarters * RS_QUARTER + 1)]
+        failed |= first >= end
+        bases.append(closes[rows, np.minimum(first, width - 1)])
+    return bases, failed
+
+
+def weighted_strength(last_closes, bases, failed):
+    """``strength()`` of rows whose windows end on ``last_closes`` and start on ``bases``, see ``quarter_bases``."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total = sum(weight * (last_closes / base - 1) for weight, base in zip(QUARTER_WEIGHTS, bases))
+    return np.where(failed, 0.0, total)
+
+
+def strength_matrix(closes):
+    """``strength()`` of every row of a right-aligned close matrix, for each lookback in ``RS_LOOKBACKS``.
+
+    A quarter's performance is the last close over the first close of its window, forward-filling gaps like
+    ``pct_change`` does; a row whose window has no change to compound gets 0, like the ``except`` in ``strength``.
+    """
+    n_rows, width = closes.shape
+    columns = np.arange(width)
+    last_valid = np.maximum.accumulate(np.where(~np.isnan(closes), columns, -1), axis=1)
+    filled = np.take_along_axis(closes, np.maximum(last_valid, 0), axis=1)
+    next_valid = next_valid_columns(closes)
+
+    result = np.zeros((n_rows, len(RS_LOOKBACKS)))
+    for j, lookback in enumerate(RS_LOOKBACKS):
+        end = width - 1 - lookback
+        result[:, j] = weighted_strength(filled[:, end], *quarter_bases(closes, next_valid, end))
+    return result
+
+
+def qcut_labels(values, q=100):
+    """``pd.qcut(column, q, labels=False, duplicates="drop")`` for every column of ``values``.
+
+    The quantile edges of all columns come out of a single sort, using the same "fraction" interpolation as
+    pandas so the labels are identical.
+    """
+    n = values.shape[0]
+    if n == 0:
+        return [np.zeros(0, dtype=int) for _ in range(values.shape[1])]
+    ordered = np.sort(values, axis=0)
+    position = np.linspace(0, 1, q + 1) * (n - 1)
+    lower = position.astype(int)
+    fraction = (position - lower)[:, None]
+    upper = np.minimum(lower + 1, n - 1)
+    edges = np.where(fraction == 0, ordered[lower], ordered[lower] + (ordered[upper] - ordered[lower]) * fraction)
+
+    labels = []
+    for j in range(values.shape[1]):
+        bins = pd.unique(edges[:, j])
+        ids = np.searchsorted(bins, values[:, j], side="left")
+        ids[values[:, j] == bins[0]] = 1
+        na_mask = (ids == len(bins)) | (ids == 0)
+        column = ids - 1
+        if na_mask.any():
+            column = column.astype(float)
+            column[na_mask] = np.nan
+        labels.append(column)
+    return labels
+
+
+def relative_strengths(strengths, strengths_ref):
+    """RS of strengths against the reference's, truncated to 2 decimals and 0 where undefined."""
+    rs = (1 + strengths) / (1 + strengths_ref) * 100
+    return np.where(np.isfinite(rs), np.trunc(rs * 100) / 100, 0.0)
+
+
+def relative_strengths_now(PRICE_DATA):
+    """Relative strength now, 1, 3 and 6 months ago of every ticker with at least 6 months of history."""
+    tickers = []
+    for ticker, data in PRICE_DATA.items():
         try:
-            closes = pd.Series([candle["close"] for candle in data["candles"]], dtype=float)
-            if len(closes) >= 6 * 20:
-                rs = relative_strength(closes, closes_ref)
-                month = 20
-                tmp_percentile = 100
-                rs1m = relative_strength(closes.head(-1 * month), closes_ref.head(-1 * month))
-                rs3m = relative_strength(closes.head(-3 * month), closes_ref.head(-3 * month))
-                rs6m = relative_strength(closes.head(-6 * month), closes_ref.head(-6 * month))
-
-                if rs < 590:
-                    relative_strengths.append((ticker, rs, tmp_percentile, rs1m, rs3m, rs6m))
-                    stock_rs[ticker] = rs
+            if len(price_store.column(data, "close")) >= 6 * MONTH:
+                tickers.append(ticker)
         except KeyError:
             print(f'Ticker {ticker} has corrupted data.')
 
-    df = pd.DataFrame(relative_strengths,
-                      columns=[TITLE_TICKER, TITLE_RS, TITLE_PERCENTILE, TITLE_1M, TITLE_3M, TITLE_6M])
-    df[TITLE_PERCENTILE] = pd.qcut(df[TITLE_RS], 100, labels=False, duplicates="drop")
-    df[TITLE_1M] = pd.qcut(df[TITLE_1M], 100, labels=False, duplicates="drop")
-    df[TITLE_3M] = pd.qcut(df[TITLE_3M], 100, labels=False, duplicates="drop")
-    df[TITLE_6M] = pd.qcut(df[TITLE_6M], 100, labels=False, duplicates="drop")
+    strengths = strength_matrix(close_matrix(PRICE_DATA, tickers))
+    strengths_ref = strength_matrix(close_matrix(PRICE_DATA, [REFERENCE_TICKER]))
+    return tickers, relative_strengths(strengths, strengths_ref)
+
+
+def ranking_frame(tickers, rs):
+    """Unsorted ranking of ``tickers`` from their RS now, 1, 3 and 6 months ago."""
+    keep = rs[:, 0] < 590
+    tickers = [ticker for ticker, kept in zip(tickers, keep) if kept]
+    rs = rs[keep]
+
+    percentile, percentile_1m, percentile_3m, percentile_6m = qcut_labels(rs)
+    return pd.DataFrame({
+        TITLE_TICKER: tickers,
+        TITLE_RS: rs[:, 0],
+        TITLE_PERCENTILE: percentile,
+        TITLE_1M: percentile_1m,
+        TITLE_3M: percentile_3m,
+        TITLE_6M: percentile_6m,
+    })
+
+
+def rankings_frame(PRICE_DATA):
+    """Unsorted ranking of every ticker: RS now and the percentiles of now, 1, 3 and 6 months ago."""
+    return ranking_frame(*relative_strengths_now(PRICE_DATA))
+
+
+@metrics.timed("rank")
+def rankings(PRICE_DATA, end_date, rs_matrix=None, persist=True):
+    """Ranking of ``end_date``, read from the RS store when it holds the day. Otherwise computed and, unless
+    ``persist`` is False, appended to the store."""
+    store = rs_store.open_store()
+    if store.has_date(end_date):
+        print(f"RS rankings of {end_date} already stored. Loading...")
+        return [store.frame(end_date)]
+
+    if rs_matrix is not None and end_date in rs_matrix.date_index:
+        df = rs_matrix.frame(end_date)
+    else:
+        df = rankings_frame(PRICE_DATA)
     df = df.sort_values(([TITLE_RS]), ascending=False).reset_index(drop=True)
     df[TITLE_RANK] = df.index + 1
 
@@ -141,90 +248,45 @@ def rankings(PRICE_DATA, end_date):
         rs_value = first_row[TITLE_RS]
         first_rs_values[percentile] = rs_value
 
-    os.makedirs(output_dir, exist_ok=True)
-    df.to_csv(output_path, index=False)
+    if persist:
+        store.append(end_date, df)
 
     return [df]
 
 
 def find_closest_date(PRICE_DATA, target_date_str):
-    # Convert date string to timestamp with market close time (16:00)
-    target_ts = int(datetime.datetime.strptime(target_date_str, "%Y-%m-%d").replace(hour=16, minute=0, second=0).timestamp())
-
-    # find max candles based on the earliest timestamp
-    max_candles = None
-    min_timestamp = None
-
-    for data in PRICE_DATA.values():
-        candles = data.get("candles", [])
-        if not candles:
-            continue
-        timestamp = candles[0]["datetime"]
-        if timestamp == target_ts:
-            return target_ts
-        if min_timestamp is None or timestamp < min_timestamp:
-            min_timestamp = timestamp
-            max_candles = candles
-
-    if max_candles is None:
-        return None  # or raise an exception
-
-    def key_function(item):
-        index, candle = item
-        return abs(candle["datetime"] - target_ts)
-
-    _, closest_candle = min(enumerate(max_candles), key=key_function)
-    return closest_candle["datetime"]
+    """Timestamp of the reference ticker's trading day closest to ``target_date_str``."""
+    return trading_calendar.TradingCalendar.from_price_data(PRICE_DATA).closest_to_date(target_date_str)
 
 
+@metrics.timed("filter")
 def filter_price_data_by_index(price_data: dict, timestamp: int) -> dict:
-    filtered_data = {}
-    for ticker, data in price_data.items():
-        candles = data.get("candles", [])
-        filtered_candles = []
-        for i, candle in enumerate(candles):
-            if candle["datetime"] < timestamp:
-                continue
-            else:
-                filtered_candles = candles[:i + 1]
-                break
-        if len(filtered_candles) > 0:
-            filtered_data[ticker] = {"candles": filtered_candles}
-    return filtered_data
-
-
-def load_data():
-    """Load price history data in parallel using ThreadPoolExecutor for faster processing."""
-    import concurrent.futures
-
-    def load_file(char):
-        try:
-            file_path = os.path.join(os.path.dirname(DIR), 'data_persist', f'{char}_price_history.json.gz')
-            with gzip.open(file_path, 'rb') as f_in:
-                return json.loads(f_in.read().decode('utf-8'))
-        except Exception as e:
-            print(f"Error loading file for '{char}': {e}")
-            return {}
+    """Zero-copy view of the price data as of ``timestamp``, see ``price_store.AsOfView``."""
+    return price_store.AsOfView(price_data, timestamp)
 
-    PRICE_DATA = {}
-    chars = list(string.ascii_lowercase)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(26, len(chars))) as executor:
-        future_to_char = {executor.submit(load_file, char): char for char in chars}
+@metrics.timed("load")
+def load_data(tickers=None, lazy=False):
+    """Open the memory-mapped price store, first building the shards it lacks from the JSON shards.
 
-        for i, future in enumerate(concurrent.futures.as_completed(future_to_char)):
-            char = future_to_char[future]
-            print(f"\rLoading in parallel: {(i + 1):3}/{len(chars)} files processed ({char.upper()})",
-                  end="", flush=True)
-            data = future.result()
-            if data:
-                PRICE_DATA.update(data)
+    With ``tickers`` only the shards holding those tickers are opened and the result only has them. With ``lazy``
+    nothing is read until a ticker is accessed, see ``price_store.PriceData``.
+    """
+    price_store.build_from_json(price_store.missing_shards())
+    if lazy and price_store.shard_names():
+        PRICE_DATA = price_store.PriceData(tickers=tickers)
+        print(f"Opened lazy price data for {len(PRICE_DATA)} tickers\n")
+        return PRICE_DATA
+    store = price_store.open_store(tickers=tickers)
+    if store is not None:
+        print(f"Opened price store for {len(store)} tickers in {len(store.shards)} shards\n")
+        return store
 
-    print(f"\nLoaded price data for {len(PRICE_DATA)} tickers\n")
-    return PRICE_DATA
+    print("No price data to load\n")
+    return {}
 
 
-def main(PRICE_DATA=None, timestamp_override=None, new_csv=False):
+def main(PRICE_DATA=None, timestamp_override=None, new_csv=False, rs_matrix=None):
     if PRICE_DATA is None:
         PRICE_DATA = load_data()
 
@@ -244,7 +306,7 @@ def main(PRICE_DATA=None, timestamp_override=None, new_csv=False):
                 .strftime('%Y-%m-%d'))
     print(f"Loaded data from {start_date} to {end_date}")
 
-    rankings(filtered_price_date, end_date)
+    rankings(filtered_price_date, end_date, rs_matrix)
     screen_stocks.main(PRICE_DATA, filtered_price_date, end_date, new_csv)
 
     return filtered_price_date, end_date
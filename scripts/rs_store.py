@@ -0,0 +1,155 @@
+"""RS history in one SQLite database instead of one CSV per day.
+
+``rs_history`` holds every ranked ticker of every day with the columns of the
+old ``rs_stocks_<date>.csv`` files, keyed by (date, ticker) and indexed by
+(ticker, date), so a day's ranking, a ticker's percentile history or the last
+ranked day before a date are single indexed queries. The old CSVs are imported
+the first time the store is opened (or with ``python -m scripts.rs_store``).
+The database is not committed, the workflows carry it between runs as a cache.
+"""
+import glob
+import os
+import re
+import sqlite3
+
+import pandas as pd
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+DB_FILE = os.path.join(os.path.dirname(DIR), 'data_persist', 'rs_history.sqlite')
+CSV_DIR = os.path.join(os.path.dirname(DIR), 'rs_stocks')
+
+# Database column -> column title of the rankings frame and the old CSVs
+COLUMNS = {
+    "ticker": "Ticker",
+    "rs": "Relative Strength",
+    "percentile": "Percentile",
+    "month_1": "1 Month Ago",
+    "month_3": "3 Months Ago",
+    "month_6": "6 Months Ago",
+    "rank": "Rank",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rs_history (
+    date TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    rs REAL,
+    percentile INTEGER,
+    month_1 INTEGER,
+    month_3 INTEGER,
+    month_6 INTEGER,
+    rank INTEGER,
+    PRIMARY KEY (date, ticker)
+);
+CREATE INDEX IF NOT EXISTS rs_history_ticker ON rs_history (ticker, date);
+"""
+
+
+class RSStore:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # A connection must not cross a fork, walk-forward workers open their own
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def append(self, date, df):
+        """Stores the ranking ``df`` of ``date``, replacing whatever was stored for that day."""
+        frame = df.rename(columns={title: column for column, title in COLUMNS.items()})[list(COLUMNS)]
+        rows = [(date, *row) for row in frame.astype(object).where(frame.notna(), None).itertuples(index=False)]
+        with self.connection:
+            self.connection.execute("DELETE FROM rs_history WHERE date = ?", (date,))
+            self.connection.executemany(
+                f"INSERT INTO rs_history (date, {', '.join(COLUMNS)}) VALUES (?{', ?' * len(COLUMNS)})", rows)
+
+    def has_date(self, date):
+        row = self.connection.execute("SELECT 1 FROM rs_history WHERE date = ? LIMIT 1", (date,)).fetchone()
+        return row is not None
+
+    def dates(self):
+        return [date for date, in self.connection.execute("SELECT DISTINCT date FROM rs_history ORDER BY date")]
+
+    def latest_date(self, on_or_before=None):
+        """Last ranked day, or the last one on or before ``on_or_before``; None when there is none."""
+        if on_or_before is None:
+            row = self.connection.execute("SELECT MAX(date) FROM rs_history").fetchone()
+        else:
+            row = self.connection.execute("SELECT MAX(date) FROM rs_history WHERE date <= ?",
+                                          (on_or_before,)).fetchone()
+        return row[0]
+
+    def frame(self, date, limit=None):
+        """Ranking of ``date`` in rank order with the CSV column titles, the best ``limit`` rows if given."""
+        query = f"SELECT {', '.join(COLUMNS)} FROM rs_history WHERE date = ? ORDER BY rank"
+        params = (date,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (date, int(limit))
+        return pd.read_sql_query(query, self.connection, params=params).rename(columns=COLUMNS)
+
+    def top(self, date, n):
+        """The ``n`` strongest tickers of ``date``."""
+        return self.frame(date, limit=n)
+
+    def count(self, date):
+        return self.connection.execute("SELECT COUNT(*) FROM rs_history WHERE date = ?", (date,)).fetchone()[0]
+
+    def percentile_history(self, ticker, start_date=None, end_date=None):
+        """Percentile of ``ticker`` on every stored day between the two dates, as a Series indexed by date."""
+        query = "SELECT date, percentile FROM rs_history WHERE ticker = ?"
+        params = [ticker]
+        if start_date is not None:
+            query += " AND date >= ?"
+            params.append(start_date)
+        if end_date is not None:
+            query += " AND date <= ?"
+            params.append(end_date)
+        df = pd.read_sql_query(query + " ORDER BY date", self.connection, params=params)
+        return pd.Series(df["percentile"].values, index=df["date"], name=ticker)
+
+    def import_csvs(self, directory=CSV_DIR):
+        """Imports every ``rs_stocks_<date>.csv`` of ``directory`` whose day is not stored yet."""
+        stored = set(self.dates())
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(directory, 'rs_stocks_*.csv'))):
+            match = re.search(r'rs_stocks_(\d{4}-\d{2}-\d{2})\.csv$', path)
+            if match is None or match.group(1) in stored:
+                continue
+            self.append(match.group(1), pd.read_csv(path))
+            imported += 1
+        if imported:
+            print(f"Imported {imported} rs_stocks CSV files into {self.path}")
+        return imported
+
+
+_STORE = None
+
+
+def open_store():
+    """The shared store, importing the old CSVs the first time the database is created."""
+    global _STORE
+    if _STORE is None:
+        exists = os.path.exists(DB_FILE)
+        _STORE = RSStore(DB_FILE)
+        if not exists:
+            _STORE.import_csvs()
+    return _STORE
+
+
+def main():
+    store = RSStore()
+    store.import_csvs()
+    print(f"{len(store.dates())} days in {store.path}")
+
+
+if __name__ == "__main__":
+    main()
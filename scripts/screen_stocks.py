@@ -1,179 +1,152 @@
 import os
 import datetime
 import sys
-from dateutil.relativedelta import relativedelta
 import yfinance as yf
 import csv
 import time
 import pandas as pd
 import json
+import numpy as np
 
+from scripts import forward_labels
+from scripts import fundamentals
+from scripts import indicators
+from scripts import metrics
+from scripts import price_store
 from scripts import rs_ranking
+from scripts import rs_store
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 OUTPUT_DIR = os.path.join(os.path.dirname(DIR), 'data_persist')
-CACHE_FILE = os.path.join(OUTPUT_DIR, '_market_cap_cache.json')
 
 pd.set_option('display.max_rows', None)
 pd.set_option('display.width', None)
 pd.set_option('display.max_columns', None)
 
 
-# Load cache on module load
-def load_market_cap_cache():
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, "r", encoding="utf8") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading market cap cache: {e}")
-    return {}
-
-
-def save_market_cap_cache():
-    try:
-        with open(CACHE_FILE, "w", encoding="utf8") as f:
-            json.dump(market_cap_cache, f)
-    except Exception as e:
-        print(f"Error saving market cap cache: {e}")
-
-
-market_cap_cache = load_market_cap_cache()
-
-
-def load_csv(end_date):
-    original_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-    for i in range(0, 11):
-        try_date = original_date - datetime.timedelta(days=i)
-        try_date_str = try_date.strftime("%Y-%m-%d")
-        path = os.path.join(os.path.dirname(DIR), 'rs_stocks', f'rs_stocks_{try_date_str}.csv')
-        if os.path.exists(path):
-            with open(path, mode='r') as csv_file:
-                csv_reader = csv.reader(csv_file)
-                rows = list(csv_reader)
-                first_half_rows = rows[:len(rows) // 5 + 1]
-            return first_half_rows
-    return None
+def load_csv(end_date, ranking=None):
+    """Header plus the top fifth of the latest RS ranking at most 10 days before ``end_date``, as rows of the old
+    rs_stocks CSV. With ``ranking``, the top fifth of that ranking of ``end_date`` instead of the stored one."""
+    if ranking is not None:
+        df = ranking[list(rs_store.COLUMNS.values())].head((len(ranking) + 1) // 5)
+        return [list(df.columns)] + df.values.tolist()
+    store = rs_store.open_store()
+    date = store.latest_date(end_date)
+    oldest = (datetime.datetime.strptime(end_date, "%Y-%m-%d") - datetime.timedelta(days=10)).strftime("%Y-%m-%d")
+    if date is None or date < oldest:
+        return None
+    # The CSV's first fifth counted its header line
+    df = store.top(date, (store.count(date) + 1) // 5)
+    return [list(df.columns)] + df.values.tolist()
 
 
 def calculate_sma(prices, window, shift_back=1):
-    close_prices = [candle['close'] for candle in prices['candles']]
+    close_prices = price_store.column(prices, 'close').tolist()
     if len(close_prices) < window:
         return None
     return sum(close_prices[-(window + shift_back):-shift_back]) / window
 
 
-def find_last_max_price(prices, max_value):
-    close_prices = [candle['close'] for candle in prices['candles']]
-    for index, price in enumerate(reversed(close_prices)):
-        if index == 0: continue
-        if price >= max_value: return index
-    return 3650
+# Returned by the find_last_* helpers when no earlier candle is high enough
+NOT_FOUND = 3650
+
 
+def find_last_higher(prices, field, back=0):
+    """Candles between the last one and the nearest candle at or above the ``field`` of candle ``-1 - back``,
+    looking only before that candle. A lookup in the precomputed ``<field>_since_higher`` column."""
+    since_higher = price_store.column(prices, f'{field}_since_higher')
+    position = len(since_higher) - 1 - back
+    if position < 0:
+        return NOT_FOUND
+    distance = int(since_higher[position])
+    # 0 is no higher candle at all, past position it is higher but before the start of this slice of history
+    if distance == 0 or distance > position:
+        return NOT_FOUND
+    return distance + back
 
-def find_last_last_max_price(prices, max_value):
-    close_prices = [candle['close'] for candle in prices['candles']]
-    for index, price in enumerate(reversed(close_prices)):
-        if index == 0: continue
-        if index == 1: continue
-        if price >= max_value: return index
-    return 3650
 
+def find_last_max_price(prices):
+    return find_last_higher(prices, 'close')
 
-def find_last_max_volume(prices, max_value):
-    volume = [candle['volume'] for candle in prices['candles']]
-    for index, volume in enumerate(reversed(volume)):
-        if index == 0: continue
-        if volume >= max_value: return index
-    return 3650
+
+def find_last_last_max_price(prices):
+    return find_last_higher(prices, 'close', back=1)
+
+
+def find_last_max_volume(prices):
+    return find_last_higher(prices, 'volume')
 
 
 def find_avg_volume(prices, window):
-    volumes = [candle['volume'] for candle in prices['candles']]
+    volumes = price_store.column(prices, 'volume').tolist()
     if len(volumes) < window:
         return 0
     return sum(volumes[-window:]) / window
 
 
 def get_change_on_date(prices, target_date):
-    candles = prices['candles']
-    for i, candle in enumerate(candles):
-        if candle['datetime'] == target_date:
-            this_close = candles[i]['close']
-            last_close = candles[i - 1]['close']
-            if last_close == 0: return 0
-            return (this_close - last_close) / last_close
-    return None
+    matches = np.flatnonzero(price_store.column(prices, 'datetime') == target_date)
+    if len(matches) == 0:
+        return None
+    close_prices = price_store.column(prices, 'close')
+    i = matches[0]
+    this_close = float(close_prices[i])
+    last_close = float(close_prices[i - 1])
+    if last_close == 0: return 0
+    return (this_close - last_close) / last_close
 
 
 def get_close_avg_movement_last_period(prices, period, shift_back=1):
-    candles = prices['candles'][(-period + 1):]
+    close_prices = price_store.column(prices, 'close')[(-period + 1):].tolist()
     changes = []
-    for i in range(1, len(candles)):
-        prev_close = candles[i - 1]['close']
+    for i in range(1, len(close_prices)):
+        prev_close = close_prices[i - 1]
         if prev_close == 0:
             change = 0  # or use `continue` to skip this iteration
         else:
-            change = (candles[i]['close'] - prev_close) / prev_close
+            change = (close_prices[i] - prev_close) / prev_close
         changes.append(change)
     sum_abs = sum(abs(change) for change in changes)
     return sum_abs / period
 
 
 def get_close_max_movement_last_period(prices, period):
-    candles = prices['candles'][(-period + 1):]
+    close_prices = price_store.column(prices, 'close')[(-period + 1):].tolist()
     changes = []
-    for i in range(1, len(candles)):
-        prev_close = candles[i - 1]['close']
+    for i in range(1, len(close_prices)):
+        prev_close = close_prices[i - 1]
         if prev_close == 0:
             change = 0  # or use `continue` to skip this iteration
         else:
-            change = (candles[i]['close'] - prev_close) / prev_close
+            change = (close_prices[i] - prev_close) / prev_close
         changes.append(change)
     max_abs = max(abs(change) for change in changes)
     return max_abs
 
 
-def get_market_cap_info(ticker_symbol):
-    global market_cap_cache
-
-    # # Check if market cap is already cached
-    # if ticker_symbol in market_cap_cache:
-    #     market_cap = market_cap_cache[ticker_symbol]["market_cap"]
-    #     beta = market_cap_cache[ticker_symbol]["beta"]
-    #     next_earning = market_cap_cache[ticker_symbol]["next_earning"]
-    #     exchange = market_cap_cache[ticker_symbol]["exchange"]
-    #     return market_cap, beta, next_earning, exchange
-
-    for _ in range(2):
-        try:
-            ticker = yf.Ticker(ticker_symbol)
-            info = ticker.info
-            market_cap = info.get("marketCap")
-            # beta = info.get("beta")
-            # exchange = info.get("exchange")
-            # currency = info.get("currency")
-            # next_earning = ticker.calendar["Earnings Date"][0].strftime("%Y-%m-%d")
-            if market_cap is None:
-                market_cap = 0
-            market_cap_cache.setdefault(ticker_symbol, {})["market_cap"] = market_cap
-            return market_cap, info
-        except Exception:
-            if _ == 1:
-                time.sleep(1)
-            else:
-                market_cap_cache.setdefault(ticker_symbol, {})["market_cap"] = 0
-    return 0, None
-
-
-def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False):
-    first_half_rows = load_csv(end_date)
+def get_market_cap_info(ticker_symbol, fetch=True):
+    """Market cap and the ``Ticker.info`` fields the screen reads, from the fundamentals cache. Stale fields are
+    fetched again first unless ``fetch`` is False."""
+    values = fundamentals.get(ticker_symbol) if fetch else fundamentals.CACHE.get(ticker_symbol)
+    info = {key: values.get(field) for field, key in fundamentals.INFO_KEYS.items()}
+    return values.get("market_cap") or 0, info
+
+
+@metrics.timed("screen")
+def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False, append_csv=True, ranking=None, fetch=True):
+    """Screens the top of the day's RS ranking, the stored one or ``ranking``. With ``fetch`` False the
+    fundamentals are read from the cache only, stale or not."""
+    first_half_rows = load_csv(end_date, ranking)
     price_history = filtered_price_date
     results = []
 
     filtered_rows = [row for row in first_half_rows if row[0] in price_history]
-    total = len(filtered_rows)
-    for i, row in enumerate(filtered_rows):
+    features = indicators.feature_table(price_history, [row[0] for row in filtered_rows])
+    features = features[features["length"] >= 2]
+
+    # Cheap technical checks on the whole table first, the breakout scans and market cap lookups only on what passes
+    candidates = features[features["mm_pass"] & (features["price_change"] > 0) & (features["price_change"] < 8)]
+    if len(candidates):
         vix_ticker = "^VIX"
         vix = price_history[vix_ticker]["candles"][-1]["close"]
         vix_sma20 = calculate_sma(price_history[vix_ticker], 10)
@@ -182,59 +155,35 @@ def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False):
         # print(f"VIX is too high: {vix}, (SMA20 {vix_sma20})\n")
         # return
 
-        ticker = row[0]
-        # print(f"Screening stocks {ticker} \r{i + 1} / {total}, {(i + 1) / total * 100:.2f}% ", end="", flush=True)
-
-        sma10 = calculate_sma(price_history[ticker], 10)
-        sma50 = calculate_sma(price_history[ticker], 50)
-        sma150 = calculate_sma(price_history[ticker], 150)
-        sma200 = calculate_sma(price_history[ticker], 200)
-        sma200_22 = calculate_sma(price_history[ticker], 200, 22)
-
-        if len(price_history[ticker]["candles"]) < 2:
-            continue
-        latest_close_price = price_history[ticker]["candles"][-1]["close"]
-        yesterday_close_price = price_history[ticker]["candles"][-2]["close"]
-        volume = price_history[ticker]["candles"][-1]["volume"]
-        date = price_history[ticker]["candles"][-1]["datetime"]
-        price_change = get_change_on_date(price_history[ticker], date) * 100
-
-        last_max_price = find_last_max_price(price_history[ticker], latest_close_price)
-        last_max_price_yesterday = find_last_last_max_price(price_history[ticker], yesterday_close_price)
-        last_max_volume = find_last_max_volume(price_history[ticker], volume)
-
-        close_sma10 = latest_close_price / sma10 if sma10 else 0
-        close_sma50 = latest_close_price / sma50 if sma50 else 0
-        close_sma150 = latest_close_price / sma150 if sma150 else 0
-        close_sma200 = latest_close_price / sma200 if sma200 else 0
-        sma50_sma150 = sma50 / sma150 if sma150 else 0
-        sma50_sma200 = sma50 / sma200 if sma200 else 0
-        sma150_sma200 = sma150 / sma200 if sma200 else 0
-        trending_up = sma200 / sma200_22 if sma200_22 else 0
-
-        mm_conditions = [
-            close_sma50 > 1,
-            close_sma150 > 1,
-            close_sma200 > 1,
-            sma50_sma150 > 1,
-            sma50_sma200 > 1,
-            sma150_sma200 > 1,
-            trending_up > 1,
-        ]
-
-        mm_score = sum(1 for mm_condition in mm_conditions if mm_condition)
-
-        avg_volume100 = find_avg_volume(price_history[ticker], 100)
-        volume_volume100 = volume / avg_volume100 if avg_volume100 else 0
-        max_mov5 = get_close_max_movement_last_period(price_history[ticker], 5) * 100
-        max_mov100 = get_close_max_movement_last_period(price_history[ticker], 100) * 100
+    # Fetch the fundamentals of every candidate at once, get_market_cap_info below then reads the cache
+    if fetch:
+        fundamentals.prefetch(candidates.index)
+
+    for ticker, feature in candidates.iterrows():
+        date = feature["datetime"]
+        price_change = feature["price_change"]
+        mm_score = int(feature["mm_score"])
+        close_sma10 = feature["close_sma10"]
+        close_sma50 = feature["close_sma50"]
+        close_sma150 = feature["close_sma150"]
+        close_sma200 = feature["close_sma200"]
+        sma50_sma150 = feature["sma50_sma150"]
+        sma50_sma200 = feature["sma50_sma200"]
+        sma150_sma200 = feature["sma150_sma200"]
+        trending_up = feature["trending_up"]
+        max_mov5 = feature["max_mov5"]
+        max_mov100 = feature["max_mov100"]
+
+        last_max_price = find_last_max_price(price_history[ticker])
+        last_max_price_yesterday = find_last_last_max_price(price_history[ticker])
+        last_max_volume = find_last_max_volume(price_history[ticker])
 
         # last_max_price > 90 -> A price like this must be at least 90 days ago -> soit at ATH, soit ATH since 90 days
         # 90 > last_max_price_yesterday -> we had yesterday's price within 90d -> I need at least one mini vcp loop
         is_breakout = 0 < price_change < 8 and last_max_price > 90 > last_max_price_yesterday > 2
 
-        if mm_score >= len(mm_conditions) and is_breakout:
-            market_cap, info = get_market_cap_info(ticker)
+        if is_breakout:
+            market_cap, info = get_market_cap_info(ticker, fetch)
             beta = info.get("beta")
             exchange = info.get("exchange")
             currency = info.get("currency")
@@ -257,7 +206,7 @@ def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False):
 
             xc_score = sum(1 for xc_condition in xc_conditions if xc_condition)
 
-            date_string = datetime.datetime.fromtimestamp(date).strftime('%Y-%m-%d')
+            date_string = datetime.datetime.fromtimestamp(int(date)).strftime('%Y-%m-%d')
 
             if xc_score >= len(xc_conditions) - 3 and 1 <= market_cap_billion < 200:
                 results.append(
@@ -269,7 +218,6 @@ def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False):
                      f"{vix:>6.2f}", f"{vix_sma20:>6.2f}", f"{close_sma10:>6.2f}",
                      f"{mm_score}/7", f"{xc_score}/7", f"N/A", "N/A")),
 
-    save_market_cap_cache()
     print("\n")
     if len(results) == 0:
         print("No stocks passed\n")
@@ -288,56 +236,27 @@ def screen(PRICE_DATA, filtered_price_date, end_date, new_csv=False):
 
     if new_csv:
         formated_results = {}
-        for r in results:
-            ticker = r[0]
-            if ticker in PRICE_DATA:
-                candles = PRICE_DATA[ticker]["candles"]
-                signal_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-                # Add 16 hours to signal_date to match market close time
-                signal_timestamp = int((signal_date + relativedelta(hours=16)).timestamp())
-                signal_price = 10000000
-                low_since_signal = signal_price
-                high_since_signal = 0
-                valid = False
-
-                for i, candle in enumerate(candles):
-                    if abs(candle["datetime"] - signal_timestamp) < 86400:  # Within 24 hours
-                        signal_price = candle["close"]
-                    elif candle["datetime"] > signal_timestamp:
-                        valid = True
-                        if candle["close"] < low_since_signal:
-                            low_since_signal = candle["close"]
-                        if candle["close"] > high_since_signal:
-                            high_since_signal = candle["close"]
-
-                last_price = candles[-1]["close"]
-                gain = (last_price - signal_price) / signal_price
-                if valid:
-                    low_since_signal = (low_since_signal - signal_price) / signal_price
-                    high_since_signal = (high_since_signal - signal_price) / signal_price
-                else:
-                    low_since_signal = 0
-                    high_since_signal = 0
-
-                formated_results[ticker] = {
-                    "score": r[1],
-                    "date": r[2],
-                    "exchange": r[3],
-                    "currency": r[4],
-                    "gain": gain,
-                    "low_since_signal": low_since_signal,
-                    "high_since_signal": high_since_signal,
-                }
+        signals = [r for r in results if r[0] in PRICE_DATA]
+        labels = forward_labels.label(PRICE_DATA, [(r[0], end_date) for r in signals])
+        for r, label in zip(signals, labels):
+            formated_results[r[0]] = {
+                "score": r[1],
+                "date": r[2],
+                "exchange": r[3],
+                "currency": r[4],
+                **label,
+            }
         json_path = os.path.join(os.path.dirname(DIR), 'screen_results/daily', f'screen_results_{end_date}.json')
         with open(json_path, 'w') as outfile:
             json.dump(formated_results, outfile)
-    else:
+    elif append_csv:
         output_path = os.path.join(os.path.dirname(DIR), 'screen_results', f'screen_results.csv')
         header = not os.path.exists(output_path)
         df.to_csv(output_path, mode='a', index=False, header=header)
 
     print(df)
     print("\n")
+    return df
 
 
 def main(PRICE_DATA, filtered_price_date=None, end_date=None, new_csv=False):
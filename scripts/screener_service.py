@@ -0,0 +1,324 @@
+"""Resident screener: the price data loaded once and queried over HTTP.
+
+Every entry point pays for ``load_data`` again; the service opens the price
+store once, keeps it and answers queries with the existing functions:
+
+    GET  /status                                   tickers, shards, when the data was loaded
+    GET  /rank?date=2025-06-02&top=50              rankings as of the trading day closest to the date
+    GET  /screen?date=2025-06-02                   screen of that day, on the cached fundamentals
+    GET  /history?ticker=NVDA&start=2025-01-01&end=2025-06-30
+    POST /backtest {"signals": [{"Ticker": "NVDA", "Date": "2025-06-02"}], "stop_loss": 9, "stop_gain": 0}
+
+A watcher thread checks the JSON shards and the price store's index files of
+``data_persist`` every ``--poll`` seconds. When one changes, the store is
+opened again and swapped in, and queries already running finish on the data
+they started with. Queries only read: a ranking the RS store does not hold is
+computed without being stored, and screens use the cached fundamentals
+without going to the network or appending to screen_results.csv. Rankings,
+screens and back-tests run one at a time on a single worker thread, since the
+RS store's SQLite connection is not shared across threads. History reads run
+on the request threads.
+
+    python -m scripts.screener_service --port 8780
+    python -m scripts.screener_service --socket /tmp/screener.sock
+    curl --unix-socket /tmp/screener.sock 'http://localhost/rank?date=2025-06-02&top=20'
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from scripts import back_tester
+from scripts import fundamentals
+from scripts import metrics
+from scripts import price_store
+from scripts import rs_ranking
+from scripts import screen_stocks
+from scripts import trading_calendar
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_PORT = 8780
+POLL_SECONDS = 30
+
+
+class QueryError(Exception):
+    """A query the service cannot answer, with the HTTP status to answer it with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def data_signature(directory=price_store.DATA_DIR, store_directory=price_store.STORE_DIR):
+    """Modification times of the files a reload would read, compared between two polls."""
+    paths = glob.glob(os.path.join(directory, f'*{price_store.JSON_SUFFIX}')) + \
+        glob.glob(os.path.join(store_directory, '*', price_store.INDEX_FILE))
+    signature = {}
+    for path in paths:
+        try:
+            signature[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return signature
+
+
+def stale_shards(directory=price_store.STORE_DIR):
+    """Shards whose JSON file was written after their columnar shard."""
+    names = []
+    for name in price_store.json_shard_names():
+        index_path = os.path.join(directory, name, price_store.INDEX_FILE)
+        if os.path.exists(index_path) and \
+                os.path.getmtime(price_store.json_shard_path(name)) > os.path.getmtime(index_path):
+            names.append(name)
+    return names
+
+
+def records(df):
+    """Rows of a frame as JSON-ready dicts, NaN as None."""
+    return json.loads(df.to_json(orient="records"))
+
+
+class ResidentData:
+    """The loaded price data and its trading calendar, replaced as a whole when the files change."""
+
+    def __init__(self, poll=POLL_SECONDS):
+        self.poll = poll
+        self._lock = threading.Lock()
+        self.reloads = 0
+        # Rankings, screens and back-tests share the RS store connection
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.load()
+
+    def load(self):
+        stale = stale_shards()
+        if stale:
+            price_store.build_from_json(stale)
+        signature = data_signature()
+        PRICE_DATA = rs_ranking.load_data()
+        calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA)
+        # Screens read the fundamentals the screening jobs cached, pick up what they added
+        self.run(fundamentals.CACHE.reload)
+        with self._lock:
+            self.PRICE_DATA = PRICE_DATA
+            self.calendar = calendar
+            self.signature = signature
+            self.loaded = datetime.datetime.now()
+
+    def snapshot(self):
+        with self._lock:
+            return self.PRICE_DATA, self.calendar
+
+    def reload_if_changed(self):
+        if data_signature() == self.signature:
+            return False
+        print("Price data changed, reloading")
+        with metrics.span("service_reload"):
+            self.load()
+        self.reloads += 1
+        return True
+
+    def watch(self):
+        """Reloads in the background whenever the files change, until the process exits."""
+        def loop():
+            while True:
+                time.sleep(self.poll)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"Reload failed, keeping the loaded data: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def run(self, fn, *args):
+        return self.worker.submit(fn, *args).result()
+
+    def as_of(self, date):
+        """The price data as of the trading day closest to ``date`` and that day."""
+        PRICE_DATA, calendar = self.snapshot()
+        try:
+            timestamp = calendar.closest_to_date(date)
+        except ValueError:
+            raise QueryError(f"Not a date: {date}")
+        view = rs_ranking.filter_price_data_by_index(PRICE_DATA, timestamp)
+        return PRICE_DATA, view, trading_calendar.timestamp_to_date(timestamp)
+
+    def status(self, params):
+        PRICE_DATA, calendar = self.snapshot()
+        shards = getattr(PRICE_DATA, "shards", None)
+        return {
+            "tickers": len(PRICE_DATA),
+            "shards": len(shards) if shards is not None else None,
+            "first_date": trading_calendar.timestamp_to_date(calendar.timestamps[0]),
+            "last_date": trading_calendar.timestamp_to_date(calendar.timestamps[-1]),
+            "loaded": self.loaded.isoformat(timespec="seconds"),
+            "reloads": self.reloads,
+        }
+
+    def rank(self, params):
+        _, view, end_date = self.as_of(required(params, "date"))
+        df = self.run(partial(rs_ranking.rankings, view, end_date, persist=False))[0]
+        if "min_percentile" in params:
+            df = df[df[rs_ranking.TITLE_PERCENTILE] >= float(params["min_percentile"])]
+        if "top" in params:
+            df = df.head(int(params["top"]))
+        return {"date": end_date, "ranking": records(df)}
+
+    def screen(self, params):
+        PRICE_DATA, view, end_date = self.as_of(required(params, "date"))
+
+        def screen_day():
+            ranking = rs_ranking.rankings(view, end_date, persist=False)[0]
+            return screen_stocks.screen(PRICE_DATA, view, end_date, append_csv=False, ranking=ranking, fetch=False)
+        return {"date": end_date, "results": records(self.run(screen_day))}
+
+    def history(self, params):
+        ticker = required(params, "ticker")
+        PRICE_DATA, _ = self.snapshot()
+        if ticker not in PRICE_DATA:
+            raise QueryError(f"Unknown ticker {ticker}", 404)
+        prices = PRICE_DATA[ticker]
+        datetimes = price_store.column(prices, "datetime")
+        start = 0
+        stop = len(datetimes)
+        if "start" in params:
+            start = int(np.searchsorted(datetimes, trading_calendar.date_to_timestamp(params["start"]), side="left"))
+        if "end" in params:
+            stop = int(np.searchsorted(datetimes, trading_calendar.date_to_timestamp(params["end"]), side="right"))
+        columns = {field: price_store.column(prices, field)[start:stop].tolist() for field in price_store.FIELDS}
+        candles = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        return {"ticker": ticker, "candles": candles}
+
+    def backtest(self, params):
+        signals = params.get("signals")
+        if not signals:
+            raise QueryError("No signals to back-test")
+        rows = [dict(signal) for signal in signals]
+        for row in rows:
+            if "Ticker" not in row or "Date" not in row:
+                raise QueryError("Every signal needs a Ticker and a Date")
+        stop_loss = float(params.get("stop_loss", 9.0))
+        stop_gain = float(params.get("stop_gain", 0.0))
+        PRICE_DATA, _ = self.snapshot()
+        rows, profits, holding_days = self.run(back_tester.simulate_trades, PRICE_DATA, rows, stop_loss, stop_gain)
+        result = {"trades": rows}
+        if profits:
+            average_profit, average_holding_days, annualized = back_tester.annualized_return(profits, holding_days)
+            result.update({"average_profit": average_profit, "average_holding_days": average_holding_days,
+                           "annualized_return": annualized})
+        return result
+
+
+def required(params, name):
+    if not params.get(name):
+        raise QueryError(f"Missing parameter {name}")
+    return params[name]
+
+
+ROUTES = {
+    ("GET", "/status"): ResidentData.status,
+    ("GET", "/rank"): ResidentData.rank,
+    ("GET", "/screen"): ResidentData.screen,
+    ("GET", "/history"): ResidentData.history,
+    ("POST", "/backtest"): ResidentData.backtest,
+}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    data = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        parts = urlsplit(self.path)
+        route = ROUTES.get((method, parts.path))
+        if route is None:
+            self._send(404, {"error": f"No route {method} {parts.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            if method == "POST":
+                length = int(self.headers.get("Content-Length") or 0)
+                params = json.loads(self.rfile.read(length) or b'{}')
+            else:
+                params = dict(parse_qsl(parts.query))
+            with metrics.span(f"service{parts.path.replace('/', '_')}"):
+                body = route(self.data, params)
+        except QueryError as e:
+            self._send(e.status, {"error": str(e)})
+            return
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        body["seconds"] = time.perf_counter() - start
+        self._send(200, body)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(data, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    """Returns the server, not started yet: ``serve_forever`` it."""
+    handler = type("Handler", (ServiceHandler,), {"data": data})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the price data in memory and answer screening queries")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between checks for new data")
+    args = parser.parse_args()
+
+    data = ResidentData(args.poll)
+    data.watch()
+    server = serve(data, args.host, args.port, args.socket)
+    print(f"Serving {len(data.PRICE_DATA)} tickers on "
+          + (args.socket if args.socket else f"http://{args.host}:{args.port}"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        metrics.report("screener_service")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+import heapq
 import os
 import datetime
 import sys
@@ -5,10 +7,20 @@ from dateutil.relativedelta import relativedelta
 import yfinance as yf
 import csv
 import time
+import numpy as np
 import pandas as pd
 import json
 
+from scripts import price_store
+from scripts import rs_ranking
+from scripts import trading_calendar
+
 DIR = os.path.dirname(os.path.realpath(__file__))
+TRADES_FILE = os.path.join(os.path.dirname(DIR), 'screen_results', 'screen_results copy.csv')
+# split_cash: each day's signals share the cash left, equal_weight: every position gets the same share of equity
+SIZING_RULES = ("split_cash", "equal_weight")
+# Slack on the cash check: splitting the cash in equal budgets can leave the last one a rounding error above it
+CASH_TOLERANCE = 1e-9
 
 
 def simulate():
@@ -28,34 +40,32 @@ def simulate():
     current_cash = initial_cash
     current_holding = 0
     current_nb_holding = 0
-    holdings = {}
+    # (sell date, order bought, holding), popped once the sell date has passed
+    holdings = []
     zero_budget_counter = 0
     trading_counter = 0
 
     for current_date, rows in dates.items():
         # sell
-        for sell_date in list(holdings.keys()):
-            if current_date > sell_date:
-                list_to_sell = holdings.get(sell_date)
-                for holding in list_to_sell:
-                    current_nb_holding -= 1
-                    money_out = holding["money_out"]
-                    money_in = holding["money_in"]
-                    profit_percentage = holding["profit_percentage"]
-                    current_cash += money_in
-                    current_holding -= money_out
-                    timeline.append({
-                        "Date": current_date,
-                        "Action": "Sell",
-                        "Ticker": holding["ticker"],
-                        "Profit": f"{profit_percentage}%",
-                        "Cash": f"{current_cash:.2f}",
-                        "Cash Change": f"+{money_in:.2f}",
-                        "Holding": f"{current_holding:.2f} ({current_nb_holding})",
-                        "Holding Change": f"-{money_in:.2f}",
-                        "Total": f"{current_cash + current_holding:.2f}"
-                    })
-                holdings.pop(sell_date)
+        while holdings and current_date > holdings[0][0]:
+            _, _, holding = heapq.heappop(holdings)
+            current_nb_holding -= 1
+            money_out = holding["money_out"]
+            money_in = holding["money_in"]
+            profit_percentage = holding["profit_percentage"]
+            current_cash += money_in
+            current_holding -= money_out
+            timeline.append({
+                "Date": current_date,
+                "Action": "Sell",
+                "Ticker": holding["ticker"],
+                "Profit": f"{profit_percentage}%",
+                "Cash": f"{current_cash:.2f}",
+                "Cash Change": f"+{money_in:.2f}",
+                "Holding": f"{current_holding:.2f} ({current_nb_holding})",
+                "Holding Change": f"-{money_in:.2f}",
+                "Total": f"{current_cash + current_holding:.2f}"
+            })
 
         # buy attempt
         # money_out = current_cash / 1 / len(rows)
@@ -89,10 +99,11 @@ def simulate():
             profit_percentage = float(row["Profit"].replace("%", ""))
             money_in = money_out * (1 + profit_percentage / 100)
             sell_date = row.get("Sell Date")
-            holdings.setdefault(sell_date, []).append({"ticker": ticker,
-                                                       "money_out": money_out,
-                                                       "money_in": money_in,
-                                                       "profit_percentage": profit_percentage})
+            heapq.heappush(holdings, (sell_date, len(timeline),
+                                      {"ticker": ticker,
+                                       "money_out": money_out,
+                                       "money_in": money_in,
+                                       "profit_percentage": profit_percentage}))
             timeline.append({
                 "Date": current_date,
                 "Action": "Buy",
@@ -106,27 +117,25 @@ def simulate():
             })
 
     # Add remaining holdings to cash
-    for sell_date in list(holdings.keys()):
-            list_to_sell = holdings.get(sell_date)
-            for holding in list_to_sell:
-                current_nb_holding -= 1
-                money_out = holding["money_out"]
-                money_in = holding["money_in"]
-                profit_percentage = holding["profit_percentage"]
-                current_cash += money_in
-                current_holding -= money_out
-                timeline.append({
-                    "Date": "End",
-                    "Action": "Sell",
-                    "Ticker": holding["ticker"],
-                    "Profit": f"{profit_percentage}%",
-                    "Cash": f"{current_cash:.2f}",
-                    "Cash Change": f"+{money_in:.2f}",
-                    "Holding": f"{current_holding:.2f} ({current_nb_holding})",
-                    "Holding Change": f"-{money_in:.2f}",
-                    "Total": f"{current_cash + current_holding:.2f}"
-                })
-            holdings.pop(sell_date)
+    while holdings:
+        _, _, holding = heapq.heappop(holdings)
+        current_nb_holding -= 1
+        money_out = holding["money_out"]
+        money_in = holding["money_in"]
+        profit_percentage = holding["profit_percentage"]
+        current_cash += money_in
+        current_holding -= money_out
+        timeline.append({
+            "Date": "End",
+            "Action": "Sell",
+            "Ticker": holding["ticker"],
+            "Profit": f"{profit_percentage}%",
+            "Cash": f"{current_cash:.2f}",
+            "Cash Change": f"+{money_in:.2f}",
+            "Holding": f"{current_holding:.2f} ({current_nb_holding})",
+            "Holding Change": f"-{money_in:.2f}",
+            "Total": f"{current_cash + current_holding:.2f}"
+        })
     percentage = (current_cash - initial_cash) / initial_cash * 100
     print(f"{percentage:.2f}%, {zero_budget_counter} zero budget days / {trading_counter} trading days")
 
@@ -140,8 +149,177 @@ def simulate():
             writer.writerow(row)
 
 
+def load_trades(file_path=TRADES_FILE):
+    """Back-tested trades with a buy date, in file order, as a DataFrame of Ticker / Date / Sell Date."""
+    trades = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    trades = trades[(trades["Ticker"] != "AVERAGE") & (trades["Date"] != "")]
+    return trades[["Ticker", "Date", "Sell Date"]].reset_index(drop=True)
+
+
+def aligned_closes(PRICE_DATA, tickers, timestamps):
+    """(tickers x days) closes on the calendar days, carrying the last known close over gaps and NaN candles."""
+    closes = np.full((len(tickers), len(timestamps)), np.nan)
+    for row, ticker in enumerate(tickers):
+        datetimes = price_store.column(PRICE_DATA[ticker], "datetime")
+        ticker_closes = price_store.column(PRICE_DATA[ticker], "close")
+        if len(ticker_closes) == 0:
+            continue
+        last_valid = np.maximum.accumulate(np.where(np.isnan(ticker_closes), -1, np.arange(len(ticker_closes))))
+        candle = np.searchsorted(datetimes, timestamps, side="right") - 1
+        source = np.where(candle >= 0, last_valid[np.maximum(candle, 0)], -1)
+        known = source >= 0
+        closes[row, known] = ticker_closes[source[known]]
+    return closes
+
+
+def simulate_portfolio(PRICE_DATA, trades, initial_cash=100, sizing="split_cash", max_positions=None,
+                       cash_fraction=1.0):
+    """Replays ``trades`` day by day on the trading calendar, marking open positions to market every day.
+
+    A trade is bought at the close of the first trading day on or after its Date, and sold at the close of its
+    Sell Date (the last day when it has none), its cash being available from the next day like ``simulate``. Exits
+    wait in a heap ordered by day, so a day only touches the positions that actually leave.
+
+    ``sizing`` is "split_cash" (the day's signals share ``cash_fraction`` of the cash left, like ``simulate``) or
+    "equal_weight" (every position gets ``cash_fraction`` of the equity divided by ``max_positions``, or by the
+    day's signal count without a cap). No position is opened while ``max_positions`` are open.
+
+    Returns the daily equity curve, the list of executed actions and a summary dict.
+    """
+    if sizing not in SIZING_RULES:
+        raise ValueError(f"Unknown sizing rule {sizing}, expected one of {SIZING_RULES}")
+    calendar = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA)
+    timestamps = calendar.timestamps
+    trades = trades[[ticker in PRICE_DATA for ticker in trades["Ticker"]]].reset_index(drop=True)
+
+    def day_index(dates):
+        # Dates resolve to the market close stamp of rs_data, the first candle on or after them whatever the time zone
+        days = [trading_calendar.date_to_timestamp(date) if date else timestamps[-1] for date in dates]
+        return np.searchsorted(timestamps, np.asarray(days, dtype=np.int64), side="left")
+
+    entry_days = day_index(trades["Date"])
+    exit_days = np.minimum(np.maximum(day_index(trades["Sell Date"]), entry_days), len(timestamps) - 1)
+    tradable = entry_days < len(timestamps)
+    trades, entry_days, exit_days = trades[tradable].reset_index(drop=True), entry_days[tradable], exit_days[tradable]
+    if len(trades) == 0:
+        return pd.DataFrame(), [], {}
+
+    first_day, last_day = int(entry_days.min()), int(exit_days.max())
+    tickers = sorted(set(trades["Ticker"]))
+    ticker_rows = {ticker: row for row, ticker in enumerate(tickers)}
+    # (days x tickers) so a day's prices are one contiguous row
+    closes = aligned_closes(PRICE_DATA, tickers, timestamps[first_day:last_day + 1]).T.copy()
+    # Positions are only ever held while their ticker has a price, 0 keeps the daily dot product free of NaN
+    marks = np.nan_to_num(closes)
+    trade_rows = np.array([ticker_rows[ticker] for ticker in trades["Ticker"]])
+
+    order = np.argsort(entry_days, kind="stable")
+    day_starts = np.searchsorted(entry_days[order], np.arange(first_day, last_day + 2), side="left")
+
+    cash = float(initial_cash)
+    held = np.zeros(len(tickers))
+    exits = []
+    actions = []
+    bought = sold = 0.0
+    skipped = 0
+    curve = np.zeros((last_day - first_day + 1, 3))
+
+    def sell(exit_day, trade, shares, cost):
+        nonlocal cash, sold
+        row = trade_rows[trade]
+        proceeds = shares * marks[exit_day - first_day, row]
+        cash += proceeds
+        held[row] -= shares
+        sold += proceeds
+        actions.append((int(timestamps[exit_day]), "Sell", tickers[row], proceeds, (proceeds - cost) / cost * 100,
+                        cash))
+
+    for day in range(first_day, last_day + 1):
+        column = day - first_day
+        # Positions whose sell day has passed, their cash is available today
+        while exits and exits[0][0] < day:
+            sell(*heapq.heappop(exits))
+
+        todays = order[day_starts[column]:day_starts[column + 1]]
+        if len(todays):
+            equity = cash + held @ marks[column]
+            if sizing == "equal_weight":
+                budget = equity * cash_fraction / (max_positions or len(todays))
+            else:
+                budget = cash * cash_fraction / len(todays)
+            for trade in todays:
+                price = closes[column, trade_rows[trade]]
+                if (max_positions and len(exits) >= max_positions) or np.isnan(price) or price <= 0 \
+                        or budget < 1 or budget > cash + CASH_TOLERANCE:
+                    skipped += 1
+                    continue
+                spent = min(budget, cash)
+                shares = spent / price
+                cash -= spent
+                held[trade_rows[trade]] += shares
+                bought += spent
+                heapq.heappush(exits, (int(exit_days[trade]), int(trade), shares, spent))
+                actions.append((int(timestamps[day]), "Buy", tickers[trade_rows[trade]], spent, None, cash))
+
+        curve[column] = (cash, held @ marks[column], len(exits))
+
+    # Whatever is left was sold on its own sell day, the last day of the curve at the latest
+    while exits:
+        sell(*heapq.heappop(exits))
+
+    equity_curve = pd.DataFrame({
+        "Date": [trading_calendar.timestamp_to_date(ts) for ts in timestamps[first_day:last_day + 1]],
+        "Cash": curve[:, 0],
+        "Holding": curve[:, 1],
+        "Total": curve[:, 0] + curve[:, 1],
+        "Positions": curve[:, 2].astype(int),
+    })
+    equity_curve["Drawdown"] = equity_curve["Total"] / equity_curve["Total"].cummax() - 1
+
+    total = equity_curve["Total"].to_numpy()
+    years = max((timestamps[last_day] - timestamps[first_day]) / (365.25 * 86400), 1 / 365.25)
+    summary = {
+        "final_equity": float(cash),
+        "total_return": float(cash / initial_cash - 1) * 100,
+        "annualized_return": float((cash / initial_cash) ** (1 / years) - 1) * 100 if cash > 0 else -100.0,
+        # Drawdowns are never positive, a flat curve would otherwise report -0.0
+        "max_drawdown": max(0.0, float(-equity_curve["Drawdown"].min()) * 100),
+        "exposure": float(np.mean(np.divide(curve[:, 1], total, out=np.zeros_like(total), where=total > 0))) * 100,
+        # Traded value per year, in multiples of the average equity
+        "turnover": float((bought + sold) / 2 / total.mean() / years) if total.mean() > 0 else 0.0,
+        "trades": len(trades) - skipped,
+        "skipped": skipped,
+    }
+    return equity_curve, actions, summary
+
+
 def main():
-    simulate()
+    parser = argparse.ArgumentParser(description="Simulate a portfolio trading the back-tested screen results.")
+    parser.add_argument("--legacy", action="store_true",
+                        help="book the profits of the CSV at the sell dates instead of marking to market")
+    parser.add_argument("--sizing", choices=SIZING_RULES, default="split_cash")
+    parser.add_argument("--max-positions", type=int, default=None)
+    parser.add_argument("--cash-fraction", type=float, default=1.0)
+    parser.add_argument("--initial-cash", type=float, default=100)
+    args = parser.parse_args()
+
+    if args.legacy:
+        simulate()
+        return
+
+    PRICE_DATA = rs_ranking.load_data(lazy=True)
+    equity_curve, actions, summary = simulate_portfolio(PRICE_DATA, load_trades(), args.initial_cash, args.sizing,
+                                                        args.max_positions, args.cash_fraction)
+    for key, value in summary.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+
+    output_dir = os.path.join(os.path.dirname(DIR), 'screen_results')
+    equity_curve.to_csv(os.path.join(output_dir, 'screen_results_equity.csv'), index=False)
+    pd.DataFrame([(trading_calendar.timestamp_to_date(ts), action, ticker, f"{amount:.2f}",
+                   "" if profit is None else f"{profit:.2f}%", f"{cash:.2f}")
+                  for ts, action, ticker, amount, profit, cash in actions],
+                 columns=["Date", "Action", "Ticker", "Amount", "Profit", "Cash"]) \
+        .to_csv(os.path.join(output_dir, 'screen_results_portfolio.csv'), index=False)
 
 
 if __name__ == "__main__":
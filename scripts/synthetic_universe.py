@@ -0,0 +1,140 @@
+"""Deterministic synthetic price universe for benchmarks.
+
+Every ticker gets a geometric random walk with its own drift and volatility
+over the weekdays before ``END_DATE``. Some tickers list late, some are
+delisted before the end, and every ticker misses a share of its candles.
+The shards are written like ``rs_data`` writes them, as hash shards of
+``*_price_history.json.gz`` with SPY and ^VIX in every shard, so the rest of
+the pipeline reads the universe like live data. The same arguments always
+give the same files.
+
+    python -m scripts.synthetic_universe OUTPUT_DIR --tickers 2000 --days 1500
+"""
+import argparse
+import datetime
+import string
+import zlib
+
+import numpy as np
+
+from scripts import price_store
+
+END_DATE = "2024-12-31"
+# Share of the universe that lists after the first day
+LATE_LISTING_RATE = 0.1
+# Symbols pandas reads back as missing values
+NA_SYMBOLS = {"NA", "NAN", "NULL", "NONE"}
+
+
+def trading_days(days, end_date=END_DATE):
+    """The ``days`` last weekdays up to ``end_date``, as market close timestamps stamped like rs_data, 16:00 UTC."""
+    day = datetime.datetime.strptime(end_date, "%Y-%m-%d").replace(hour=16, tzinfo=datetime.timezone.utc)
+    timestamps = []
+    while len(timestamps) < days:
+        if day.weekday() < 5:
+            timestamps.append(int(day.timestamp()))
+        day -= datetime.timedelta(days=1)
+    return np.array(timestamps[::-1], dtype=np.int64)
+
+
+def ticker_symbols(count, seed=0):
+    """``count`` distinct, made-up ticker symbols of one to four letters."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_uppercase))
+    symbols = {}
+    while len(symbols) < count:
+        symbol = "".join(rng.choice(letters, int(rng.integers(1, 5))))
+        if symbol not in price_store.SHARED_TICKERS and symbol not in NA_SYMBOLS:
+            symbols[symbol] = True
+    return list(symbols)
+
+
+def _rng(seed, ticker):
+    # Each ticker draws from its own stream so its history does not depend on the rest of the universe
+    return np.random.default_rng([seed, zlib.crc32(ticker.encode('utf-8'))])
+
+
+def _candles(timestamps, closes, volumes, rng):
+    spread = np.abs(rng.normal(0, 0.01, len(closes)))
+    opens = closes * (1 + rng.normal(0, 0.005, len(closes)))
+    return [{"open": round(float(opens[i]), 4), "close": round(float(closes[i]), 4),
+             "low": round(float(min(opens[i], closes[i]) * (1 - spread[i])), 4),
+             "high": round(float(max(opens[i], closes[i]) * (1 + spread[i])), 4),
+             "volume": float(volumes[i]), "datetime": int(timestamps[i])}
+            for i in range(len(closes))]
+
+
+def price_history(ticker, timestamps, gap_rate=0.01, delist_rate=0.05, seed=0):
+    """``{"candles": [...]}`` of one synthetic ticker over ``timestamps``."""
+    rng = _rng(seed, ticker)
+    days = len(timestamps)
+    first = int(rng.integers(0, days * 3 // 4)) if rng.random() < LATE_LISTING_RATE else 0
+    last = int(rng.integers(first + 1, days)) if rng.random() < delist_rate else days
+
+    drift = rng.normal(0.0003, 0.001)
+    volatility = rng.uniform(0.01, 0.04)
+    returns = rng.normal(drift, volatility, last - first)
+    closes = rng.uniform(5, 200) * np.exp(np.cumsum(returns))
+    volumes = np.round(rng.lognormal(rng.uniform(10, 15), 0.5, last - first))
+    keep = rng.random(last - first) >= gap_rate
+    keep[-1] = True
+    return {"candles": _candles(timestamps[first:last][keep], closes[keep], volumes[keep], rng)}
+
+
+def reference_histories(timestamps, seed=0):
+    """Complete SPY and ^VIX histories, ^VIX mean-reverting around 18."""
+    rng = _rng(seed, "SPY")
+    spy = 300 * np.exp(np.cumsum(rng.normal(0.0004, 0.01, len(timestamps))))
+    vix = np.empty(len(timestamps))
+    vix[0] = 18
+    shocks = rng.normal(0, 1.5, len(timestamps))
+    for i in range(1, len(timestamps)):
+        vix[i] = max(9.0, vix[i - 1] + 0.1 * (18 - vix[i - 1]) + shocks[i])
+    volumes = np.round(rng.lognormal(18, 0.3, len(timestamps)))
+    return {"SPY": {"candles": _candles(timestamps, spy, volumes, rng)},
+            "^VIX": {"candles": _candles(timestamps, vix, np.zeros(len(timestamps)), rng)}}
+
+
+def fundamentals(ticker, seed=0):
+    """Made-up fundamentals of ``ticker`` with the fields of ``fundamentals.FIELD_TTLS``."""
+    rng = _rng(seed + 1, ticker)
+    return {
+        "market_cap": int(10 ** rng.uniform(8, 12)),
+        "beta": round(float(rng.uniform(0.3, 2.0)), 2),
+        "exchange": str(rng.choice(["NMS", "NYQ", "ASE"])),
+        "currency": "USD",
+        "summary": f"{ticker} is a synthetic company.",
+        "next_earning": None,
+    }
+
+
+def generate(directory, tickers=2000, days=1500, gap_rate=0.01, delist_rate=0.05, seed=0,
+             shard_count=price_store.SHARD_COUNT, end_date=END_DATE):
+    """Writes the universe as ``shard_count`` JSON shards in ``directory`` and returns its tickers."""
+    timestamps = trading_days(days, end_date)
+    symbols = ticker_symbols(tickers, seed)
+    shared = reference_histories(timestamps, seed)
+    for index in range(shard_count):
+        tickers_dict = {ticker: price_history(ticker, timestamps, gap_rate, delist_rate, seed)
+                        for ticker in price_store.shard_tickers(symbols, index, shard_count)}
+        tickers_dict.update(shared)
+        price_store.write_json_shard(price_store.shard_name(index), tickers_dict, directory)
+    print(f"Wrote {len(symbols)} synthetic tickers over {days} days to {shard_count} shards in {directory}")
+    return symbols
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic price universe as JSON price history shards")
+    parser.add_argument("directory")
+    parser.add_argument("--tickers", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1500)
+    parser.add_argument("--gap-rate", type=float, default=0.01, help="share of candles missing from each ticker")
+    parser.add_argument("--delist-rate", type=float, default=0.05, help="share of tickers delisted before the end")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=price_store.SHARD_COUNT)
+    args = parser.parse_args()
+    generate(args.directory, args.tickers, args.days, args.gap_rate, args.delist_rate, args.seed, args.shards)
+
+
+if __name__ == "__main__":
+    main()
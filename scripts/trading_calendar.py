@@ -0,0 +1,95 @@
+"""Trading calendar shared by every date-driven loop.
+
+Built once from the reference ticker's candles (SPY by default), it answers
+"closest / previous / next trading day" with binary searches instead of
+scanning candles, and converts between dates, timestamps and day indices.
+"""
+import datetime
+
+import numpy as np
+
+from scripts import price_store
+from scripts.rs_data import cfg
+
+REFERENCE_TICKER = cfg("REFERENCE_TICKER") or "SPY"
+
+
+def date_to_timestamp(date_str):
+    """Timestamp of ``date_str`` at market close, the way rs_data stamps candles: 16:00 UTC, whatever the local
+    time zone."""
+    day = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+    return int(day.replace(hour=16, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def timestamp_to_date(timestamp):
+    return datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class TradingCalendar:
+    def __init__(self, timestamps):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    @classmethod
+    def from_price_data(cls, PRICE_DATA, reference=REFERENCE_TICKER):
+        return cls(price_store.column(PRICE_DATA[reference], "datetime"))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def index_of(self, timestamp):
+        """Day index of a trading-day timestamp, -1 when it is not one."""
+        i = int(np.searchsorted(self.timestamps, timestamp, side="left"))
+        if i < len(self.timestamps) and self.timestamps[i] == timestamp:
+            return i
+        return -1
+
+    def timestamp_at(self, index):
+        return int(self.timestamps[index])
+
+    def closest_index(self, timestamp):
+        """Index of the trading day nearest to ``timestamp``, the earlier one on ties."""
+        if len(self.timestamps) == 0:
+            return -1
+        i = int(np.searchsorted(self.timestamps, timestamp, side="left"))
+        if i == 0:
+            return 0
+        if i == len(self.timestamps):
+            return i - 1
+        if timestamp - self.timestamps[i - 1] <= self.timestamps[i] - timestamp:
+            return i - 1
+        return i
+
+    def closest(self, timestamp):
+        i = self.closest_index(timestamp)
+        return None if i < 0 else int(self.timestamps[i])
+
+    def previous(self, timestamp):
+        """Last trading day at or before ``timestamp``."""
+        i = int(np.searchsorted(self.timestamps, timestamp, side="right")) - 1
+        return None if i < 0 else int(self.timestamps[i])
+
+    def next(self, timestamp):
+        """First trading day at or after ``timestamp``."""
+        i = int(np.searchsorted(self.timestamps, timestamp, side="left"))
+        return None if i >= len(self.timestamps) else int(self.timestamps[i])
+
+    def closest_to_date(self, date_str):
+        return self.closest(date_to_timestamp(date_str))
+
+    def between(self, start_timestamp, end_timestamp):
+        """Trading-day timestamps in ``[start_timestamp, end_timestamp]``."""
+        lo = np.searchsorted(self.timestamps, start_timestamp, side="left")
+        hi = np.searchsorted(self.timestamps, end_timestamp, side="right")
+        return [int(ts) for ts in self.timestamps[lo:hi]]
+
+    def days_between_dates(self, start_date, end_date):
+        """Every distinct trading day the closest-day walk from ``start_date`` to ``end_date`` visits."""
+        start = self.closest_to_date(start_date)
+        end = self.closest_to_date(end_date)
+        if start is None or end is None:
+            return []
+        return self.between(start, end)
+
+    def ticker_offsets(self, datetimes):
+        """For every trading day, the index of the first candle of a ticker at or after it."""
+        return np.searchsorted(datetimes, self.timestamps, side="left")
@@ -0,0 +1,110 @@
+"""Walk-forward historical screening on a process pool.
+
+Splits the trading days between two dates into contiguous chunks and screens
+each chunk in its own process. On platforms that fork, workers inherit the
+opened price store (memory-mapped, so its pages are shared) and the RS matrix
+copy-on-write instead of loading them again. The per-day results are merged in
+date order into one CSV, the same file the serial back_tester walk appends to.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+
+import pandas as pd
+
+from scripts import fundamentals
+from scripts import rs_matrix
+from scripts import rs_ranking
+from scripts import screen_stocks
+from scripts import trading_calendar
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+OUTPUT_FILE = os.path.join(os.path.dirname(DIR), 'screen_results', 'screen_results.csv')
+# Chunks per worker, a few so a worker stuck on a busy stretch of dates doesn't hold up the whole run
+CHUNKS_PER_WORKER = 4
+
+# Price data, RS matrix and calendar of the run, set in the parent before forking or loaded by each worker
+_STATE = {}
+
+
+def _load_state():
+    if not _STATE:
+        PRICE_DATA = rs_ranking.load_data()
+        _STATE["price_data"] = PRICE_DATA
+        _STATE["matrix"] = rs_matrix.load_or_build(PRICE_DATA)
+        _STATE["calendar"] = trading_calendar.TradingCalendar.from_price_data(PRICE_DATA)
+    return _STATE
+
+
+def screen_day(timestamp):
+    """Ranks and screens one trading day, returning its date and the screen results."""
+    state = _load_state()
+    PRICE_DATA = state["price_data"]
+    filtered_price_date = rs_ranking.filter_price_data_by_index(PRICE_DATA, timestamp)
+    end_date = trading_calendar.timestamp_to_date(timestamp)
+    rs_ranking.rankings(filtered_price_date, end_date, state["matrix"])
+    return end_date, screen_stocks.screen(PRICE_DATA, filtered_price_date, end_date, append_csv=False)
+
+
+def _init_worker(workers):
+    # Screens fetch stale fundamentals, the workers share one request budget instead of each having it
+    fundamentals.ENGINE.split(workers)
+
+
+def screen_chunk(timestamps):
+    return [screen_day(timestamp) for timestamp in timestamps]
+
+
+def split(items, chunks):
+    """Splits ``items`` into at most ``chunks`` contiguous runs of near equal length."""
+    chunks = max(1, min(chunks, len(items)))
+    size, extra = divmod(len(items), chunks)
+    runs, start = [], 0
+    for i in range(chunks):
+        stop = start + size + (1 if i < extra else 0)
+        runs.append(items[start:stop])
+        start = stop
+    return runs
+
+
+def run(start_date, end_date, workers=None, output_path=OUTPUT_FILE):
+    """Screens every trading day from ``start_date`` to ``end_date`` and writes the merged results."""
+    workers = workers or os.cpu_count() or 1
+    state = _load_state()
+    timestamps = list(state["calendar"].days_between_dates(start_date, end_date))
+    print(f"Screening {len(timestamps)} trading days from {start_date} to {end_date} on {workers} workers")
+
+    chunks = split(timestamps, workers * CHUNKS_PER_WORKER)
+    if workers == 1:
+        results = [screen_chunk(chunk) for chunk in chunks]
+    else:
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in start_methods else None)
+        with context.Pool(workers, initializer=_init_worker, initargs=(workers,)) as pool:
+            results = pool.map(screen_chunk, chunks)
+
+    days = sorted((day for chunk in results for day in chunk), key=lambda day: day[0])
+    if not days:
+        print("No trading days in range")
+        return None
+    merged = pd.concat([df for _, df in days], ignore_index=True)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    merged.to_csv(output_path, index=False)
+    print(f"Wrote {len(merged)} rows for {len(days)} days to {output_path}")
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen every trading day of a date range in parallel.")
+    parser.add_argument("--start", default="2025-01-01", help="first date to screen, YYYY-MM-DD")
+    parser.add_argument("--end", default=datetime.date.today().strftime("%Y-%m-%d"),
+                        help="last date to screen, YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="CSV the merged results are written to")
+    args = parser.parse_args()
+    run(args.start, args.end, args.workers, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Local stand-in for the Yahoo Finance endpoints the fetchers use.
+
+Serves the cookie, crumb, chart (``/v8/finance/chart``), quoteSummary and
+``/v7/finance/quote`` requests of yfinance, either from synthetic histories
+(``synthetic_universe``, extended up to today) or, with ``--replay``, from
+responses recorded by an ``rs_data`` run with ``--transport record``. Latency,
+"Too Many Requests" answers (at random or above a request rate) and empty
+"symbol may be delisted" answers can be injected, so the fetch engine's
+concurrency, retries and backoff can be exercised offline:
+
+    python -m scripts.yahoo_stub --port 8765 --latency 0.05 --rate-limit 0.02
+    python -m scripts.rs_data 0 --transport stub --stub-url http://127.0.0.1:8765
+
+``GET /__stats`` returns how many requests were served, rate limited and
+emptied.
+"""
+import argparse
+import collections
+import datetime
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+import pandas as pd
+
+from scripts import synthetic_universe
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+CASSETTE_DIR = os.path.join(os.path.dirname(DIR), 'data_persist', 'yahoo_cassettes')
+DEFAULT_URL = "http://127.0.0.1:8765"
+CRUMB = "stub-crumb"
+# Query parameters left out of the recorded request keys: the crumb changes every session and the chart windows
+# move with the day the fetcher runs
+IGNORED_PARAMS = {"crumb", "period1", "period2"}
+EXCHANGE_TIMEZONE = "America/New_York"
+
+
+def is_yahoo(url):
+    return urlsplit(url).netloc.endswith("yahoo.com")
+
+
+def redirect(url, base_url):
+    """``url`` sent to ``base_url`` instead when it is a Yahoo URL."""
+    if not is_yahoo(url):
+        return url
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    return urlunsplit((base.scheme, base.netloc, parts.path or "/", parts.query, ""))
+
+
+def _param(value):
+    # requests sends booleans the way yfinance writes them in its URLs
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def cassette_key(method, url, params=None):
+    """Name under which the response of a request is recorded and looked up."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + list((params or {}).items())
+    query = sorted((key, _param(value)) for key, value in query if key not in IGNORED_PARAMS)
+    text = json.dumps([method.upper(), parts.path, query])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def record(directory, method, url, params, status, content_type, body):
+    """Saves one response as ``<key>.json`` in ``directory``."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{cassette_key(method, url, params)}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump({"method": method.upper(), "url": url, "params": {key: _param(value) for key, value
+                                                                    in (params or {}).items()
+                                                                    if key not in IGNORED_PARAMS},
+                   "status": status, "content_type": content_type, "body": body}, f)
+    os.replace(tmp_path, path)
+
+
+def load_cassettes(directory):
+    cassettes = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        with open(path, 'r', encoding='utf8') as f:
+            cassettes[os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+    return cassettes
+
+
+def _chart_timestamps(timestamps):
+    """Yahoo stamps daily candles at the 9:30 open in the exchange's time zone."""
+    dates = pd.to_datetime([datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).date()
+                            for ts in timestamps])
+    opens = dates.tz_localize(EXCHANGE_TIMEZONE) + pd.Timedelta(hours=9, minutes=30)
+    return [int(ts.timestamp()) for ts in opens]
+
+
+def chart_response(ticker, candles, period1=None, period2=None):
+    """Chart response of ``candles`` between the two timestamps, in Yahoo's format."""
+    timestamps = _chart_timestamps([candle["datetime"] for candle in candles])
+    rows = [(ts, candle) for ts, candle in zip(timestamps, candles)
+            if (period1 is None or ts >= period1) and (period2 is None or ts < period2)]
+    if period1 is None and period2 is None:
+        # range=... requests, such as the time zone lookup, only need the last days
+        rows = rows[-5:]
+    quote = {field: [candle[field] for _, candle in rows] for field in ("open", "high", "low", "close", "volume")}
+    last = candles[-1]["close"] if candles else None
+    meta = {
+        "currency": "USD", "symbol": ticker, "exchangeName": "NMS", "fullExchangeName": "NasdaqGS",
+        "instrumentType": "EQUITY", "firstTradeDate": timestamps[0] if timestamps else None,
+        "regularMarketTime": timestamps[-1] if timestamps else None, "hasPrePostMarketData": True,
+        "gmtoffset": -14400, "timezone": "EDT", "exchangeTimezoneName": EXCHANGE_TIMEZONE,
+        "regularMarketPrice": last, "chartPreviousClose": last, "priceHint": 2,
+        "currentTradingPeriod": {name: {"timezone": "EDT", "start": 0, "end": 0, "gmtoffset": -14400}
+                                 for name in ("pre", "regular", "post")},
+        "dataGranularity": "1d", "range": "",
+        "validRanges": ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"],
+    }
+    return {"chart": {"result": [{"meta": meta, "timestamp": [ts for ts, _ in rows],
+                                  "indicators": {"quote": [quote], "adjclose": [{"adjclose": quote["close"]}]}}],
+                      "error": None}}
+
+
+def missing_chart_response(ticker):
+    return {"chart": {"result": None, "error": {
+        "code": "Not Found", "description": f"No data found, symbol may be delisted ({ticker})"}}}
+
+
+def quote_summary_response(ticker, values):
+    return {"quoteSummary": {"result": [{
+        "assetProfile": {"longBusinessSummary": values["summary"]},
+        "summaryDetail": {"beta": values["beta"], "marketCap": values["market_cap"], "currency": values["currency"]},
+        "quoteType": {"exchange": values["exchange"], "symbol": ticker, "quoteType": "EQUITY"},
+        "defaultKeyStatistics": {},
+        "financialData": {},
+    }], "error": None}}
+
+
+def quote_response(ticker, values):
+    return {"quoteResponse": {"result": [{
+        "symbol": ticker, "marketCap": values["market_cap"], "exchange": values["exchange"],
+        "currency": values["currency"], "earningsTimestampStart": None,
+    }], "error": None}}
+
+
+def timeseries_response(ticker, types):
+    """Fundamentals time series, every requested type without a value."""
+    result = {"meta": {"symbol": [ticker], "type": types}, "timestamp": []}
+    result.update({name: [{"reportedValue": {"raw": None}}] for name in types})
+    return {"timeseries": {"result": [result], "error": None}}
+
+
+class StubState:
+    """What the stand-in serves and the faults it injects, shared by the handler threads."""
+
+    def __init__(self, days=1500, seed=0, latency=0.0, jitter=0.0, rate_limit=0.0, max_rps=None, empty=0.0,
+                 cassettes=None):
+        self.days = days
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.max_rps = max_rps
+        self.empty = empty
+        self.cassettes = cassettes
+        self.stats = collections.Counter()
+        self._histories = {}
+        self._recent = collections.deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def history(self, ticker):
+        with self._lock:
+            candles = self._histories.get(ticker)
+        if candles is None:
+            timestamps = synthetic_universe.trading_days(self.days, datetime.date.today().strftime("%Y-%m-%d"))
+            candles = synthetic_universe.price_history(ticker, timestamps, seed=self.seed, delist_rate=0)["candles"]
+            with self._lock:
+                self._histories[ticker] = candles
+        return candles
+
+    def fault(self):
+        """Decides, for one request, whether to answer "Too Many Requests" or no data."""
+        now = time.monotonic()
+        with self._lock:
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 1:
+                self._recent.popleft()
+            if self.max_rps is not None and len(self._recent) > self.max_rps:
+                return "rate_limited"
+            draw = self._random.random()
+        if draw < self.rate_limit:
+            return "rate_limited"
+        if draw < self.rate_limit + self.empty:
+            return "empty"
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                extra = self._random.uniform(0, self.jitter)
+            time.sleep(self.latency + extra)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=()):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.do_GET()
+
+    def do_GET(self):
+        state = self.state
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        types = [value for key, value in parse_qsl(parts.query) if key == "type"]
+        path = parts.path
+        if path == "/__stats":
+            self._send(200, dict(state.stats))
+            return
+
+        with state._lock:
+            state.stats["requests"] += 1
+        state.delay()
+        if path in ("", "/"):
+            # The fc.yahoo.com cookie request
+            self._send(200, "", "text/html", [("Set-Cookie", "A3=stub; Max-Age=31536000; Path=/")])
+            return
+        if path.endswith("/getcrumb"):
+            self._send(200, CRUMB, "text/plain")
+            return
+
+        fault = state.fault()
+        if fault == "rate_limited":
+            with state._lock:
+                state.stats["rate_limited"] += 1
+            self._send(429, "Too Many Requests\r\n", "text/plain")
+            return
+
+        if state.cassettes is not None:
+            cassette = state.cassettes.get(cassette_key(self.command, path, params))
+            if cassette is None:
+                with state._lock:
+                    state.stats["not_recorded"] += 1
+                self._send(404, missing_chart_response(path.rsplit("/", 1)[-1]))
+                return
+            self._send(cassette["status"], cassette["body"], cassette.get("content_type") or "application/json")
+            return
+
+        ticker = path.rsplit("/", 1)[-1]
+        if path.startswith("/v8/finance/chart/"):
+            if fault == "empty":
+                with state._lock:
+                    state.stats["empty"] += 1
+                self._send(404, missing_chart_response(ticker))
+                return
+            period1 = int(params["period1"]) if "period1" in params else None
+            period2 = int(params["period2"]) if "period2" in params else None
+            self._send(200, chart_response(ticker, state.history(ticker), period1, period2))
+        elif path.startswith("/v10/finance/quoteSummary/"):
+            self._send(200, quote_summary_response(ticker, synthetic_universe.fundamentals(ticker, state.seed)))
+        elif path.startswith("/v7/finance/quote"):
+            ticker = params.get("symbols", "")
+            self._send(200, quote_response(ticker, synthetic_universe.fundamentals(ticker, state.seed)))
+        elif path.startswith("/ws/fundamentals-timeseries/"):
+            self._send(200, timeseries_response(ticker, types))
+        else:
+            with state._lock:
+                state.stats["unknown"] += 1
+            self._send(404, {"error": f"not served by the stub: {path}"})
+
+
+def serve(host="127.0.0.1", port=8765, state=None):
+    """Returns a started server answering on its own thread; ``server.shutdown()`` stops it."""
+    handler = type("Handler", (StubHandler,), {"state": state or StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic or recorded Yahoo responses locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--days", type=int, default=1500, help="length of the synthetic histories")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--max-rps", type=float, default=None, help="answer 429 above this many requests a second")
+    parser.add_argument("--empty", type=float, default=0.0, help="share of chart requests answered with no data")
+    parser.add_argument("--replay", nargs="?", const=CASSETTE_DIR, default=None,
+                        help="serve the responses recorded in this directory instead of synthetic data")
+    args = parser.parse_args()
+
+    cassettes = load_cassettes(args.replay) if args.replay else None
+    state = StubState(args.days, args.seed, args.latency, args.jitter, args.rate_limit, args.max_rps, args.empty,
+                      cassettes)
+    server = serve(args.host, args.port, state)
+    print(f"Yahoo stub on http://{args.host}:{args.port}"
+          + (f", replaying {len(cassettes)} responses" if cassettes is not None else ""))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(dict(state.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import datetime
+import time
+
+import pandas as pd
+import pytest
+
+from scripts import rs_ranking
+from scripts import synthetic_universe
+
+DAY = 86400
+
+
+def candles(closes, start="2024-01-02", volumes=None):
+    """``{"candles": [...]}`` with one weekday candle per close, stamped at 16:00 UTC like rs_data does."""
+    day = datetime.datetime.strptime(start, "%Y-%m-%d").replace(hour=16, tzinfo=datetime.timezone.utc)
+    result = []
+    for i, close in enumerate(closes):
+        while day.weekday() >= 5:
+            day += datetime.timedelta(days=1)
+        result.append({"open": close, "close": close, "low": close, "high": close,
+                       "volume": float(volumes[i]) if volumes is not None else 1000.0,
+                       "datetime": int(day.timestamp())})
+        day += datetime.timedelta(days=1)
+    return {"candles": result}
+
+
+@pytest.fixture
+def make_candles():
+    return candles
+
+
+@pytest.fixture
+def west_of_utc(monkeypatch):
+    """Runs the test in New York time, where local 16:00 is a few hours after the candles' 16:00 UTC."""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def universe(tickers=40, days=400, seed=0):
+    """``synthetic_universe`` price data held in memory, with SPY and ^VIX."""
+    timestamps = synthetic_universe.trading_days(days)
+    PRICE_DATA = {ticker: synthetic_universe.price_history(ticker, timestamps, seed=seed)
+                  for ticker in synthetic_universe.ticker_symbols(tickers, seed)}
+    PRICE_DATA.update(synthetic_universe.reference_histories(timestamps, seed))
+    return PRICE_DATA
+
+
+def per_ticker_ranking(PRICE_DATA):
+    """The ranking ``rankings()`` computed one ticker at a time with ``relative_strength`` before it was
+    vectorized, unsorted and without the percentile cut."""
+    closes_ref = pd.Series([candle["close"] for candle in PRICE_DATA[rs_ranking.REFERENCE_TICKER]["candles"]])
+    rows = []
+    for ticker, data in PRICE_DATA.items():
+        closes = pd.Series([candle["close"] for candle in data["candles"]], dtype=float)
+        if len(closes) >= 6 * 20:
+            rs = rs_ranking.relative_strength(closes, closes_ref)
+            month = 20
+            rs1m = rs_ranking.relative_strength(closes.head(-1 * month), closes_ref.head(-1 * month))
+            rs3m = rs_ranking.relative_strength(closes.head(-3 * month), closes_ref.head(-3 * month))
+            rs6m = rs_ranking.relative_strength(closes.head(-6 * month), closes_ref.head(-6 * month))
+            if rs < 590:
+                rows.append((ticker, rs, 100, rs1m, rs3m, rs6m))
+    titles = [rs_ranking.TITLE_TICKER, rs_ranking.TITLE_RS, rs_ranking.TITLE_PERCENTILE,
+              rs_ranking.TITLE_1M, rs_ranking.TITLE_3M, rs_ranking.TITLE_6M]
+    df = pd.DataFrame(rows, columns=titles)
+    df[rs_ranking.TITLE_PERCENTILE] = pd.qcut(df[rs_ranking.TITLE_RS], 100, labels=False, duplicates="drop")
+    for title in titles[3:]:
+        df[title] = pd.qcut(df[title], 100, labels=False, duplicates="drop")
+    return df
+
+
+@pytest.fixture(scope="session")
+def price_universe():
+    """One ``universe()`` shared by the tests, which must not modify it."""
+    return universe()
+
+
+@pytest.fixture
+def old_ranking():
+    return per_ticker_ranking
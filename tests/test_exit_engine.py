@@ -0,0 +1,77 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from scripts import back_tester
+from scripts import exit_engine
+from scripts import trading_calendar
+
+
+def check_stop_loss(start_timestamp, candles_dict, stop_loss, stop_gain):
+    """The candle loop ``exit_engine`` replaced, as back_tester had it."""
+    buy_timestamp = -1
+    purchase_price = -1
+    max_close = -1
+    min_close = -1
+    sorted_timestamps = sorted(candles_dict.keys(), key=lambda ts: datetime.datetime.fromtimestamp(int(ts)))
+    for ts in sorted_timestamps:
+        current_close = candles_dict[ts]["close"]
+        ts_int = int(ts)
+        if ts_int < start_timestamp:
+            continue
+        if purchase_price == -1:
+            buy_timestamp = ts_int
+            purchase_price = current_close
+            max_close = current_close
+            min_close = current_close
+            continue
+        profit = (current_close - purchase_price) / purchase_price
+        min_close = min(min_close, current_close)
+        if profit > stop_gain / 100:
+            min_profit = (min_close - purchase_price) / purchase_price
+            return buy_timestamp, ts_int, profit, f"{stop_gain} gain, min: {min_profit * 100:.2f}%"
+        max_close = max(max_close, current_close)
+        if current_close < max_close * (1 - stop_loss / 100):
+            max_profit = (max_close - purchase_price) / purchase_price
+            return buy_timestamp, ts_int, profit, f"{stop_loss} loss, max: {max_profit * 100:.2f}%"
+    last_ts = sorted_timestamps[-1]
+    max_profit = (max_close - purchase_price) / purchase_price
+    return (buy_timestamp, int(last_ts), (candles_dict[last_ts]["close"] - purchase_price) / purchase_price,
+            f"End of data, max: {max_profit * 100:.2f}%")
+
+
+@pytest.mark.parametrize("stop_loss, stop_gain", [(9.0, 0.0), (5.0, 20.0), (15.0, 1000.0)])
+def test_simulated_trades_exit_like_check_stop_loss(price_universe, stop_loss, stop_gain):
+    rng = np.random.default_rng(0)
+    tickers = sorted(price_universe)
+    rows = []
+    for _ in range(60):
+        ticker = tickers[rng.integers(len(tickers))]
+        candles = price_universe[ticker]["candles"]
+        date = trading_calendar.timestamp_to_date(candles[int(rng.integers(len(candles)))]["datetime"])
+        rows.append({"Ticker": ticker, "Date": date})
+
+    traded, profits, holding_days = back_tester.simulate_trades(price_universe, [dict(row) for row in rows],
+                                                                stop_loss, stop_gain)
+    assert len(traded) == len(rows)
+    for row, profit in zip(traded, profits):
+        start_timestamp = int(datetime.datetime.strptime(row["Date"], "%Y-%m-%d").timestamp())
+        candles_dict = {str(candle["datetime"]): candle for candle in price_universe[row["Ticker"]]["candles"]}
+        _, sell_timestamp, expected_profit, reason = check_stop_loss(start_timestamp, candles_dict, stop_loss,
+                                                                     stop_gain)
+        assert row["Sell Date"] == datetime.datetime.fromtimestamp(sell_timestamp).strftime("%Y-%m-%d")
+        assert profit == pytest.approx(expected_profit)
+        assert row["Sell reason"] == reason
+
+
+def test_first_rule_names_the_reason_on_a_tie():
+    closes = np.array([[10.0, 9.0, 8.0], [10.0, 10.5, 11.0]])
+    paths = exit_engine.Paths(closes, np.array([3, 3]))
+    offsets, profits, reasons = exit_engine.evaluate(paths, [exit_engine.TimeStop(2), exit_engine.TrailingStop(15)])
+    assert offsets.tolist() == [2, 2]
+    assert reasons.tolist() == [0, 0]
+    offsets, profits, reasons = exit_engine.evaluate(paths, [exit_engine.TrailingStop(15)])
+    assert offsets.tolist() == [2, 2]
+    assert reasons.tolist() == [0, exit_engine.END_OF_DATA]
+    assert profits.tolist() == pytest.approx([-0.2, 0.1])
@@ -0,0 +1,51 @@
+import pytest
+
+from scripts import fetch_engine
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class HTTPError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.response = Response(status_code)
+
+
+def test_rate_limit_is_read_from_the_http_status():
+    assert fetch_engine.is_rate_limit_error(HTTPError("HTTP Error", 429))
+    assert not fetch_engine.is_rate_limit_error(HTTPError("HTTP Error 500 for /v8/finance/chart/4290.T", 500))
+    assert not fetch_engine.is_rate_limit_error(ValueError("No data for 4290.T, period 1429"))
+    assert fetch_engine.is_rate_limit_error("YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')")
+
+
+def test_split_shares_the_budget():
+    engine = fetch_engine.FetchEngine(object, max_workers=8, rate=4.0, burst=8)
+    engine.split(4)
+    assert engine.max_workers == 2
+    assert engine.bucket.rate == pytest.approx(1.0)
+    assert engine.bucket.capacity == 2
+    assert engine.limiter.max_concurrency == 2
+
+
+def test_call_retries_rate_limits_then_gives_up():
+    engine = fetch_engine.FetchEngine(object, max_workers=1, rate=1000, burst=10, max_retries=3, base_delay=0)
+    engine.limiter = fetch_engine.AdaptiveLimiter(1, cooldown=0)
+    attempts = []
+
+    def rate_limited(session):
+        attempts.append(session)
+        raise fetch_engine.RateLimited("Too Many Requests")
+    assert engine.call(rate_limited, "AAA") is None
+    assert len(attempts) == 3
+
+    answers = iter([fetch_engine.RateLimited("Too Many Requests"), "ok"])
+
+    def flaky(session):
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+    assert engine.call(flaky, "BBB") == "ok"
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pytest
+
+from scripts import forward_labels
+from scripts import trading_calendar
+
+
+def loop_label(candles, date):
+    """The per-candle loop ``screen()`` labeled every result with before forward_labels."""
+    signal_timestamp = forward_labels.signal_timestamp(date)
+    signal_price = 10000000
+    low_since_signal = signal_price
+    high_since_signal = 0
+    valid = False
+    for candle in candles:
+        if abs(candle["datetime"] - signal_timestamp) < 86400:
+            signal_price = candle["close"]
+        elif candle["datetime"] > signal_timestamp:
+            valid = True
+            if candle["close"] < low_since_signal:
+                low_since_signal = candle["close"]
+            if candle["close"] > high_since_signal:
+                high_since_signal = candle["close"]
+    gain = (candles[-1]["close"] - signal_price) / signal_price
+    if valid:
+        low_since_signal = (low_since_signal - signal_price) / signal_price
+        high_since_signal = (high_since_signal - signal_price) / signal_price
+    else:
+        low_since_signal = 0
+        high_since_signal = 0
+    return {"gain": gain, "low_since_signal": low_since_signal, "high_since_signal": high_since_signal}
+
+
+def test_labels_match_the_per_candle_loop(price_universe):
+    rng = np.random.default_rng(1)
+    tickers = sorted(price_universe)
+    signals = []
+    for _ in range(200):
+        ticker = tickers[rng.integers(len(tickers))]
+        candles = price_universe[ticker]["candles"]
+        if not candles:
+            continue
+        # Every candle of the history, plus weekends and days past the end
+        timestamp = candles[rng.integers(len(candles))]["datetime"] + int(rng.integers(-3, 4)) * forward_labels.DAY
+        signals.append((ticker, trading_calendar.timestamp_to_date(timestamp)))
+    signals.append(("MISSING", "2024-01-02"))
+
+    labels = forward_labels.label(price_universe, signals)
+
+    assert labels[-1] is None
+    for (ticker, date), ticker_label in zip(signals[:-1], labels):
+        expected = loop_label(price_universe[ticker]["candles"], date)
+        assert ticker_label == pytest.approx(expected, nan_ok=True), (ticker, date)
+
+
+def test_rebuild_daily_rewrites_only_stale_files(tmp_path, make_candles):
+    PRICE_DATA = {"AAA": make_candles([10.0, 11.0, 9.0, 12.0])}
+    dates = [trading_calendar.timestamp_to_date(candle["datetime"]) for candle in PRICE_DATA["AAA"]["candles"]]
+    current = {"AAA": dict(score=1, **forward_labels.label(PRICE_DATA, [("AAA", dates[1])])[0])}
+    (tmp_path / f"screen_results_{dates[1]}.json").write_text(json.dumps(current))
+    (tmp_path / f"screen_results_{dates[0]}.json").write_text(json.dumps({"AAA": {"score": 2, "gain": 0}}))
+
+    assert forward_labels.rebuild_daily(PRICE_DATA, str(tmp_path)) == 1
+
+    stale = json.loads((tmp_path / f"screen_results_{dates[0]}.json").read_text())
+    assert stale["AAA"] == {"score": 2, "gain": pytest.approx(0.2), "low_since_signal": pytest.approx(-0.1),
+                            "high_since_signal": pytest.approx(0.2)}
+    assert json.loads((tmp_path / f"screen_results_{dates[1]}.json").read_text()) == current
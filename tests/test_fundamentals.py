@@ -0,0 +1,99 @@
+import json
+import time
+
+import pytest
+
+from scripts import fundamentals
+
+DAY = fundamentals.DAY
+GOOD = {"market_cap": 5e9, "beta": 1.2, "exchange": "NMS", "currency": "USD", "summary": "A company.",
+        "next_earning": None}
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(fundamentals, "LEGACY_CACHE_FILE", str(tmp_path / "_market_cap_cache.json"))
+    return str(tmp_path / "_fundamentals_cache.jsonl")
+
+
+def test_fields_go_stale_after_their_ttl(cache_path):
+    cache = fundamentals.FundamentalsCache(cache_path)
+    cache.update("AAA", GOOD)
+    now = time.time()
+    assert cache.stale_fields("AAA", now) == []
+    assert cache.stale_fields("AAA", now + 2 * DAY) == ["market_cap", "next_earning"]
+    assert cache.stale_fields("AAA", now + 40 * DAY) == ["market_cap", "beta", "next_earning"]
+    assert cache.stale_fields("BBB", now) == list(fundamentals.FIELD_TTLS)
+
+
+def test_failure_keeps_the_last_good_values(cache_path):
+    cache = fundamentals.FundamentalsCache(cache_path)
+    cache.update("AAA", GOOD)
+    cache.mark_failed("AAA")
+    assert cache.get("AAA") == GOOD
+    # Fresh fields keep an expiry no later than FAILURE_TTL from now
+    now = time.time()
+    assert cache.stale_fields("AAA", now) == []
+    assert cache.stale_fields("AAA", now + fundamentals.FAILURE_TTL + 1) == list(fundamentals.FIELD_TTLS)
+    assert fundamentals.FundamentalsCache(cache_path).get("AAA") == GOOD
+
+
+def test_failure_of_a_stale_ticker_waits_before_asking_again(cache_path):
+    cache = fundamentals.FundamentalsCache(cache_path)
+    cache.update("AAA", GOOD)
+    for field in cache.entries["AAA"].values():
+        field["fetched"] -= 400 * DAY
+    cache.mark_failed("AAA")
+    now = time.time()
+    assert cache.get("AAA") == GOOD
+    assert cache.stale_fields("AAA", now) == []
+    assert cache.stale_fields("AAA", now + fundamentals.FAILURE_TTL + 1) == list(fundamentals.FIELD_TTLS)
+
+
+def test_failure_without_a_prior_value_has_no_market_cap(cache_path):
+    cache = fundamentals.FundamentalsCache(cache_path)
+    cache.mark_failed("AAA")
+    assert cache.get("AAA")["market_cap"] == 0
+    assert cache.stale_fields("AAA") == []
+
+
+def test_prefetch_marks_empty_answers_failed_and_skips_give_ups(cache_path, monkeypatch):
+    cache = fundamentals.FundamentalsCache(cache_path)
+    cache.update("GONE", GOOD)
+    for field in cache.entries["GONE"].values():
+        field["fetched"] -= 400 * DAY
+    answers = {"AAA": GOOD, "GONE": {}, "LIMITED": None}
+    monkeypatch.setattr(fundamentals.ENGINE, "map", lambda fn, items: [(item, answers[item]) for item in items])
+
+    fundamentals.prefetch(["AAA", "GONE", "LIMITED"], cache)
+
+    assert cache.get("AAA") == GOOD
+    assert cache.get("GONE") == GOOD and not cache.stale_fields("GONE")
+    assert cache.get("LIMITED") == {}
+
+
+def test_journal_keeps_appends_of_every_process(cache_path):
+    first = fundamentals.FundamentalsCache(cache_path)
+    second = fundamentals.FundamentalsCache(cache_path)
+    first.update("AAA", GOOD)
+    second.update("BBB", GOOD)
+    first.update("CCC", GOOD)
+    # Compacting the second cache must keep what the first one appended after it was loaded
+    second.compact()
+    first.update("DDD", GOOD)
+
+    with open(cache_path, encoding='utf8') as f:
+        tickers = [json.loads(line)["ticker"] for line in f]
+    assert sorted(set(tickers)) == ["AAA", "BBB", "CCC", "DDD"]
+    assert sorted(fundamentals.FundamentalsCache(cache_path).entries) == ["AAA", "BBB", "CCC", "DDD"]
+
+
+def test_compaction_writes_one_line_per_ticker(cache_path, monkeypatch):
+    monkeypatch.setattr(fundamentals, "COMPACT_RATIO", 0)
+    cache = fundamentals.FundamentalsCache(cache_path)
+    for _ in range(3):
+        cache.update("AAA", GOOD)
+        cache.update("BBB", GOOD)
+    with open(cache_path, encoding='utf8') as f:
+        assert len(f.readlines()) == 2
+    assert fundamentals.FundamentalsCache(cache_path).get("BBB") == GOOD
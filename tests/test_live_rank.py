@@ -0,0 +1,12 @@
+from scripts import live_rank
+from scripts import trading_calendar
+
+
+def test_end_of_day_leaves_out_the_stored_bar_of_the_day_west_of_utc(make_candles, west_of_utc):
+    PRICE_DATA = {"AAA": make_candles([10.0, 11.0, 12.0]), "BBB": make_candles([20.0, 21.0])}
+    today = trading_calendar.date_to_timestamp("2024-01-04")
+
+    history = live_rank.end_of_day(PRICE_DATA, today)
+
+    assert [candle["close"] for candle in history["AAA"]["candles"]] == [10.0, 11.0]
+    assert [candle["close"] for candle in history["BBB"]["candles"]] == [20.0, 21.0]
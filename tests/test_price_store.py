@@ -0,0 +1,114 @@
+import os
+
+from scripts import config
+from scripts import price_store
+
+
+def test_unreadable_json_shard_is_not_written(tmp_path, make_candles):
+    data_directory = str(tmp_path / "data")
+    store_directory = str(tmp_path / "store")
+    price_store.write_json_shard("00", {"AAA": make_candles([1.0, 2.0])}, data_directory)
+    os.makedirs(data_directory, exist_ok=True)
+    with open(price_store.json_shard_path("01", data_directory), 'wb') as f:
+        f.write(b'not gzip')
+
+    price_store.build_from_json(directory=store_directory, workers=1, data_directory=data_directory)
+
+    assert price_store.shard_names(store_directory) == ["00"]
+    assert price_store.missing_shards(directory=store_directory, data_directory=data_directory) == ["01"]
+
+
+def brute_days_since_higher(values):
+    result = []
+    for i, value in enumerate(values):
+        back = [i - j for j in range(i - 1, -1, -1) if values[j] >= value]
+        result.append(back[0] if back else 0)
+    return result
+
+
+def test_store_round_trip(tmp_path, make_candles):
+    directory = str(tmp_path)
+    tickers = {"AAA": make_candles([1.0, 2.5, 2.0]), "BBB": make_candles([7.0]), "EMPTY": {"candles": []}}
+    price_store.write_shard("00", tickers, directory, shard_count=2)
+
+    store = price_store.PriceStore(directory)
+    assert sorted(store) == ["AAA", "BBB", "EMPTY"]
+    for ticker, data in tickers.items():
+        assert list(store[ticker]["candles"]) == data["candles"]
+    assert store["AAA"]["candles"][-1]["close"] == 2.0
+    assert list(store["AAA"]["candles"][1:]) == tickers["AAA"]["candles"][1:]
+    assert list(price_store.PriceData(directory)["AAA"]["candles"]) == tickers["AAA"]["candles"]
+
+
+def test_shared_ticker_is_read_from_its_most_recent_shard(tmp_path, make_candles):
+    directory = str(tmp_path)
+    price_store.write_shard("00", {"SPY": make_candles([1.0, 2.0])}, directory, shard_count=2)
+    price_store.write_shard("01", {"SPY": make_candles([1.0, 2.0, 3.0])}, directory, shard_count=2)
+    assert price_store.PriceStore(directory).location("SPY") == "01"
+    assert price_store.PriceStore(directory, tickers=["SPY"]).location("SPY") == "01"
+
+
+def test_since_higher_columns(tmp_path, make_candles):
+    closes = [5.0, 3.0, 4.0, 4.0, 6.0, 1.0, float("nan"), 2.0, 5.5]
+    volumes = [10, 30, 20, 20, 5, 40, 10, 35, 50]
+    price_store.write_shard("00", {"AAA": make_candles(closes, volumes=volumes)}, str(tmp_path))
+    prices = price_store.PriceStore(str(tmp_path))["AAA"]
+
+    expected_closes = brute_days_since_higher(closes)
+    assert price_store.column(prices, "close_since_higher").tolist() == expected_closes
+    assert price_store.column(prices, "volume_since_higher").tolist() == brute_days_since_higher(volumes)
+    # The legacy list of candle dicts derives the same column on the fly
+    assert price_store.column(make_candles(closes, volumes=volumes), "close_since_higher").tolist() == \
+        expected_closes
+
+
+def test_manifest_is_rebuilt_after_a_shard_write(tmp_path, make_candles):
+    directory = str(tmp_path)
+    price_store.write_shard("00", {"AAA": make_candles([1.0])}, directory, shard_count=2)
+    assert price_store.manifest(directory)["locations"] == {"AAA": "00"}
+    price_store.write_shard("01", {"BBB": make_candles([1.0])}, directory, shard_count=2)
+
+    assert price_store.manifest(directory)["locations"] == {"AAA": "00", "BBB": "01"}
+    assert price_store.verify(directory) == []
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_shard_count_comes_from_the_config():
+    assert price_store.SHARD_COUNT == config.cfg("SHARD_COUNT")
+
+
+def test_open_store_keeps_reading_its_data_while_a_shard_is_rewritten(tmp_path, make_candles):
+    directory = str(tmp_path)
+    old = {"AAA": make_candles([1.0, 2.0, 3.0, 4.0]), "BBB": make_candles([5.0, 6.0])}
+    price_store.write_shard("00", old, directory)
+    store = price_store.PriceStore(directory)
+
+    # Shorter columns, then a second refresh that removes the files the store was opened on
+    price_store.write_shard("00", {"BBB": make_candles([7.0])}, directory)
+    price_store.write_shard("00", {"AAA": make_candles([8.0]), "BBB": make_candles([9.0])}, directory)
+
+    for ticker, data in old.items():
+        assert list(store[ticker]["candles"]) == data["candles"]
+        assert price_store.column(store[ticker], "close_since_higher").tolist() == \
+            brute_days_since_higher([candle["close"] for candle in data["candles"]])
+    assert price_store.PriceStore(directory)["BBB"]["candles"][-1]["close"] == 9.0
+    assert len([name for name in os.listdir(os.path.join(directory, "00")) if name.endswith(".bin")]) == \
+        2 * len(price_store.DTYPES)
+    assert price_store.verify(directory) == []
+
+
+def test_migrate_replaces_letter_shards_with_hash_shards(tmp_path, make_candles):
+    data_directory = str(tmp_path / "data")
+    store_directory = str(tmp_path / "store")
+    price_store.write_json_shard("a", {"AAPL": make_candles([1.0]), "SPY": make_candles([1.0])}, data_directory)
+    price_store.write_json_shard("m", {"MSFT": make_candles([2.0]), "SPY": make_candles([1.0, 2.0])}, data_directory)
+    assert price_store.needs_reshard(4, data_directory)
+
+    price_store.reshard(4, store_directory, data_directory)
+
+    assert price_store.json_shard_names(data_directory) == ["00", "01", "02", "03"]
+    assert not price_store.needs_reshard(4, data_directory)
+    store = price_store.PriceStore(store_directory)
+    assert sorted(store) == ["AAPL", "MSFT", "SPY"]
+    assert store["SPY"]["candles"][-1]["close"] == 2.0
+    assert store.location("MSFT") == price_store.shard_name(price_store.shard_of("MSFT", 4))
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from scripts import rs_data
+from scripts import trading_calendar
+
+
+def scaled(data, ratio, digits=2):
+    """Candles of ``data`` with every price multiplied by ``ratio`` and rounded like yf.download(rounding=True)."""
+    return [dict(candle, **{field: round(candle[field] * ratio, digits) for field in ("open", "close", "low", "high")})
+            for candle in data["candles"]]
+
+
+def test_merge_prefers_fetched_candles(make_candles):
+    stored = make_candles([1.0, 2.0, 3.0])["candles"]
+    fetched = make_candles([3.5, 4.0], start="2024-01-04")["candles"]
+    merged = rs_data.merge_candles(stored, fetched)
+    assert [candle["close"] for candle in merged] == [1.0, 2.0, 3.5, 4.0]
+
+
+def test_unchanged_or_rounded_overlap_is_not_an_adjustment(make_candles):
+    stored = make_candles([100.0 + i for i in range(20)])
+    assert not rs_data.is_adjusted(stored["candles"], stored["candles"][-8:])
+    assert not rs_data.is_adjusted(stored["candles"], scaled(stored, 1.00004)[-8:])
+
+
+def test_split_is_an_adjustment(make_candles):
+    stored = make_candles([100.0 + i for i in range(20)])
+    assert rs_data.is_adjusted(stored["candles"], scaled(stored, 0.5)[-8:])
+
+
+def test_small_dividend_is_an_adjustment(make_candles):
+    stored = make_candles([100.0 + i for i in range(20)])
+    # 0.1% moves every bar by less than ADJUSTMENT_TOLERANCE, but by the same ratio
+    assert 0.001 < rs_data.ADJUSTMENT_TOLERANCE
+    fetched = scaled(stored, 0.999)[-8:]
+    assert rs_data.is_adjusted(stored["candles"], fetched)
+    # Also when the last stored bar was a provisional one that closed elsewhere
+    fetched[-1] = dict(fetched[-1], close=fetched[-1]["close"] + 0.15)
+    assert rs_data.is_adjusted(stored["candles"], fetched)
+
+
+def test_revised_last_bar_is_not_an_adjustment(make_candles):
+    stored = make_candles([100.0 + i for i in range(20)])
+    fetched = [dict(candle) for candle in stored["candles"][-8:]]
+    fetched[-1]["close"] += 0.1
+    assert not rs_data.is_adjusted(stored["candles"], fetched)
+
+
+def test_refresh_re_downloads_an_adjusted_history(make_candles, monkeypatch):
+    stored = make_candles([100.0 + i for i in range(20)])
+    full = {"candles": scaled(stored, 0.999)}
+    monkeypatch.setattr(rs_data, "get_yf_data", lambda ticker, start_date, end_date: full)
+
+    refreshed = rs_data.with_stored_history("AAA", {"candles": full["candles"][-8:]}, stored["candles"],
+                                            "2020-01-01", "2024-12-31")
+    assert refreshed is full
+
+    appended = make_candles([120.0, 121.0], start="2024-01-30")
+    overlap = {"candles": stored["candles"][-5:] + appended["candles"]}
+    refreshed = rs_data.with_stored_history("AAA", overlap, stored["candles"], "2020-01-01", "2024-12-31")
+    assert refreshed["candles"] == stored["candles"] + appended["candles"]
+
+
+def test_batch_reads_missing_tickers_from_the_frame(monkeypatch):
+    dates = pd.to_datetime(["2024-01-02", "2024-01-03"])
+    columns = pd.MultiIndex.from_product([["AAA", "EMPTY"], ["Open", "High", "Low", "Close", "Adj Close", "Volume"]])
+    df = pd.DataFrame([[1.0, 1.0, 1.0, 1.0, 1.0, 10] + [np.nan] * 6,
+                       [2.0, 2.0, 2.0, 2.0, 2.0, 20] + [np.nan] * 6], index=dates, columns=columns)
+    monkeypatch.setattr(rs_data.yf, "download", lambda *args, **kwargs: df, raising=False)
+
+    fetched, missing = rs_data.download_batch(["AAA", "EMPTY", "GONE"], "2024-01-01", "2024-01-04", None)
+
+    assert [candle["close"] for candle in fetched["AAA"]["candles"]] == [1.0, 2.0]
+    assert fetched["AAA"]["candles"][0]["datetime"] == trading_calendar.date_to_timestamp("2024-01-02")
+    assert missing == ["EMPTY", "GONE"]
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import rs_matrix
+from scripts import rs_ranking
+
+
+def sorted_frame(df):
+    return df.sort_values(rs_ranking.TITLE_TICKER).reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def matrix(price_universe):
+    return rs_matrix.build(price_universe)
+
+
+def test_matrix_equals_the_per_ticker_ranking(price_universe, matrix, old_ranking):
+    for day in range(150, len(matrix.dates), 60):
+        view = rs_ranking.filter_price_data_by_index(price_universe, int(matrix.timestamps[day]))
+        pd.testing.assert_frame_equal(sorted_frame(matrix.frame(matrix.dates[day])),
+                                      sorted_frame(old_ranking(view)), check_dtype=False)
+
+
+def test_window_equals_the_full_build(price_universe, matrix):
+    start = matrix.dates[-60]
+    window = rs_matrix.build(price_universe, start)
+    assert window.dates == matrix.dates[-60:]
+    np.testing.assert_array_equal(window.rs, matrix.rs[-60:])
+    np.testing.assert_array_equal(window.percentiles, matrix.percentiles[:, -60:])
+
+
+def test_saved_matrix_loads_back_exactly(tmp_path, matrix):
+    path = str(tmp_path / "rs_matrix.npz")
+    matrix.save(path)
+    loaded = rs_matrix.RSMatrix.load(path)
+    np.testing.assert_array_equal(loaded.rs, matrix.rs)
+    np.testing.assert_array_equal(loaded.percentiles, matrix.percentiles)
+    assert loaded.tickers == matrix.tickers
+    assert loaded.source_tickers == matrix.source_tickers
+
+
+def test_load_or_build_reuses_a_current_matrix(tmp_path, price_universe, matrix, monkeypatch):
+    path = str(tmp_path / "rs_matrix.npz")
+    matrix.save(path)
+    monkeypatch.setattr(rs_matrix, "build", lambda *args: pytest.fail("rebuilt a current matrix"))
+    assert rs_matrix.load_or_build(price_universe, path).dates == matrix.dates
+    assert rs_matrix.load_or_build(price_universe, path, matrix.dates[-60]).dates == matrix.dates
+
+
+def test_load_or_build_rebuilds_a_stale_matrix(tmp_path, price_universe, matrix):
+    path = str(tmp_path / "rs_matrix.npz")
+    rs_matrix.build(price_universe, matrix.dates[-20]).save(path)
+    # Does not cover the start date
+    assert rs_matrix.load_or_build(price_universe, path, matrix.dates[-60]).dates == matrix.dates[-60:]
+    # Built from other tickers
+    fewer = {ticker: data for ticker, data in price_universe.items() if ticker != matrix.tickers[0]}
+    assert matrix.tickers[0] not in rs_matrix.load_or_build(fewer, path).source_tickers
+
+
+def test_window_starts_on_its_date_west_of_utc(tmp_path, price_universe, matrix, monkeypatch, west_of_utc):
+    start = matrix.dates[-60]
+    assert rs_matrix.build(price_universe, start).dates == matrix.dates[-60:]
+    path = str(tmp_path / "rs_matrix.npz")
+    rs_matrix.build(price_universe, start).save(path)
+    monkeypatch.setattr(rs_matrix, "build", lambda *args: pytest.fail("rebuilt a current matrix"))
+    assert rs_matrix.load_or_build(price_universe, path, start).dates == matrix.dates[-60:]
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import price_store
+from scripts import rs_ranking
+from scripts import trading_calendar
+
+
+def sorted_frame(df):
+    return df.sort_values(rs_ranking.TITLE_TICKER).reset_index(drop=True)
+
+
+def test_rankings_frame_equals_the_per_ticker_ranking(price_universe, old_ranking):
+    calendar = trading_calendar.TradingCalendar.from_price_data(price_universe)
+    for day in (130, 250, len(calendar) - 1):
+        view = rs_ranking.filter_price_data_by_index(price_universe, calendar.timestamp_at(day))
+        pd.testing.assert_frame_equal(sorted_frame(rs_ranking.rankings_frame(view)), sorted_frame(old_ranking(view)),
+                                      check_dtype=False)
+
+
+def test_rankings_frame_reads_the_columnar_store(price_universe):
+    columnar = price_store.columnar(price_universe)
+    pd.testing.assert_frame_equal(rs_ranking.rankings_frame(columnar), rs_ranking.rankings_frame(price_universe))
+
+
+def test_strength_matrix_equals_strength_of_short_histories():
+    width = 300
+    histories = [np.linspace(12, 20, width), np.linspace(50, 40, 200), np.linspace(5, 6, 70), np.array([3.0])]
+    closes = np.full((len(histories), width), np.nan)
+    for i, history in enumerate(histories):
+        closes[i, width - len(history):] = history
+    strengths = rs_ranking.strength_matrix(closes)
+    for i, history in enumerate(histories):
+        for j, lookback in enumerate(rs_ranking.RS_LOOKBACKS):
+            expected = rs_ranking.strength(pd.Series(history[:max(0, len(history) - lookback)]))
+            assert strengths[i, j] == pytest.approx(expected)
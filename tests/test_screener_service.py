@@ -0,0 +1,58 @@
+import pytest
+
+from scripts import fundamentals
+from scripts import rs_ranking
+from scripts import rs_store
+from scripts import screener_service
+from scripts import trading_calendar
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch, price_universe):
+    store = rs_store.RSStore(str(tmp_path / "rs_history.sqlite"))
+    monkeypatch.setattr(rs_store, "_STORE", store)
+    monkeypatch.setattr(fundamentals, "LEGACY_CACHE_FILE", str(tmp_path / "_market_cap_cache.json"))
+    monkeypatch.setattr(fundamentals, "CACHE", fundamentals.FundamentalsCache(str(tmp_path / "cache.jsonl")))
+    monkeypatch.setattr(fundamentals, "prefetch", lambda *args: pytest.fail("fetched fundamentals"))
+    monkeypatch.setattr(fundamentals, "get", lambda *args: pytest.fail("fetched fundamentals"))
+    monkeypatch.setattr(rs_ranking, "load_data", lambda: price_universe)
+    monkeypatch.setattr(screener_service, "stale_shards", lambda: [])
+    monkeypatch.setattr(screener_service, "data_signature", lambda: {})
+    data = screener_service.ResidentData(poll=3600)
+    yield data
+    data.worker.shutdown()
+
+
+def day(data):
+    return trading_calendar.timestamp_to_date(data.calendar.timestamps[-1])
+
+
+def stored_count(data, date):
+    # The store's connection belongs to the worker thread
+    return data.run(lambda: rs_store.open_store().count(date))
+
+
+def test_rank_does_not_write_the_store(data):
+    body = data.rank({"date": day(data), "top": "5"})
+    assert len(body["ranking"]) == 5
+    assert stored_count(data, body["date"]) == 0
+
+
+def test_rank_matches_the_stored_ranking(data):
+    view = data.as_of(day(data))[1]
+    stored = data.run(lambda: rs_ranking.rankings(view, day(data))[0])
+    body = data.rank({"date": day(data)})
+    assert [row["Ticker"] for row in body["ranking"]] == stored["Ticker"].tolist()
+
+
+def test_screen_uses_cached_fundamentals_only(data):
+    body = data.screen({"date": day(data)})
+    assert body["results"]
+    assert stored_count(data, body["date"]) == 0
+
+
+def test_history_keeps_the_candles_of_both_dates_west_of_utc(data, west_of_utc):
+    datetimes = [candle["datetime"] for candle in data.PRICE_DATA[rs_ranking.REFERENCE_TICKER]["candles"]]
+    start, end = (trading_calendar.timestamp_to_date(ts) for ts in (datetimes[-10], datetimes[-5]))
+    body = data.history({"ticker": rs_ranking.REFERENCE_TICKER, "start": start, "end": end})
+    assert [candle["datetime"] for candle in body["candles"]] == datetimes[-10:-4]
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from scripts import simulate_timeline
+from scripts import trading_calendar
+
+
+def test_split_cash_buys_every_signal_of_the_day(make_candles):
+    PRICE_DATA = {ticker: make_candles([10.0] * 10) for ticker in ("SPY", "AAA", "BBB", "CCC")}
+    date = trading_calendar.timestamp_to_date(PRICE_DATA["SPY"]["candles"][2]["datetime"])
+    sell_date = trading_calendar.timestamp_to_date(PRICE_DATA["SPY"]["candles"][5]["datetime"])
+    trades = pd.DataFrame({"Ticker": ["AAA", "BBB", "CCC"], "Date": [date] * 3, "Sell Date": [sell_date] * 3})
+
+    equity_curve, actions, summary = simulate_timeline.simulate_portfolio(PRICE_DATA, trades, initial_cash=100)
+
+    assert summary["trades"] == 3
+    assert summary["skipped"] == 0
+    assert [action for _, action, *_ in actions].count("Buy") == 3
+    assert equity_curve["Cash"].min() >= 0
+    assert summary["final_equity"] == pytest.approx(100)
+
+
+def test_flat_curve_reports_no_drawdown(make_candles):
+    PRICE_DATA = {ticker: make_candles([10.0] * 5) for ticker in ("SPY", "AAA")}
+    date = trading_calendar.timestamp_to_date(PRICE_DATA["SPY"]["candles"][1]["datetime"])
+    trades = pd.DataFrame({"Ticker": ["AAA"], "Date": [date], "Sell Date": [""]})
+
+    _, _, summary = simulate_timeline.simulate_portfolio(PRICE_DATA, trades)
+
+    assert str(summary["max_drawdown"]) == "0.0"
+
+
+def test_trades_enter_and_exit_on_their_dates_west_of_utc(make_candles, west_of_utc):
+    PRICE_DATA = {"SPY": make_candles([10.0] * 6), "AAA": make_candles([10.0, 11.0, 12.0, 13.0, 14.0, 15.0])}
+    trades = pd.DataFrame({"Ticker": ["AAA"], "Date": ["2024-01-03"], "Sell Date": ["2024-01-05"]})
+
+    _, actions, summary = simulate_timeline.simulate_portfolio(PRICE_DATA, trades, initial_cash=100)
+
+    assert [(trading_calendar.timestamp_to_date(ts), action) for ts, action, *_ in actions] == \
+        [("2024-01-03", "Buy"), ("2024-01-05", "Sell")]
+    assert summary["final_equity"] == pytest.approx(100 * 13 / 11)
@@ -0,0 +1,50 @@
+import pytest
+
+from scripts import rs_data
+from scripts import yahoo_stub
+
+CHART_URL = "https://query2.finance.yahoo.com/v8/finance/chart/AAA"
+
+
+class RecordingStubSession(rs_data.RecordingSession, rs_data.StubSession):
+    """Records what a synthetic yahoo_stub answers, standing in for Yahoo itself."""
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(state):
+        server = yahoo_stub.serve(port=0, state=state)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cassette_key_ignores_crumb_and_chart_window():
+    key = yahoo_stub.cassette_key("get", CHART_URL + "?interval=1d&crumb=a", {"period1": 1, "events": "div"})
+    assert key == yahoo_stub.cassette_key("GET", CHART_URL, {"events": "div", "interval": "1d", "period2": 2})
+    assert key != yahoo_stub.cassette_key("GET", CHART_URL, {"events": "div", "interval": "1wk"})
+
+
+def test_replays_recorded_responses(tmp_path, stub):
+    live_url = stub(yahoo_stub.StubState(days=60))
+    recorder = RecordingStubSession(str(tmp_path), base_url=live_url)
+    params = {"period1": 0, "period2": 2 ** 31, "interval": "1d", "crumb": "a"}
+    recorded = recorder.get(CHART_URL, params=params)
+    assert recorded.status_code == 200
+    assert len(recorded.json()["chart"]["result"][0]["timestamp"]) == 60
+
+    state = yahoo_stub.StubState(cassettes=yahoo_stub.load_cassettes(str(tmp_path)))
+    session = rs_data.StubSession(stub(state))
+    replayed = session.get(CHART_URL, params=dict(params, period1=1000, crumb="b"))
+    assert replayed.status_code == 200
+    assert replayed.json() == recorded.json()
+
+    missing = session.get(CHART_URL.replace("AAA", "BBB"), params=params)
+    assert missing.status_code == 404
+    assert state.stats["not_recorded"] == 1